@@ -94,7 +94,8 @@ def str_highlight_day(
 
 def str_week(week, today, collection=None,
              hmethod=None, default_color=None, multiple=None, color=None,
-             highlight_event_days=False, locale=None, bold_for_light_color=True):
+             highlight_event_days=False, locale=None, bold_for_light_color=True,
+             day_calendars=None):
     """returns a string representing one week,
     if for day == today color is reversed
 
@@ -102,6 +103,10 @@ def str_week(week, today, collection=None,
     :type day: list()
     :param today: the date of today
     :type today: datetime.date
+    :param day_calendars: the calendars with events on each day of `week`,
+        as returned by `collection.get_calendars_between`, if not given the
+        collection is asked for every day
+    :type day_calendars: dict
     :return: string, which if printed on terminal appears to have length 20,
              but may contain ascii escape sequences
     :rtype: str
@@ -111,7 +116,10 @@ def str_week(week, today, collection=None,
         if day == today:
             day = style(str(day.day).rjust(2), reverse=True)
         elif highlight_event_days:
-            devents = list(collection.get_calendars_on(day))
+            if day_calendars is not None:
+                devents = sorted(day_calendars[day])
+            else:
+                devents = collection.get_calendars_on(day)
             if len(devents) > 0:
                 day = str_highlight_day(day, devents, hmethod, default_color,
                                         multiple, color, bold_for_light_color, collection)
@@ -172,6 +180,13 @@ def vertical_month(month=None,
     month_abbr_len = get_month_abbr_len()
     khal.append(style(' ' * month_abbr_len + weekheaders + ' ' + w_number, bold=True))
     _calendar = calendar.Calendar(firstweekday)
+    day_calendars = None
+    if highlight_event_days:
+        last_year, last_month = divmod(year * 12 + month - 1 + count - 1, 12)
+        day_calendars = collection.get_calendars_between(
+            _calendar.monthdatescalendar(year, month)[0][0],
+            _calendar.monthdatescalendar(last_year, last_month + 1)[-1][-1],
+        )
     for _ in range(count):
         for week in _calendar.monthdatescalendar(year, month):
             if monthdisplay == 'firstday':
@@ -179,7 +194,8 @@ def vertical_month(month=None,
             else:
                 new_month = len(week if week[0].day <= 7 else [])
             strweek = str_week(week, today, collection, hmethod, default_color,
-                               multiple, color, highlight_event_days, locale, bold_for_light_color)
+                               multiple, color, highlight_event_days, locale, bold_for_light_color,
+                               day_calendars)
             if new_month:
                 m_name = style(calendar.month_abbr[week[6].month].ljust(month_abbr_len), bold=True)
             elif weeknumber == 'left':
@@ -29,7 +29,7 @@ from shutil import get_terminal_size
 import click
 import click_log
 
-from . import __version__, controllers, khalendar
+from . import __version__
 from .exceptions import FatalError
 from .settings import InvalidSettingsError, get_config
 from .settings.exceptions import NoConfigFile
@@ -123,6 +123,12 @@ def global_options(f):
     def logfile_callback(ctx, option, path):
         ctx.logfilepath = path
 
+    def jobs_callback(ctx, option, jobs):
+        ctx.jobs = jobs
+
+    def refresh_callback(ctx, option, refresh):
+        ctx.refresh = refresh
+
     config = click.option(
         '--config', '-c',
         help='The config file to use.',
@@ -146,13 +152,46 @@ def global_options(f):
         metavar='LOGFILE',
     )
 
+    jobs = click.option(
+        '--jobs', '-j',
+        help=('The number of processes used to parse events when updating the '
+              'database [defaults to the configured value]'),
+        type=click.IntRange(min=1),
+        callback=jobs_callback,
+        default=None,
+        expose_value=False,
+        metavar='N',
+    )
+
+    refresh = click.option(
+        '--refresh/--no-refresh',
+        help=('Check the vdirs for changes before reading the database, '
+              'always or only if it is older than the configured maximal age '
+              '[defaults to the configured value]'),
+        callback=refresh_callback,
+        default=None,
+        expose_value=False,
+    )
+
     version = click.version_option(version=__version__)
 
-    return logfile(config(color(version(f))))
+    return refresh(jobs(logfile(config(color(version(f))))))
+
 
+def build_collection(conf, selection, update=True, read_only=False):
+    """build and return a khalendar.CalendarCollection from the configuration
 
-def build_collection(conf, selection):
-    """build and return a khalendar.CalendarCollection from the configuration"""
+    :param update: if False, the collection's db is not updated from the
+        vdirs yet
+    :param read_only: if True, the command won't change any events and the
+        db can be trusted if it was checked recently, see `max_cache_age`
+    """
+    ctx = click.get_current_context(silent=True)
+    if read_only and ctx is not None and 'daemon' in (ctx.obj or {}):
+        # running in `khal daemon`, which already has the collection
+        return ctx.obj['daemon'].collection(conf, selection)
+
+    from . import khalendar
     try:
         props = dict()
         for name, cal in conf['calendars'].items():
@@ -169,6 +208,10 @@ def build_collection(conf, selection):
             color=conf['highlight_days']['color'],
             locale=conf['locale'],
             dbpath=conf['sqlite']['path'],
+            horizon=conf['sqlite']['recurrence_horizon'],
+            jobs=conf['sqlite']['jobs'],
+            update=update,
+            max_cache_age=conf['sqlite']['max_cache_age'] if read_only else None,
             hmethod=conf['highlight_days']['method'],
             default_color=conf['highlight_days']['default_color'],
             multiple=conf['highlight_days']['multiple'],
@@ -192,7 +235,7 @@ class _NoConfig(object):
 
 
 def prepare_context(ctx, config):
-    assert ctx.obj is None
+    assert ctx.obj is None or 'conf' not in ctx.obj
 
     logger.debug('khal %s' % __version__)
     try:
@@ -204,10 +247,43 @@ def prepare_context(ctx, config):
                     'look at the Changelog to see what changed.')
         sys.exit(1)
     else:
+        if ctx.jobs is not None:
+            conf['sqlite']['jobs'] = ctx.jobs
+        if ctx.refresh is not None:
+            # without refreshing, any db that was checked once is trusted
+            conf['sqlite']['max_cache_age'] = None if ctx.refresh else dt.timedelta.max
         logger.debug('Using config:')
         logger.debug(stringify_conf(conf))
 
-    ctx.obj = {'conf_path': config, 'conf': conf}
+    ctx.obj = dict(ctx.obj or {}, conf_path=config, conf=conf)
+
+
+def forward_to_daemon(ctx, config):
+    """run the invoked command in `khal daemon`, if it is running and the
+    command only reads events, and exit"""
+    from . import daemon
+    from .settings.settings import find_configuration_file, referenced_environ
+    if ctx.invoked_subcommand not in daemon.COMMANDS or 'daemon' in ctx.obj or \
+            ctx.logfilepath or isinstance(ctx.obj['conf'], _NoConfig):
+        return
+    args = ['--verbosity', logging.getLevelName(logger.level)]
+    if config is not None:
+        args += ['--config', os.path.abspath(config)]
+    color = ctx.color if ctx.color is not None else sys.stdout.isatty()
+    args.append('--color' if color else '--no-color')
+    if ctx.refresh is not None:
+        args.append('--refresh' if ctx.refresh else '--no-refresh')
+    try:
+        # the daemon's paths are only the same if these variables are, too
+        names = referenced_environ(config if config is not None else find_configuration_file())
+    except (OSError, UnicodeDecodeError):
+        return
+    try:
+        exit_code = daemon.forward(ctx.obj['conf'], args + ctx.command_args, names)
+    except BrokenPipeError:
+        _exit_on_broken_pipe()
+    if exit_code is not None:
+        ctx.exit(exit_code)
 
 
 def stringify_conf(conf):
@@ -226,8 +302,32 @@ def stringify_conf(conf):
     return '\n'.join(out)
 
 
+def echo_rows(rows):
+    """print `rows` as soon as they are generated, exit when they cannot be
+    written anymore (e.g., when piped into `head`)"""
+    try:
+        for row in rows:
+            click.echo(row)
+    except BrokenPipeError:
+        _exit_on_broken_pipe()
+
+
+def _exit_on_broken_pipe():
+    # Python would complain about the broken pipe again when flushing stdout
+    # on exit
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    sys.exit(1)
+
+
+class _KhalGroup(click.Group):
+    def invoke(self, ctx):
+        # the subcommand and its arguments, for `forward_to_daemon`
+        ctx.command_args = getattr(ctx, 'protected_args', []) + ctx.args
+        return super().invoke(ctx)
+
+
 def _get_cli():
-    @click.group()
+    @click.group(cls=_KhalGroup)
     @click_log.simple_verbosity_option('khal')
     @global_options
     @click.pass_context
@@ -240,6 +340,7 @@ def _get_cli():
             logger = logging.getLogger('khal')
             logger.handlers = [logging.FileHandler(ctx.logfilepath)]
         prepare_context(ctx, config)
+        forward_to_daemon(ctx, config)
 
     @cli.command()
     @multi_calendar_option
@@ -258,11 +359,13 @@ def _get_cli():
     def calendar(ctx, include_calendar, exclude_calendar, daterange, once,
                  notstarted, format, day_format):
         '''Print calendar with agenda.'''
+        from . import controllers
         try:
             rows = controllers.calendar(
                 build_collection(
                     ctx.obj['conf'],
-                    multi_calendar_select(ctx, include_calendar, exclude_calendar)
+                    multi_calendar_select(ctx, include_calendar, exclude_calendar),
+                    read_only=True,
                 ),
                 agenda_format=format,
                 day_format=day_format,
@@ -282,7 +385,7 @@ def _get_cli():
                 bold_for_light_color=ctx.obj['conf']['view']['bold_for_light_color'],
                 env={"calendars": ctx.obj['conf']['calendars']}
             )
-            click.echo('\n'.join(rows))
+            echo_rows(rows)
         except FatalError as error:
             logger.debug(error, exc_info=True)
             logger.fatal(error)
@@ -307,11 +410,13 @@ def _get_cli():
               daterange, once, notstarted, format, day_format):
         """List all events between a start (default: today) and (optional)
         end datetime."""
+        from . import controllers
         try:
-            event_column = controllers.khal_list(
+            event_column = controllers.iter_khal_list(
                 build_collection(
                     ctx.obj['conf'],
-                    multi_calendar_select(ctx, include_calendar, exclude_calendar)
+                    multi_calendar_select(ctx, include_calendar, exclude_calendar),
+                    read_only=True,
                 ),
                 agenda_format=format,
                 day_format=day_format,
@@ -321,7 +426,7 @@ def _get_cli():
                 conf=ctx.obj['conf'],
                 env={"calendars": ctx.obj['conf']['calendars']}
             )
-            click.echo('\n'.join(event_column))
+            echo_rows(event_column)
         except FatalError as error:
             logger.debug(error, exc_info=True)
             logger.fatal(error)
@@ -378,6 +483,7 @@ def _get_cli():
                     'No default calendar is configured, '
                     'please provide one explicitly.'
                 )
+        from . import controllers
         try:
             new_func = controllers.new_from_string
             if interactive:
@@ -423,6 +529,7 @@ def _get_cli():
         each calendar's name or any unique prefix of a calendar's name.
 
         '''
+        from . import controllers
         if include_calendar:
             ctx.obj['calendar_selection'] = {include_calendar, }
         collection = build_collection(ctx.obj['conf'], ctx.obj.get('calendar_selection', None))
@@ -463,8 +570,10 @@ def _get_cli():
     @click.pass_context
     def interactive(ctx, include_calendar, exclude_calendar):
         '''Interactive UI. Also launchable via `ikhal`.'''
+        from . import controllers
         controllers.interactive(
-            build_collection(ctx.obj['conf'], ctx.obj.get('calendar_selection', None)),
+            build_collection(
+                ctx.obj['conf'], ctx.obj.get('calendar_selection', None), update=False),
             ctx.obj['conf']
         )
 
@@ -475,10 +584,12 @@ def _get_cli():
     def interactive_cli(ctx, config, include_calendar, exclude_calendar):
         '''Interactive UI. Also launchable via `khal interactive`.'''
         prepare_context(ctx, config)
+        from . import controllers
         controllers.interactive(
             build_collection(
                 ctx.obj['conf'],
-                multi_calendar_select(ctx, include_calendar, exclude_calendar)
+                multi_calendar_select(ctx, include_calendar, exclude_calendar),
+                update=False,
             ),
             ctx.obj['conf']
         )
@@ -491,7 +602,8 @@ def _get_cli():
         try:
             click.echo('\n'.join(build_collection(
                 ctx.obj['conf'],
-                multi_calendar_select(ctx, include_calendar, exclude_calendar)
+                multi_calendar_select(ctx, include_calendar, exclude_calendar),
+                read_only=True,
             ).names))
         except FatalError as error:
             logger.debug(error, exc_info=True)
@@ -527,6 +639,7 @@ def _get_cli():
         '''Print an ics file (or read from stdin) without importing it.
 
         Just print the ics file, do nothing else.'''
+        from . import controllers
         try:
             if ics:
                 ics_str = ics.read()
@@ -551,6 +664,10 @@ def _get_cli():
 
         For recurring events, only the master event and different overwritten
         events are shown.
+
+        Every word needs to match the beginning of a word in an event's
+        summary, description, location, categories or attendees, words like
+        location:berlin only match in that field.
         '''
         # TODO support for time ranges, location, description etc
         if format is None:
@@ -558,7 +675,8 @@ def _get_cli():
         try:
             collection = build_collection(
                 ctx.obj['conf'],
-                multi_calendar_select(ctx, include_calendar, exclude_calendar)
+                multi_calendar_select(ctx, include_calendar, exclude_calendar),
+                read_only=True,
             )
             events = sorted(collection.search(search_string))
             event_column = list()
@@ -588,6 +706,7 @@ def _get_cli():
     @click.pass_context
     def edit(ctx, format, search_string, show_past, include_calendar, exclude_calendar):
         '''Interactively edit (or delete) events matching the search string.'''
+        from . import controllers
         try:
             controllers.edit(
                 build_collection(
@@ -617,13 +736,15 @@ def _get_cli():
     @click.pass_context
     def at(ctx, datetime, notstarted, format, day_format, include_calendar, exclude_calendar):
         '''Print all events at a specific datetime (defaults to now).'''
+        from . import controllers
         if not datetime:
             datetime = ("now",)
         try:
-            rows = controllers.khal_list(
+            rows = controllers.iter_khal_list(
                 build_collection(
                     ctx.obj['conf'],
-                    multi_calendar_select(ctx, include_calendar, exclude_calendar)
+                    multi_calendar_select(ctx, include_calendar, exclude_calendar),
+                    read_only=True,
                 ),
                 agenda_format=format,
                 day_format=day_format,
@@ -633,12 +754,27 @@ def _get_cli():
                 conf=ctx.obj['conf'],
                 env={"calendars": ctx.obj['conf']['calendars']}
             )
-            click.echo('\n'.join(rows))
+            echo_rows(rows)
         except FatalError as error:
             logger.debug(error, exc_info=True)
             logger.fatal(error)
             sys.exit(1)
 
+    @cli.command()
+    @click.pass_context
+    def daemon(ctx):
+        '''Serve the commands that only read events for other khal processes.
+
+        Keeps the calendars in memory and their cache up to date while the
+        vdirs change, `list`, `at`, `search` and `calendar` then run in the
+        daemon, if it is running.'''
+        from .daemon import serve, socket_path
+        try:
+            serve(ctx.obj['conf'])
+        except OSError as error:
+            logger.fatal('cannot serve at {}: {}'.format(socket_path(ctx.obj['conf']), error))
+            sys.exit(1)
+
     @cli.command()
     @click.pass_context
     def configure(ctx):
@@ -37,7 +37,7 @@ from khal.khalendar.exceptions import DuplicateUid, ReadOnlyCalendarError
 
 from .exceptions import ConfigurationError
 from .khalendar.vdir import Item
-from .terminal import merge_columns
+from .terminal import iter_merge_columns
 from .utils import cal_from_ics
 
 logger = logging.getLogger('khal')
@@ -92,7 +92,7 @@ def calendar(collection, agenda_format=None, notstarted=False, once=False, dater
     except ValueError as error:
         raise FatalError(error)
 
-    event_column = khal_list(
+    event_column = iter_khal_list(
         collection,
         daterange,
         conf=conf,
@@ -117,7 +117,7 @@ def calendar(collection, agenda_format=None, notstarted=False, once=False, dater
         highlight_event_days=highlight_event_days,
         locale=locale,
         bold_for_light_color=bold_for_light_color)
-    return merge_columns(calendar_column, event_column, width=lwidth)
+    return iter_merge_columns(calendar_column, event_column, width=lwidth)
 
 
 def start_end_from_daterange(daterange, locale,
@@ -166,11 +166,6 @@ def get_events_between(
     :returns: a list to be printed as the agenda for the given days
     :rtype: list(str)
     """
-    assert not (notstarted and not original_start)
-
-    event_list = []
-    if env is None:
-        env = {}
     assert start
     assert end
     start_local = locale['local_timezone'].localize(start)
@@ -181,7 +176,20 @@ def get_events_between(
 
     events = sorted(collection.get_localized(start_local, end_local))
     events_float = sorted(collection.get_floating(start, end))
-    events = sorted(events + events_float)
+    return format_events(
+        sorted(events + events_float), start, end, agenda_format=agenda_format,
+        notstarted=notstarted, env=env, width=width, seen=seen, original_start=original_start)
+
+
+def format_events(events, start, end, agenda_format=None, notstarted=False,
+                  env=None, width=None, seen=None, original_start=None):
+    """format `events`, found between `start` and `end`, see
+    `get_events_between` for the parameters"""
+    assert not (notstarted and not original_start)
+
+    event_list = []
+    if env is None:
+        env = {}
     for event in events:
         # yes the logic could be simplified, but I believe it's easier
         # to understand what's going on here this way
@@ -208,11 +216,17 @@ def get_events_between(
     return event_list
 
 
-def khal_list(collection, daterange=None, conf=None, agenda_format=None,
-              day_format=None, once=False, notstarted=False, width=False,
-              env=None, datepoint=None):
+def khal_list(*args, **kwargs):
+    """returns a list of all events in `daterange`, see `iter_khal_list`"""
+    return list(iter_khal_list(*args, **kwargs))
+
+
+def iter_khal_list(collection, daterange=None, conf=None, agenda_format=None,
+                   day_format=None, once=False, notstarted=False, width=False,
+                   env=None, datepoint=None):
+    """yields the lines listing all events in `daterange` (or at `datepoint`),
+    one day at a time"""
     assert daterange is not None or datepoint is not None
-    """returns a list of all events in `daterange`"""
     # because empty strings are also Falsish
     if agenda_format is None:
         agenda_format = conf['view']['agenda_event_format']
@@ -247,32 +261,29 @@ def khal_list(collection, daterange=None, conf=None, agenda_format=None,
             )
         logger.debug('Getting all events between {} and {}'.format(start, end))
 
-    event_column = []
+    empty = True
     once = set() if once else None
     if env is None:
         env = {}
 
     original_start = conf['locale']['local_timezone'].localize(start)
-    while start < end:
-        if start.date() == end.date():
-            day_end = end
-        else:
-            day_end = dt.datetime.combine(start.date(), dt.time.max)
-        current_events = get_events_between(
-            collection, locale=conf['locale'], agenda_format=agenda_format, start=start,
-            end=day_end, notstarted=notstarted, original_start=original_start,
+    for day_start, day_end, events in collection.get_events_by_day(start, end):
+        current_events = format_events(
+            events, day_start, day_end, agenda_format=agenda_format,
+            notstarted=notstarted, original_start=original_start,
             env=env,
             seen=once,
             width=width,
         )
         if day_format and (conf['default']['show_all_days'] or current_events):
-            event_column.append(format_day(start.date(), day_format, conf['locale']))
-        event_column.extend(current_events)
-        start = dt.datetime(*start.date().timetuple()[:3]) + dt.timedelta(days=1)
-
-    if event_column == []:
-        event_column = [style('No events', bold=True)]
-    return event_column
+            empty = False
+            yield format_day(day_start.date(), day_format, conf['locale'])
+        if current_events:
+            empty = False
+            yield from current_events
+
+    if empty:
+        yield style('No events', bold=True)
 
 
 def new_interactive(collection, calendar_name, conf, info, location=None,
@@ -0,0 +1,303 @@
+# Copyright (c) 2013-2017 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+`khal daemon` keeps the collections of calendars (and the events parsed so
+far) in memory, keeps their db up to date while the vdirs change and runs the
+commands that only read events for other khal processes, which forward them
+over a Unix domain socket next to the db.
+
+Each request is a JSON object with the command line to run (`args`), the
+size of the client's terminal and the client's `environ` (see ENVIRON and
+`forward`), the response one with the command's output (`stdout` and `stderr`) and
+`exit_code`.
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import selectors
+import shutil
+import signal
+import socket
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple  # noqa
+
+import click
+
+logger = logging.getLogger('khal')
+
+# the commands forwarded to the daemon
+COMMANDS = ['list', 'at', 'search', 'calendar']
+
+# seconds a client waits for the daemon before running the command itself
+TIMEOUT = 30
+
+# seconds the daemon waits for a client to send its request (or read the
+# response), it serves no other clients meanwhile
+CLIENT_TIMEOUT = 5
+
+# the most collections (for different calendar selections or configs) kept
+MAX_COLLECTIONS = 8
+
+# besides the terminal's size, the output of a command depends on these
+# environment variables (and those starting with LC_), which decide where the
+# config is found, the paths in it, the local timezone and the locale, and on
+# those referenced in the config file; the daemon only runs commands for
+# clients with the same values as its own
+ENVIRON = ['HOME', 'XDG_CONFIG_HOME', 'XDG_CONFIG_DIRS', 'XDG_DATA_HOME', 'TZ',
+           'LANG', 'LANGUAGE']
+
+
+def socket_path(conf: Dict[str, Any]) -> str:
+    return conf['sqlite']['path'] + '-daemon.sock'
+
+
+def _environ(names: Iterable[str]=()) -> Dict[str, Optional[str]]:
+    """the values of the environment variables in ENVIRON and `names`, None
+    for those of `names` which are not set"""
+    environ = {name: os.environ.get(name) for name in names}
+    environ.update((name, value) for name, value in os.environ.items()
+                   if name in ENVIRON or name.startswith('LC_'))
+    return environ
+
+
+def _different_environ(environ: Dict[str, Optional[str]]) -> List[str]:
+    """the names of the variables whose values in the client's `environ`
+    differ from this process' (see ENVIRON)"""
+    own = _environ(environ)
+    return sorted(name for name in set(environ) | set(own) if environ.get(name) != own.get(name))
+
+
+def _receive(connection: socket.socket) -> Any:
+    """read a JSON object until the other side shuts down writing"""
+    data = list()
+    while True:
+        chunk = connection.recv(64 * 1024)
+        if not chunk:
+            break
+        data.append(chunk)
+    return json.loads(b''.join(data).decode('utf-8'))
+
+
+def _send(connection: socket.socket, obj: Any) -> None:
+    connection.sendall(json.dumps(obj).encode('utf-8'))
+    connection.shutdown(socket.SHUT_WR)
+
+
+def forward(conf: Dict[str, Any], args: List[str], names: Iterable[str]=()) -> Optional[int]:
+    """run khal with `args` in the daemon, if it is running, and print its
+    output
+
+    :param names: the environment variables the config file references,
+        the daemon only runs the command if their values are its own
+
+    :returns: the command's exit code, or None if the daemon isn't running
+        (or failed), then the command should be run in this process
+    """
+    path = socket_path(conf)
+    if not os.path.exists(path):
+        return None
+    columns, lines = shutil.get_terminal_size()
+    request = {'args': args, 'columns': columns, 'lines': lines, 'environ': _environ(names)}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(TIMEOUT)
+            client.connect(path)
+            _send(client, request)
+            response = _receive(client)
+    except (OSError, ValueError) as error:
+        logger.debug('cannot use the daemon at {}: {}'.format(path, error))
+        return None
+    if 'error' in response:
+        logger.debug('the daemon failed: {}'.format(response['error']))
+        return None
+    # the daemon already stripped the colors if necessary
+    click.echo(response['stderr'], nl=False, err=True, color=True)
+    click.echo(response['stdout'], nl=False, color=True)
+    return response['exit_code']
+
+
+class Server(object):
+    """the daemon, serving the commands forwarded by `forward`"""
+
+    def __init__(self, conf: Dict[str, Any]) -> None:
+        self._path = socket_path(conf)
+        self._selector = selectors.DefaultSelector()
+        # (key, collection, watcher), most recently used last
+        self._collections = list()  # type: List[Tuple[tuple, Any, Any]]
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._bind()
+        except Exception:
+            self._socket.close()
+            raise
+        self._selector.register(self._socket, selectors.EVENT_READ)
+
+    def _bind(self) -> None:
+        if os.path.exists(self._path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as other:
+                    other.connect(self._path)
+            except ConnectionRefusedError:
+                # left behind by a daemon that was killed
+                os.remove(self._path)
+            else:
+                raise click.ClickException(
+                    'khal daemon is already running at {}'.format(self._path))
+        # only accessible by this user, from the moment it's created
+        umask = os.umask(0o177)
+        try:
+            self._socket.bind(self._path)
+        finally:
+            os.umask(umask)
+        self._socket.listen(16)
+
+    def close(self) -> None:
+        for _, _, watcher in self._collections:
+            if watcher is not None:
+                watcher.close()
+        self._collections = list()
+        self._selector.close()
+        self._socket.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path)
+
+    def serve_forever(self) -> None:
+        logger.info('khal daemon listening at {}'.format(self._path))
+        while True:
+            for key, _ in self._selector.select():
+                if key.fileobj is self._socket:
+                    connection, _ = self._socket.accept()
+                    connection.settimeout(CLIENT_TIMEOUT)
+                    with connection:
+                        self._handle(connection)
+                else:
+                    self._update(key.data, key.fileobj)
+
+    def _handle(self, connection: socket.socket) -> None:
+        try:
+            request = _receive(connection)
+            different = _different_environ(request.get('environ', {}))
+            if different:
+                # the command might print something else here, the client
+                # runs it itself
+                response = {'error': 'the client has a different {}'.format(', '.join(different))}
+            else:
+                try:
+                    response = self._run(request)
+                except Exception as error:
+                    logger.exception('running `{}` failed'.format(' '.join(request['args'])))
+                    response = {'error': str(error)}
+            _send(connection, response)
+        except socket.timeout:
+            logger.warning('dropped a client which did not send its request or read the '
+                           'response in time')
+        except (OSError, ValueError) as error:
+            logger.warning('lost the connection to a client: {}'.format(error))
+
+    def _run(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """run khal with the request's arguments, as if it was run by the
+        client"""
+        from .cli import main_khal
+        logger.debug('running `{}`'.format(' '.join(request['args'])))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        environ = dict(os.environ)
+        level = logger.level
+        os.environ.update(COLUMNS=str(request['columns']), LINES=str(request['lines']))
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    main_khal.main(request['args'], prog_name='khal', standalone_mode=False,
+                                   obj={'daemon': self})
+                    exit_code = 0
+                except click.ClickException as error:
+                    error.show()
+                    exit_code = error.exit_code
+                except click.Abort:
+                    click.echo('Aborted!', err=True)
+                    exit_code = 1
+                except SystemExit as error:
+                    exit_code = error.code or 0
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            logger.setLevel(level)
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'exit_code': exit_code}
+
+    def collection(self, conf: Dict[str, Any], selection: Optional[set]):
+        """return an up to date collection of the calendars in `selection`,
+        kept for later requests"""
+        from .cli import build_collection
+        from .khalendar.watcher import WatcherUnavailable
+        key = (selection, conf['calendars'], conf['locale'], conf['highlight_days'],
+               conf['default'], conf['sqlite']['path'], conf['sqlite']['recurrence_horizon'])
+        for index, (other, collection, watcher) in enumerate(self._collections):
+            if other == key:
+                self._collections.append(self._collections.pop(index))
+                break
+        else:
+            collection = build_collection(conf, selection, update=False)
+            try:
+                watcher = collection.watch()
+            except WatcherUnavailable as error:
+                logger.debug('cannot watch the vdirs: {}'.format(error))
+                watcher = None
+            else:
+                self._selector.register(watcher, selectors.EVENT_READ, data=collection)
+            self._collections.append((key, collection, watcher))
+            if len(self._collections) > MAX_COLLECTIONS:
+                _, _, old = self._collections.pop(0)
+                if old is not None:
+                    self._selector.unregister(old)
+                    old.close()
+        if watcher is not None:
+            # changes might not have been read yet, when files were just written
+            self._update(collection, watcher)
+        # if watching works, this usually only confirms the db is up to date
+        collection.update_db(max_age=conf['sqlite']['max_cache_age'])
+        return collection
+
+    def _update(self, collection, watcher) -> None:
+        """update `collection` with the changes `watcher` found"""
+        changes, rescan = watcher.read()
+        try:
+            if rescan:
+                collection.update_db()
+            elif changes:
+                collection.update_hrefs(changes)
+        except Exception:
+            logger.exception('updating the db failed')
+
+
+def serve(conf: Dict[str, Any]) -> None:
+    """run the daemon until it is interrupted"""
+    server = Server(conf)
+    # clean up like when interrupted
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
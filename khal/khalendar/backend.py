@@ -24,23 +24,37 @@ The SQLite backend implementation.
 
 import contextlib
 import datetime as dt
+from collections import namedtuple
 from enum import IntEnum
 import logging
+import os
 import sqlite3
+import zlib
 from os import makedirs, path
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from typing import (Any, ContextManager, Dict, Iterable, Iterator, List, Optional, Set, Tuple,
+                    Union)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 import icalendar
 import pytz
 from dateutil import parser
 
 from .. import utils
+from .event import Event, EventRecord, record_from_vevent
 from .exceptions import (CouldNotCreateDbDir, OutdatedDbVersionError,
                          UpdateFailed, NonUniqueUID)
 
 logger = logging.getLogger('khal')
 
-DB_VERSION = 5  # The current db layout version
+DB_VERSION = 11  # The current db layout version
+
+# seconds to wait for other processes writing to the db, before failing with
+# "database is locked"
+BUSY_TIMEOUT = 60
 
 RECURRENCE_ID = 'RECURRENCE-ID'
 THISANDFUTURE = 'THISANDFUTURE'
@@ -48,12 +62,30 @@ THISANDPRIOR = 'THISANDPRIOR'
 
 PROTO = 'PROTO'
 
+# bytes needed for the occupancy of all days of a (leap) year, one bit each
+OCCUPANCY_BYTES = 46
+
+# columns of the full text search index and the properties they are built from
+SEARCH_FIELDS = [
+    ('summary', 'SUMMARY'),
+    ('description', 'DESCRIPTION'),
+    ('location', 'LOCATION'),
+    ('categories', 'CATEGORIES'),
+    ('attendees', 'ATTENDEE'),
+]
+
 
 class EventType(IntEnum):
     DATE = 0
     DATETIME = 1
 
 
+# an event parsed and expanded by `prepare_update`, ready to be written by
+# `SQLiteDb.update_prepared`
+PreparedEvent = namedtuple('PreparedEvent', [
+    'href', 'calendar', 'item', 'instances', 'records', 'recurring', 'reach', 'search'])
+
+
 class SQLiteDb(object):
     """
     This class should provide a caching database for a calendar, keeping raw
@@ -65,37 +97,132 @@ class SQLiteDb(object):
         combination should be unique.
     :param db_path: path where this sqlite database will be saved, if this is
         None, a place according to the XDG specifications will be chosen
+    :param horizon: if set, instances of recurring events are only stored if
+        they start within `horizon` of today, instances outside of this window
+        are added to the database once they are queried. If None, all
+        instances are stored.
+    :param batch: if set, what was written is committed after every `batch`
+        events updated or deleted, even within `at_once`, so other
+        connections writing to the db don't wait for all of them
     """
 
     def __init__(self,
                  calendars: Iterable[str],
                  db_path: Optional[str],
                  locale: Dict[str, str],
+                 horizon: Optional[dt.timedelta]=None,
+                 batch: Optional[int]=None,
                  ) -> None:
         assert db_path is not None
         self.calendars = list(calendars)
         self.db_path = path.expanduser(db_path)
         self._create_dbdir()
         self.locale = locale
+        self._horizon = horizon
+        self._batch = batch
+        # the events written since the last commit, see `batch`
+        self._unbatched = 0
         self._at_once = False
-        self.conn = sqlite3.connect(self.db_path)
+        # the first and the last day by calendar whose occupancy (see
+        # `get_calendars_between`) needs to be updated before committing
+        self._dirty_days = dict()  # type: Dict[str, Tuple[dt.date, dt.date]]
+        self.conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+        # needed to keep the indexes in sync when INSERT OR REPLACE deletes rows
+        self.conn.execute('PRAGMA recursive_triggers = ON;')
+        # with a write-ahead log, other processes can keep reading the last
+        # committed state of the db while it is written to
+        mode = self.conn.execute('PRAGMA journal_mode;').fetchone()[0]
+        if mode != 'wal':
+            try:
+                mode = self.conn.execute('PRAGMA journal_mode = WAL;').fetchone()[0]
+            except sqlite3.OperationalError:
+                # another process is creating the db and switching it already
+                mode = self.conn.execute('PRAGMA journal_mode;').fetchone()[0]
+        if mode == 'wal':
+            # the db is only a cache, losing the last transactions on a power
+            # failure is fine
+            self.conn.execute('PRAGMA synchronous = NORMAL;')
+        elif self.db_path != ':memory:':
+            logger.debug('cannot use a write-ahead log for the db, using {}'.format(mode))
         self.cursor = self.conn.cursor()
-        self._create_default_tables()
-        self._check_calendars_exists()
-        self._check_table_version()
+        # creating or migrating the db must not race with other processes
+        with self._lock('db'), self.at_once():
+            self._create_default_tables()
+            self._check_table_version()
+            self._rtree = self._create_indexes()
+            self._fts = self._create_search_index()
+            self._check_calendars_exists()
+            self._check_windows()
+            self._check_occupancy()
 
     @contextlib.contextmanager
     def at_once(self):
-        assert not self._at_once
+        """run all statements in one transaction, committed at the end
+
+        can be nested, only the outermost at_once commits (after updating the
+        occupancy of the days whose events changed)
+        """
+        if self._at_once:
+            yield self
+            return
         self._at_once = True
         try:
             yield self
+            self._update_occupancy()
         except:  # noqa
+            self._dirty_days.clear()
+            # don't keep other processes from writing to the db until this
+            # connection is closed
+            self.conn.rollback()
             raise
         else:
             self.conn.commit()
         finally:
             self._at_once = False
+            self._unbatched = 0
+
+    def _event_written(self) -> None:
+        """commit within `at_once` once `batch` events were written"""
+        if self._batch is None or not self._at_once:
+            return
+        self._unbatched += 1
+        if self._unbatched >= self._batch:
+            self._unbatched = 0
+            self._update_occupancy()
+            self.conn.commit()
+
+    def update_lock(self, calendar: str) -> ContextManager[bool]:
+        """try to lock `calendar` for updating it from its vdir, without
+        waiting for other processes (or other connections) holding this lock
+
+        :returns: a context manager, yielding whether the lock was acquired
+        """
+        return self._lock('{:08x}'.format(zlib.crc32(calendar.encode('utf-8'))), blocking=False)
+
+    @contextlib.contextmanager
+    def _lock(self, name: str, blocking: bool=True) -> Iterator[bool]:
+        """lock the file `name` in the directory of lock files next to the db,
+        `<db>-locks` (the lock is held by this connection, not by this
+        process)
+
+        :returns: a context manager, yielding whether the lock was acquired
+        """
+        if self.db_path == ':memory:' or fcntl is None:
+            yield True
+            return
+        locks = self.db_path + '-locks'
+        makedirs(locks, mode=0o700, exist_ok=True)
+        fd = os.open(path.join(locks, name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+            else:
+                yield True
+        finally:
+            # also releases the lock
+            os.close(fd)
 
     def _create_dbdir(self) -> None:
         """create the dbdir if it doesn't exist"""
@@ -113,7 +240,13 @@ class SQLiteDb(object):
 
     def _check_table_version(self) -> None:
         """tests for current db Version
-        if the table is still empty, insert db_version
+        if the table is still empty, insert db_version, if the db is older,
+        migrate it to the current version
+
+        To change the db layout, increase DB_VERSION and add a method
+        `_migrate_from_<old version>` which upgrades a db of the old version
+        in place (`_create_default_tables` already created tables which did
+        not exist yet).
         """
         self.cursor.execute('SELECT version FROM version')
         result = self.cursor.fetchone()
@@ -121,11 +254,98 @@ class SQLiteDb(object):
             self.cursor.execute('INSERT INTO version (version) VALUES (?)',
                                 (DB_VERSION, ))
             self.conn.commit()
-        elif not result[0] == DB_VERSION:
+            return
+        version = result[0]
+        if version == DB_VERSION:
+            return
+        migrations = [getattr(self, '_migrate_from_{}'.format(old), None)
+                      for old in range(version, DB_VERSION)]
+        if version > DB_VERSION or None in migrations:
             raise OutdatedDbVersionError(
                 str(self.db_path) +
                 " is probably an invalid or outdated database.\n"
                 "You should consider removing it and running khal again.")
+        with self.at_once():
+            # sqlite3 does not open transactions for ALTER TABLE on its own,
+            # a failed migration must not leave a half migrated db behind
+            self.cursor.execute('BEGIN;')
+            try:
+                for old, migration in enumerate(migrations, version):
+                    logger.info('migrating {} from version {} to {}'.format(
+                        self.db_path, old, old + 1))
+                    migration()
+                self.sql_ex('UPDATE version SET version = ?;', (DB_VERSION, ))
+            except:  # noqa
+                self.conn.rollback()
+                raise
+
+    def _migrate_from_5(self) -> None:
+        """add the columns needed for windowed expansion of recurring events
+        and store the events' records
+
+        all recurrence instances of version 5 dbs (khal 0.9's) are already
+        stored, so the windows stay unbounded and nothing needs to be expanded
+        again
+        """
+        for column in ['window_start INT', 'window_end INT', 'reach INT NOT NULL DEFAULT 0']:
+            self.sql_ex('ALTER TABLE calendars ADD COLUMN {};'.format(column), ())
+        self.sql_ex('ALTER TABLE events ADD COLUMN recurring INT NOT NULL DEFAULT 0;', ())
+        for table in ['recs_loc', 'recs_float']:
+            sql_s = ('UPDATE calendars SET reach = max(reach, ('
+                     'SELECT coalesce(max(max(dtend - rec_inst, rec_inst - dtstart)), 0) '
+                     'FROM {0} WHERE {0}.calendar = calendars.calendar));'.format(table))
+            self.sql_ex(sql_s, ())
+        with _suppress_warnings():
+            sql_s = 'SELECT href, calendar, item FROM events;'
+            for href, calendar, item in self.sql_ex(sql_s, ()):
+                ical = utils.cal_from_ics(item)
+                self._insert_records(href, calendar, _records(ical, self.locale))
+                if any(RECURRENCE_ID not in vevent and ('RRULE' in vevent or 'RDATE' in vevent)
+                       for vevent in ical.walk('VEVENT')):
+                    sql_s = 'UPDATE events SET recurring = 1 WHERE href = ? AND calendar = ?;'
+                    self.sql_ex(sql_s, (href, calendar))
+
+    def _migrate_from_6(self) -> None:
+        """nothing to do, version 6 dbs (never released) already have the
+        layout of version 7"""
+
+    def _migrate_from_7(self) -> None:
+        """add the column recording when calendars were last checked"""
+        self.sql_ex('ALTER TABLE calendars ADD COLUMN checked REAL;', ())
+
+    def _migrate_from_8(self) -> None:
+        """add the column recording the timezone the occupancy table was
+        built in, `_check_occupancy` then builds it"""
+        self.sql_ex('ALTER TABLE calendars ADD COLUMN occupancy_tz TEXT;', ())
+
+    def _migrate_from_9(self) -> None:
+        """give the instance tables an explicit id, which their R*Tree
+        indexes refer to instead of their rowids (which VACUUM may change)
+
+        the ids are the rowids the indexes refer to, `_create_indexes` then
+        creates the triggers again
+        """
+        columns = 'dtstart, dtend, href, rec_inst, ref, dtype, calendar'
+        for table in ['recs_loc', 'recs_float']:
+            self.sql_ex(_RECS_TABLE.format(table + '_new'), ())
+            self.sql_ex('INSERT INTO {0}_new (id, {1}) SELECT rowid, {1} FROM {0};'.format(
+                table, columns), ())
+            self.sql_ex('DROP TABLE {0};'.format(table), ())
+            self.sql_ex('ALTER TABLE {0}_new RENAME TO {0};'.format(table), ())
+
+    def _migrate_from_10(self) -> None:
+        """give the events table an explicit id, which the full text search
+        index refers to instead of its rowids (which VACUUM may change)
+
+        the ids are the rowids the search index refers to,
+        `_create_search_index` then creates the trigger again
+        """
+        columns = 'href, calendar, sequence, etag, item, recurring'
+        self.sql_ex(_EVENTS_TABLE.format('events_new'), ())
+        self.sql_ex('INSERT INTO events_new (id, {0}) SELECT rowid, {0} FROM events;'.format(
+            columns), ())
+        self.sql_ex('DROP TABLE events;', ())
+        self.sql_ex('ALTER TABLE events_new RENAME TO events;', ())
 
     def _create_default_tables(self) -> None:
         """creates version and calendar tables and inserts table version number
@@ -134,41 +354,139 @@ class SQLiteDb(object):
                             'version (version INTEGER)')
         logger.debug("created version table")
 
+        # window_start and window_end delimit the recurrence instances stored
+        # in recs_loc and recs_float (by their rec_inst), NULL means unbounded,
+        # reach is the maximal distance between any instance's rec_inst and
+        # its start or end, checked is the unix time the calendar was last
+        # found to be up to date with its vdir and occupancy_tz the local
+        # timezone its occupancy was computed in
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS calendars (
             calendar TEXT NOT NULL UNIQUE,
             resource TEXT NOT NULL,
-            ctag TEXT
+            ctag TEXT,
+            window_start INT,
+            window_end INT,
+            reach INT NOT NULL DEFAULT 0,
+            checked REAL,
+            occupancy_tz TEXT
             )''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS events (
-                href TEXT NOT NULL,
-                calendar TEXT NOT NULL,
-                sequence INT,
-                etag TEXT,
-                item TEXT,
-                primary key (href, calendar)
-                );''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS recs_loc (
-            dtstart INT NOT NULL,
-            dtend INT NOT NULL,
-            href TEXT NOT NULL REFERENCES events( href ),
-            rec_inst TEXT NOT NULL,
-            ref TEXT NOT NULL,
-            dtype INT NOT NULL,
+        self.cursor.execute(_EVENTS_TABLE.format('events'))
+        for table in ['recs_loc', 'recs_float']:
+            self.cursor.execute(_RECS_TABLE.format(table))
+        # the properties of every VEVENT needed for listing it (see
+        # EventRecord), so they can be shown without parsing the whole event
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS records (
+            href TEXT NOT NULL,
             calendar TEXT NOT NULL,
-            primary key (href, rec_inst, calendar)
-            );''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS recs_float (
-            dtstart INT NOT NULL,
-            dtend INT NOT NULL,
-            href TEXT NOT NULL REFERENCES events( href ),
-            rec_inst TEXT NOT NULL,
             ref TEXT NOT NULL,
-            dtype INT NOT NULL,
+            summary TEXT NOT NULL,
+            location TEXT NOT NULL,
+            description TEXT NOT NULL,
+            categories TEXT NOT NULL,
+            status TEXT NOT NULL,
+            recurring INT NOT NULL,
+            recurpattern TEXT NOT NULL,
+            alarm INT NOT NULL,
+            start_tz TEXT,
+            end_tz TEXT,
+            primary key (href, calendar, ref)
+            );''')
+        # the days of a year on which a calendar has events, bit n of days
+        # (little endian) being set if it has some on the year's (n+1)th day
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS occupancy (
             calendar TEXT NOT NULL,
-            primary key (href, rec_inst, calendar)
+            year INT NOT NULL,
+            days BLOB NOT NULL,
+            primary key (calendar, year)
             );''')
         self.conn.commit()
 
+    def _create_indexes(self) -> bool:
+        """create R*Tree indexes over the start and end times of the instances
+        and the triggers keeping them up to date
+
+        :returns: False if the R*Tree module is not available, True otherwise
+        """
+        for table in ['recs_loc', 'recs_float']:
+            self.cursor.execute(
+                'SELECT count(*) FROM sqlite_master WHERE name = ?;', (table + '_index', ))
+            created = self.cursor.fetchone()[0] == 0
+            if created:
+                try:
+                    self.cursor.execute(
+                        'CREATE VIRTUAL TABLE {0}_index USING rtree(id, dtstart, dtend);'
+                        ''.format(table))
+                except sqlite3.OperationalError as error:
+                    logger.debug('Not using an R*Tree index: {}'.format(error))
+                    return False
+            # also when the index exists, migrations may have recreated the table
+            self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS {0}_insert
+                AFTER INSERT ON {0} BEGIN
+                INSERT OR REPLACE INTO {0}_index VALUES (new.id, new.dtstart, new.dtend);
+                END;'''.format(table))
+            self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS {0}_update
+                AFTER UPDATE ON {0} BEGIN
+                UPDATE {0}_index SET dtstart = new.dtstart, dtend = new.dtend
+                WHERE id = new.id;
+                END;'''.format(table))
+            self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS {0}_delete
+                AFTER DELETE ON {0} BEGIN
+                DELETE FROM {0}_index WHERE id = old.id;
+                END;'''.format(table))
+            if created:
+                self.cursor.execute(
+                    'INSERT INTO {0}_index SELECT id, dtstart, dtend FROM {0};'.format(table))
+                logger.debug('created R*Tree index for {}'.format(table))
+        self.conn.commit()
+        return True
+
+    def _create_search_index(self) -> bool:
+        """create an FTS5 full text search index over the textual properties
+        of all events, its rowids are the ids of the events table
+
+        :returns: False if the FTS5 module is not available, True otherwise
+        """
+        self.cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'events_fts';")
+        created = self.cursor.fetchone()[0] == 0
+        if created:
+            try:
+                self.cursor.execute(
+                    "CREATE VIRTUAL TABLE events_fts USING fts5({}, prefix='2 3');".format(
+                        ', '.join(column for column, _ in SEARCH_FIELDS)))
+            except sqlite3.OperationalError as error:
+                logger.debug('Not using a full text search index: {}'.format(error))
+                return False
+        # also when the index exists, migrations may have recreated the table
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS events_delete
+            AFTER DELETE ON events BEGIN
+            DELETE FROM events_fts WHERE rowid = old.id;
+            END;''')
+        if created:
+            self.cursor.execute('SELECT id, item FROM events;')
+            for id_, item in self.cursor.fetchall():
+                self._update_search_index(id_, _search_text(utils.cal_from_ics(item)))
+            logger.debug('created full text search index')
+        self.conn.commit()
+        return True
+
+    def _update_search_index(self, id_: int, search: Tuple[str, ...]) -> None:
+        """add the text of the event with id `id_`, as returned by
+        `_search_text`, to the search index"""
+        sql_s = 'INSERT INTO events_fts (rowid, {}) VALUES (?, {});'.format(
+            ', '.join(column for column, _ in SEARCH_FIELDS), ', '.join('?' * len(search)))
+        self.sql_ex(sql_s, (id_, ) + search)
+
+    def _index_condition(self, table: str, start: int, end: int) -> Tuple[str, Tuple[int, int]]:
+        """return an SQL condition (and its parameters) preselecting instances
+        of `table` which might overlap with `start` and `end` via the R*Tree
+        index, the actual overlap still needs to be checked as the index
+        only stores approximations of the times"""
+        if not self._rtree:
+            return '', ()
+        sql_s = ('{0}.id IN (SELECT id FROM {0}_index WHERE '
+                 'dtstart <= ? AND dtend >= ?) AND '.format(table))
+        return sql_s, (end, start)
+
     def _check_calendars_exists(self) -> None:
         """make sure an entry for the current calendar exists in `calendar`
         table
@@ -180,10 +498,187 @@ class SQLiteDb(object):
             if result[0] != 0:
                 logger.debug("tables for calendar {0} exist".format(cal))
             else:
-                sql_s = 'INSERT INTO calendars (calendar, resource) VALUES (?, ?);'
-                stuple = (cal, '')
+                sql_s = ('INSERT INTO calendars (calendar, resource, window_start, window_end) '
+                         'VALUES (?, ?, ?, ?);')
+                stuple = (cal, '') + self._initial_window()
                 self.sql_ex(sql_s, stuple)
 
+    def _initial_window(self) -> Tuple[Optional[int], Optional[int]]:
+        """return the window of recurrence instances stored for a new calendar"""
+        if self._horizon is None:
+            return None, None
+        today = utils.to_unix_time(dt.datetime.combine(dt.date.today(), dt.time.min))
+        horizon = int(self._horizon.total_seconds())
+        return today - horizon, today + horizon
+
+    def _check_windows(self) -> None:
+        """if all recurrence instances should be stored, make sure that
+        calendars which were previously only expanded within a window get
+        expanded completely"""
+        if self._horizon is not None:
+            return
+        for calendar in self.calendars:
+            if self.get_window(calendar) != (None, None):
+                self._extend_window(calendar, None, None)
+
+    def _check_occupancy(self) -> None:
+        """rebuild the occupancy of calendars for which it was not computed
+        in the current local timezone (e.g., because they are new)"""
+        timezone = str(self.locale['local_timezone'])
+        sql_s = ('SELECT calendar FROM calendars WHERE calendar in ({0}) AND '
+                 '(occupancy_tz IS NULL OR occupancy_tz != ?);'.format(
+                     ','.join('?' * len(self.calendars))))
+        for calendar, in self.sql_ex(sql_s, tuple(self.calendars) + (timezone, )):
+            logger.debug('computing the occupancy of {}'.format(calendar))
+            self.sql_ex('DELETE FROM occupancy WHERE calendar = ?;', (calendar, ))
+            for table in ['recs_loc', 'recs_float']:
+                self._mark_changed(table, calendar)
+            sql_s = 'UPDATE calendars SET occupancy_tz = ? WHERE calendar = ?;'
+            self.sql_ex(sql_s, (timezone, calendar))
+
+    def _mark_changed(self, table: str, calendar: str, condition: str='',
+                      stuple: tuple=()) -> None:
+        """remember that the occupancy of the days of `calendar`'s instances
+        in `table` (which match `condition`) needs to be updated"""
+        sql_s = 'SELECT min(dtstart), max(dtend) FROM {0} WHERE calendar = ?{1};'.format(
+            table, condition)
+        start, end = self.sql_ex(sql_s, (calendar, ) + stuple)[0]
+        if start is not None:
+            self._mark_days(table, calendar, start, end)
+
+    def _mark_days(self, table: str, calendar: str, start: int, end: int) -> None:
+        """remember that the occupancy of `calendar` needs to be updated
+        on the days between the unix times `start` and `end` (of instances
+        in `table`)"""
+        floating = table == 'recs_float'
+        first, last = self._date(start, floating), self._date(end, floating)
+        if calendar in self._dirty_days:
+            dirty_first, dirty_last = self._dirty_days[calendar]
+            first, last = min(first, dirty_first), max(last, dirty_last)
+        self._dirty_days[calendar] = (first, last)
+
+    def _date(self, time: int, floating: bool) -> dt.date:
+        """the (local) date of the unix time `time`"""
+        if floating:
+            return dt.datetime.utcfromtimestamp(time).date()
+        return dt.datetime.fromtimestamp(time, self.locale['local_timezone']).date()
+
+    def _day_bounds(self, day: dt.date, floating: bool) -> Tuple[int, int]:
+        """the first and the last second (unix time) of `day`, in local time
+        unless `floating`"""
+        start = dt.datetime.combine(day, dt.time.min)
+        end = dt.datetime.combine(day, dt.time.max)
+        if not floating:
+            localize = self.locale['local_timezone'].localize
+            start, end = localize(start), localize(end)
+        return utils.to_unix_time(start), utils.to_unix_time(end)
+
+    def _update_occupancy(self) -> None:
+        """update the occupancy of all days remembered by `_mark_days`"""
+        while self._dirty_days:
+            calendar, (first, last) = self._dirty_days.popitem()
+            self._write_occupancy(calendar, first, last)
+
+    def _instance_days(self, dtstart: int, dtend: int, floating: bool,
+                       first: dt.date, last: dt.date,
+                       bounds: Dict[Tuple[dt.date, bool], Tuple[int, int]]) -> Iterator[dt.date]:
+        """the days between `first` and `last` on which an instance from
+        `dtstart` to `dtend` is found by `get_localized` or `get_floating`
+
+        :param bounds: `_day_bounds` by day and if floating, filled as needed
+        """
+        overlaps = floating_overlaps if floating else localized_overlaps
+        start_day, end_day = self._date(dtstart, floating), self._date(dtend, floating)
+        day = max(start_day, first)
+        while day <= min(end_day, last):
+            # only whether it is on its first (if floating) and on its last
+            # day is not obvious, e.g., it isn't if it ends at midnight
+            if start_day < day < end_day or day == start_day and not floating:
+                yield day
+            else:
+                if (day, floating) not in bounds:
+                    bounds[day, floating] = self._day_bounds(day, floating)
+                if overlaps(dtstart, dtend, *bounds[day, floating]):
+                    yield day
+            day += dt.timedelta(days=1)
+
+    def _write_occupancy(self, calendar: str, first: dt.date, last: dt.date) -> None:
+        """recompute the occupancy of `calendar` between the days `first` and
+        `last` from its stored instances"""
+        masks = {year: 0 for year in range(first.year, last.year + 1)}
+        # the bounds of the days, by day and if floating
+        bounds = dict()  # type: Dict[Tuple[dt.date, bool], Tuple[int, int]]
+        for table in ['recs_loc', 'recs_float']:
+            floating = table == 'recs_float'
+            start, _ = self._day_bounds(first, floating)
+            _, end = self._day_bounds(last, floating)
+            index_s, index_tuple = self._index_condition(table, start, end)
+            sql_s = ('SELECT DISTINCT dtstart, dtend FROM {0} WHERE {1}'
+                     'dtstart <= ? AND dtend >= ? AND calendar = ?;'.format(table, index_s))
+            for dtstart, dtend in self.sql_ex(sql_s, index_tuple + (end, start, calendar)):
+                for day in self._instance_days(dtstart, dtend, floating, first, last, bounds):
+                    masks[day.year] |= 1 << (day.timetuple().tm_yday - 1)
+        sql_s = 'SELECT year, days FROM occupancy WHERE calendar = ? AND year >= ? AND year <= ?;'
+        stored = {year: int.from_bytes(days, 'little') for year, days
+                  in self.sql_ex(sql_s, (calendar, first.year, last.year))}
+        for year, mask in masks.items():
+            # keep the days of the year outside of first and last
+            mask |= stored.get(year, 0) & ~_days_mask(
+                max(first, dt.date(year, 1, 1)), min(last, dt.date(year, 12, 31)))
+            if mask:
+                sql_s = 'INSERT OR REPLACE INTO occupancy (calendar, year, days) VALUES (?, ?, ?);'
+                self.sql_ex(sql_s, (calendar, year, mask.to_bytes(OCCUPANCY_BYTES, 'little')))
+            elif year in stored:
+                sql_s = 'DELETE FROM occupancy WHERE calendar = ? AND year = ?;'
+                self.sql_ex(sql_s, (calendar, year))
+
+    def get_window(self, calendar: str) -> Tuple[Optional[int], Optional[int]]:
+        sql_s = 'SELECT window_start, window_end FROM calendars WHERE calendar = ?;'
+        return tuple(self.sql_ex(sql_s, (calendar, ))[0])
+
+    def _ensure_window(self, start: int, end: int) -> None:
+        """make sure all recurrence instances which could overlap with the
+        time between `start` and `end` (unix timestamps) are stored"""
+        if self._horizon is None:
+            return
+        horizon = int(self._horizon.total_seconds())
+        sql_s = ('SELECT calendar, window_start, window_end, reach FROM calendars '
+                 'WHERE calendar in ({0});'.format(','.join('?' * len(self.calendars))))
+        for calendar, wstart, wend, reach in self.sql_ex(sql_s, tuple(self.calendars)):
+            new_start, new_end = wstart, wend
+            if wstart is not None and start - reach < wstart:
+                new_start = start - reach - horizon
+            if wend is not None and end + reach >= wend:
+                new_end = end + reach + horizon
+            if (new_start, new_end) != (wstart, wend):
+                self._extend_window(calendar, new_start, new_end)
+
+    def _extend_window(self, calendar: str, start: Optional[int], end: Optional[int]) -> None:
+        """store all recurrence instances of events in `calendar` starting
+        between `start` and `end` (unix timestamps, None meaning unbounded),
+        which are not stored yet"""
+        wstart, wend = self.get_window(calendar)
+        windows = list()
+        if wstart is not None and (start is None or start < wstart):
+            windows.append((start, wstart))
+        if wend is not None and (end is None or end > wend):
+            windows.append((wend, end))
+        logger.debug('expanding recurring events in {} between {} and {}'.format(
+            calendar, start, end))
+        # all warnings about these events have already been shown when they
+        # were first inserted
+        with self.at_once(), _suppress_warnings():
+            sql_s = 'SELECT href, item FROM events WHERE calendar = ? AND recurring = 1;'
+            for href, item in self.sql_ex(sql_s, (calendar, )):
+                ical = utils.cal_from_ics(item)
+                vevents = (utils.sanitize(c, self.locale['default_timezone'], href, calendar)
+                           for c in ical.walk() if c.name == 'VEVENT')
+                for vevent in sorted(vevents, key=utils.sort_key):
+                    for window in windows:
+                        self._update_impl(vevent, href, calendar, window)
+            sql_s = 'UPDATE calendars SET window_start = ?, window_end = ? WHERE calendar = ?;'
+            self.sql_ex(sql_s, (start, end, calendar))
+
     def sql_ex(self, statement: str, stuple: tuple=Union[tuple, str]) -> List:
         """wrapper for sql statements, does a "fetchall" """
         self.cursor.execute(statement, stuple)
@@ -192,6 +687,12 @@ class SQLiteDb(object):
             self.conn.commit()
         return result
 
+    def sql_exmany(self, statement: str, stuples: Iterable[tuple]) -> None:
+        """wrapper for running `statement` once for every tuple in `stuples`"""
+        self.cursor.executemany(statement, stuples)
+        if not self._at_once:
+            self.conn.commit()
+
     def update(self, vevent_str: str, href: str, etag: str='', calendar: str=None) -> None:
         """insert a new or update an existing event into the db
 
@@ -211,34 +712,40 @@ class SQLiteDb(object):
         """
         assert calendar is not None
         assert href is not None
-        ical = utils.cal_from_ics(vevent_str)
-        check_for_errors(ical, calendar, href)
-        if not utils.assert_only_one_uid(ical):
-            logger.warning(
-                "The .ics file at {}/{} contains multiple UIDs.\n"
-                "This should not occur in vdir .ics files.\n"
-                "If you didn't edit the file by hand, please report a bug "
-                "at https://github.com/pimutils/khal/issues .\n"
-                "If you want to import it, please use `khal import FILE`."
-                "".format(calendar, href)
-            )
-            raise NonUniqueUID
-        vevents = (utils.sanitize(c, self.locale['default_timezone'], href, calendar) for
-                   c in ical.walk() if c.name == 'VEVENT')
-        # Need to delete the whole event in case we are updating a
-        # recurring event with an event which is either not recurring any
-        # more or has EXDATEs, as those would be left in the recursion
-        # tables. There are obviously better ways to achieve the same
-        # result.
-        self.delete(href, calendar=calendar)
-        for vevent in sorted(vevents, key=utils.sort_key):
-            check_for_errors(vevent, calendar, href)
-            check_support(vevent, href, calendar)
-            self._update_impl(vevent, href, calendar)
-
-        sql_s = ('INSERT INTO events (item, etag, href, calendar) VALUES (?, ?, ?, ?);')
-        stuple = (vevent_str, etag, href, calendar)
-        self.sql_ex(sql_s, stuple)
+        self.update_prepared(
+            prepare_update(vevent_str, href, calendar, self.locale, self.get_window(calendar)),
+            etag)
+
+    def update_prepared(self, prepared: 'PreparedEvent', etag: str='') -> None:
+        """insert an event already parsed and expanded by `prepare_update`,
+        see `update`"""
+        href, calendar = prepared.href, prepared.calendar
+        with self.at_once():
+            for table in ['records', 'events']:
+                sql_s = 'DELETE FROM {0} WHERE href = ? AND calendar = ?;'.format(table)
+                self.sql_ex(sql_s, (href, calendar))
+            for table, rows in prepared.instances.items():
+                self._write_instances(table, href, calendar, rows)
+            sql_s = 'UPDATE calendars SET reach = max(reach, ?) WHERE calendar = ?;'
+            self.sql_ex(sql_s, (prepared.reach, calendar))
+            self._insert_records(href, calendar, prepared.records)
+
+            sql_s = ('INSERT INTO events (item, etag, href, calendar, recurring) '
+                     'VALUES (?, ?, ?, ?, ?);')
+            stuple = (prepared.item, etag, href, calendar, prepared.recurring)
+            self.sql_ex(sql_s, stuple)
+            if self._fts:
+                self._update_search_index(self.cursor.lastrowid, prepared.search)
+        self._event_written()
+
+    def _insert_records(self, href: str, calendar: str,
+                        records: List[Tuple[str, Optional[EventRecord]]]) -> None:
+        sql_s = ('INSERT OR REPLACE INTO records (href, calendar, ref, {}) '
+                 'VALUES (?, ?, ?, {});'.format(
+                     ', '.join(EventRecord._fields),
+                     ', '.join('?' * len(EventRecord._fields))))
+        self.sql_exmany(sql_s, [(href, calendar, ref) + tuple(record)
+                                for ref, record in records if record is not None])
 
     def update_birthday(self, vevent_str: str, href: str, etag: str='', calendar: str=None) -> None:
         """
@@ -246,122 +753,132 @@ class SQLiteDb(object):
         """
         assert calendar is not None
         assert href is not None
-        self.delete(href, calendar=calendar)
-        ical = utils.cal_from_ics(vevent_str)
-        vcard = ical.walk()[0]
-        if 'BDAY' in vcard.keys():
-            bday = vcard['BDAY']
-            if isinstance(bday, list):
-                logger.warning(
-                    'Vcard {0} in collection {1} has more than one '
-                    'BIRTHDAY, will be skipped and not be available '
-                    'in khal.'.format(href, calendar)
-                )
-                return
-            try:
-                if bday[0:2] == '--' and bday[3] != '-':
-                    bday = '1900' + bday[2:]
-                    orig_bday = False
+        with self.at_once():
+            self.delete(href, calendar=calendar)
+            ical = utils.cal_from_ics(vevent_str)
+            vcard = ical.walk()[0]
+            if 'BDAY' in vcard.keys():
+                bday = vcard['BDAY']
+                if isinstance(bday, list):
+                    logger.warning(
+                        'Vcard {0} in collection {1} has more than one '
+                        'BIRTHDAY, will be skipped and not be available '
+                        'in khal.'.format(href, calendar)
+                    )
+                    return
+                try:
+                    if bday[0:2] == '--' and bday[3] != '-':
+                        bday = '1900' + bday[2:]
+                        orig_bday = False
+                    else:
+                        orig_bday = True
+                    bday = parser.parse(bday).date()
+                except ValueError:
+                    logger.warning(
+                        'cannot parse BIRTHDAY in {0} in collection {1}'.format(href, calendar))
+                    return
+                if 'FN' in vcard:
+                    name = vcard['FN']
                 else:
-                    orig_bday = True
-                bday = parser.parse(bday).date()
-            except ValueError:
-                logger.warning(
-                    'cannot parse BIRTHDAY in {0} in collection {1}'.format(href, calendar))
-                return
-            if 'FN' in vcard:
-                name = vcard['FN']
-            else:
-                n = vcard['N'].split(';')
-                name = ' '.join([n[1], n[2], n[0]])
-            vevent = icalendar.Event()
-            vevent.add('dtstart', bday)
-            vevent.add('dtend', bday + dt.timedelta(days=1))
-            if bday.month == 2 and bday.day == 29:  # leap year
-                vevent.add('rrule', {'freq': 'YEARLY', 'BYYEARDAY': 60})
-            else:
-                vevent.add('rrule', {'freq': 'YEARLY'})
-            if orig_bday:
-                vevent.add('x-birthday',
-                           '{:04}{:02}{:02}'.format(bday.year, bday.month, bday.day))
-                vevent.add('x-fname', name)
-            vevent.add('summary', '{0}\'s birthday'.format(name))
-            vevent.add('uid', href)
-            vevent_str = vevent.to_ical().decode('utf-8')
-            self._update_impl(vevent, href, calendar)
-            sql_s = ('INSERT INTO events (item, etag, href, calendar) VALUES (?, ?, ?, ?);')
-            stuple = (vevent_str, etag, href, calendar)
-            self.sql_ex(sql_s, stuple)
+                    n = vcard['N'].split(';')
+                    name = ' '.join([n[1], n[2], n[0]])
+                vevent = icalendar.Event()
+                vevent.add('dtstart', bday)
+                vevent.add('dtend', bday + dt.timedelta(days=1))
+                if bday.month == 2 and bday.day == 29:  # leap year
+                    vevent.add('rrule', {'freq': 'YEARLY', 'BYYEARDAY': 60})
+                else:
+                    vevent.add('rrule', {'freq': 'YEARLY'})
+                if orig_bday:
+                    vevent.add('x-birthday',
+                               '{:04}{:02}{:02}'.format(bday.year, bday.month, bday.day))
+                    vevent.add('x-fname', name)
+                vevent.add('summary', '{0}\'s birthday'.format(name))
+                vevent.add('uid', href)
+                vevent_str = vevent.to_ical().decode('utf-8')
+                self._update_impl(vevent, href, calendar, self.get_window(calendar))
+                sql_s = ('INSERT INTO events (item, etag, href, calendar, recurring) '
+                         'VALUES (?, ?, ?, ?, ?);')
+                stuple = (vevent_str, etag, href, calendar, True)
+                self.sql_ex(sql_s, stuple)
+                if self._fts:
+                    self._update_search_index(self.cursor.lastrowid, _search_text(vevent))
 
-    def _update_impl(self, vevent: icalendar.cal.Event, href: str, calendar: str) -> None:
-        """insert `vevent` into the database
+    def _update_impl(self, vevent: icalendar.cal.Event, href: str, calendar: str,
+                     window: Tuple[Optional[int], Optional[int]]=(None, None)) -> None:
+        """insert the recurrence instances of `vevent` into the database
 
-        expand `vevent`'s recurrence rules (if needed) and insert all instance
-        in the respective tables
-        than insert non-recurring and original recurring (those with an RRULE
-        property) events into table `events`
+        :param window: only instances of recurring events starting between
+            those two unix timestamps are inserted, None meaning unbounded
         """
-        # TODO FIXME this function is a steaming pile of shit
-        rec_id = vevent.get(RECURRENCE_ID)
-        if rec_id is None:
-            rrange = None
-        else:
-            rrange = rec_id.params.get('RANGE')
-
-        # testing on datetime.date won't work as datetime is a child of date
-        if not isinstance(vevent['DTSTART'].dt, dt.datetime):
-            dtype = EventType.DATE
-        else:
-            dtype = EventType.DATETIME
-        if ('TZID' in vevent['DTSTART'].params and dtype == EventType.DATETIME) or \
-                getattr(vevent['DTSTART'].dt, 'tzinfo', None):
-            recs_table = 'recs_loc'
-        else:
-            recs_table = 'recs_float'
-
-        thisandfuture = (rrange == THISANDFUTURE)
+        recs_table, thisandfuture, rows, reach = _expand_instances(vevent, href, window)
         if thisandfuture:
-            start_shift, duration = calc_shift_deltas(vevent)
-            start_shift_seconds = start_shift.days * 3600 * 24 + start_shift.seconds
-            duration_seconds = duration.days * 3600 * 24 + duration.seconds
-
-        dtstartend = utils.expand(vevent, href)
-        if not dtstartend:
-            # Does this event even have dates? Technically it is possible for
-            # events to be empty/non-existent by deleting all their recurrences
-            # through EXDATE.
-            return
+            for row in rows:
+                self._mark_changed(recs_table, calendar, ' AND href = ? AND rec_inst >= ?',
+                                   (href, row[3]))
+            recs_sql_s = (
+                'UPDATE {0} SET dtstart = rec_inst + ?, dtend = rec_inst + ?, ref = ? '
+                'WHERE rec_inst >= ? AND href = ? AND calendar = ?;'.format(recs_table))
+            self.sql_exmany(recs_sql_s, [row + (href, calendar) for row in rows])
+            for row in rows:
+                self._mark_changed(recs_table, calendar, ' AND href = ? AND rec_inst >= ?',
+                                   (href, row[3]))
+        elif rows:
+            # the instances replaced, e.g., by an overriding RECURRENCE-ID
+            rec_insts = [int(row[4]) for row in rows]
+            self._mark_changed(
+                recs_table, calendar, ' AND href = ? AND CAST(rec_inst AS INT) BETWEEN ? AND ?',
+                (href, min(rec_insts), max(rec_insts)))
+            self._mark_days(recs_table, calendar,
+                            min(row[0] for row in rows), max(row[1] for row in rows))
+            recs_sql_s = (
+                'INSERT OR REPLACE INTO {0} '
+                '(dtstart, dtend, href, ref, dtype, rec_inst, calendar)'
+                'VALUES (?, ?, ?, ?, ?, ?, ?);'.format(recs_table))
+            self.sql_exmany(recs_sql_s, [
+                (dtstart, dtend, href, ref, dtype, rec_inst, calendar)
+                for dtstart, dtend, ref, dtype, rec_inst in rows])
+        if reach is not None:
+            sql_s = 'UPDATE calendars SET reach = max(reach, ?) WHERE calendar = ?;'
+            self.sql_ex(sql_s, (reach, calendar))
 
-        for dtstart, dtend in dtstartend:
-            if dtype == EventType.DATE:
-                dbstart = utils.to_unix_time(dtstart)
-                dbend = utils.to_unix_time(dtend)
-            else:
-                dbstart = utils.to_unix_time(dtstart)
-                dbend = utils.to_unix_time(dtend)
+    def _write_instances(self, table: str, href: str, calendar: str,
+                         instances: Dict[str, tuple]) -> None:
+        """make the instances of `href` stored in `table` match `instances`
 
-            if rec_id is not None:
-                ref = rec_inst = str(utils.to_unix_time(rec_id.dt))
-            else:
-                rec_inst = str(dbstart)
-                ref = PROTO
-
-            if thisandfuture:
-                recs_sql_s = (
-                    'UPDATE {0} SET dtstart = rec_inst + ?, dtend = rec_inst + ?, ref = ? '
-                    'WHERE rec_inst >= ? AND href = ? AND calendar = ?;'.format(recs_table))
-                stuple_f = (
-                    start_shift_seconds, start_shift_seconds + duration_seconds,
-                    ref, rec_inst, href, calendar,
-                )
-                self.sql_ex(recs_sql_s, stuple_f)
-            else:
-                recs_sql_s = (
-                    'INSERT OR REPLACE INTO {0} '
-                    '(dtstart, dtend, href, ref, dtype, rec_inst, calendar)'
-                    'VALUES (?, ?, ?, ?, ?, ?, ?);'.format(recs_table))
-                stuple_n = (dbstart, dbend, href, ref, dtype, rec_inst, calendar)
-                self.sql_ex(recs_sql_s, stuple_n)
+        only the rows that changed are inserted, updated or deleted; if most of
+        the stored instances changed anyway (e.g., because the event's
+        recurrence rule changed), all rows are deleted and rewritten instead
+
+        :param instances: (dtstart, dtend, ref, dtype) by rec_inst, as
+            collected by `_collect_instances`
+        """
+        sql_s = ('SELECT rec_inst, dtstart, dtend, ref, dtype FROM {0} '
+                 'WHERE href = ? AND calendar = ?;'.format(table))
+        stored = {row[0]: tuple(row[1:]) for row in self.sql_ex(sql_s, (href, calendar))}
+        unchanged = {rec_inst for rec_inst, row in instances.items()
+                     if stored.get(rec_inst) == row}
+        changed = [row for rec_inst, row in stored.items() if rec_inst not in unchanged] + \
+            [row for rec_inst, row in instances.items() if rec_inst not in unchanged]
+        if changed:
+            self._mark_days(table, calendar,
+                            min(row[0] for row in changed), max(row[1] for row in changed))
+        if len(unchanged) * 2 < len(stored):
+            sql_s = 'DELETE FROM {0} WHERE href = ? AND calendar = ?;'.format(table)
+            self.sql_ex(sql_s, (href, calendar))
+            unchanged = set()
+        else:
+            sql_s = 'DELETE FROM {0} WHERE href = ? AND rec_inst = ? AND calendar = ?;'.format(
+                table)
+            self.sql_exmany(sql_s, [(href, rec_inst, calendar)
+                                    for rec_inst in stored if rec_inst not in instances])
+        sql_s = ('INSERT OR REPLACE INTO {0} '
+                 '(dtstart, dtend, href, ref, dtype, rec_inst, calendar) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?);'.format(table))
+        self.sql_exmany(sql_s, [
+            (dtstart, dtend, href, ref, dtype, rec_inst, calendar)
+            for rec_inst, (dtstart, dtend, ref, dtype) in instances.items()
+            if rec_inst not in unchanged])
 
     def get_ctag(self, calendar=str) -> Optional[str]:
         stuple = (calendar, )
@@ -378,6 +895,18 @@ class SQLiteDb(object):
         self.sql_ex(sql_s, stuple)
         self.conn.commit()
 
+    def get_checked(self, calendar: str) -> Optional[float]:
+        """return the unix time `calendar` was last checked against its vdir"""
+        sql_s = 'SELECT checked FROM calendars WHERE calendar = ?;'
+        try:
+            return self.sql_ex(sql_s, (calendar, ))[0][0]
+        except IndexError:
+            return None
+
+    def set_checked(self, checked: float, calendar: str) -> None:
+        sql_s = 'UPDATE calendars SET checked = ? WHERE calendar = ?;'
+        self.sql_ex(sql_s, (checked, calendar))
+
     def get_etag(self, href: str, calendar: str) -> Optional[str]:
         """get etag for href
 
@@ -392,6 +921,10 @@ class SQLiteDb(object):
         except IndexError:
             return None
 
+    def set_etag(self, href: str, etag: str, calendar: str) -> None:
+        sql_s = 'UPDATE events SET etag = ? WHERE href = ? AND calendar = ?;'
+        self.sql_ex(sql_s, (etag, href, calendar))
+
     def delete(self, href: str, etag: Any=None, calendar: str=None):
         """
         removes the event from the db,
@@ -401,119 +934,188 @@ class SQLiteDb(object):
         :returns: None
         """
         assert calendar is not None
-        for table in ['recs_loc', 'recs_float']:
-            sql_s = 'DELETE FROM {0} WHERE href = ? AND calendar = ?;'.format(table)
+        with self.at_once():
+            for table in ['recs_loc', 'recs_float']:
+                self._mark_changed(table, calendar, ' AND href = ?', (href, ))
+            for table in ['recs_loc', 'recs_float', 'records']:
+                sql_s = 'DELETE FROM {0} WHERE href = ? AND calendar = ?;'.format(table)
+                self.sql_ex(sql_s, (href, calendar))
+            sql_s = 'DELETE FROM events WHERE href = ? AND calendar = ?;'
             self.sql_ex(sql_s, (href, calendar))
-        sql_s = 'DELETE FROM events WHERE href = ? AND calendar = ?;'
-        self.sql_ex(sql_s, (href, calendar))
+        self._event_written()
 
     def list(self, calendar):
         """ list all events in `calendar`
 
-        used for testing
         :returns: list of (href, etag)
         """
         sql_s = 'SELECT href, etag FROM events WHERE calendar = ?;'
         return list(set(self.sql_ex(sql_s, (calendar, ))))
 
+    def get_day_intervals(self, href: str, calendar: str) -> List[Tuple[dt.date, dt.date]]:
+        """the (first, last) intervals of days touched by the stored instances
+        of the event at `href`, merged and sorted"""
+        days = list()
+        for table in ['recs_loc', 'recs_float']:
+            floating = table == 'recs_float'
+            sql_s = 'SELECT dtstart, dtend FROM {0} WHERE href = ? AND calendar = ?;'
+            for start, end in self.sql_ex(sql_s.format(table), (href, calendar)):
+                # an instance ending at midnight doesn't touch the next day
+                days.append((self._date(start, floating),
+                             self._date(max(start, end - 1), floating)))
+        return utils.merge_date_intervals(days)
+
     def get_localized_calendars(self, start: dt.datetime, end: dt.datetime) -> Iterable[str]:
         assert start.tzinfo is not None
         assert end.tzinfo is not None
         start_u = utils.to_unix_time(start)
         end_u = utils.to_unix_time(end)
+        self._ensure_window(start_u, end_u)
+        index_s, index_tuple = self._index_condition('recs_loc', start_u, end_u)
         sql_s = (
             'SELECT events.calendar FROM '
             'recs_loc JOIN events ON '
             'recs_loc.href = events.href AND '
-            'recs_loc.calendar = events.calendar WHERE '
+            'recs_loc.calendar = events.calendar WHERE {1}'
             '(dtstart >= ? AND dtstart <= ? OR '
             'dtend > ? AND dtend <= ? OR '
             'dtstart <= ? AND dtend >= ?) AND events.calendar in ({0}) '
             'ORDER BY dtstart')
-        stuple = tuple(
+        stuple = index_tuple + tuple(
             [start_u, end_u, start_u, end_u, start_u, end_u] + list(self.calendars))  # type: ignore
-        result = self.sql_ex(sql_s.format(','.join(["?"] * len(self.calendars))), stuple)
+        result = self.sql_ex(
+            sql_s.format(','.join(["?"] * len(self.calendars)), index_s), stuple)
         for calendar in result:
             yield calendar[0]  # result is always an iterable, even if getting only one item
 
+    def get_calendars_between(self, start: dt.date, end: dt.date) -> Dict[dt.date, Set[str]]:
+        """return the calendars with events on each day between `start` and
+        `end` (both included), read from the occupancy table
+        """
+        localize = self.locale['local_timezone'].localize
+        day_start = dt.datetime.combine(start, dt.time.min)
+        day_end = dt.datetime.combine(end, dt.time.max)
+        with self.at_once():
+            self._ensure_window(
+                min(utils.to_unix_time(localize(day_start)), utils.to_unix_time(day_start)),
+                max(utils.to_unix_time(localize(day_end)), utils.to_unix_time(day_end)))
+            # in case this is nested in another at_once
+            self._update_occupancy()
+        days = {start + dt.timedelta(days=number): set()
+                for number in range((end - start).days + 1)}  # type: Dict[dt.date, Set[str]]
+        sql_s = ('SELECT calendar, year, days FROM occupancy WHERE year >= ? AND year <= ? '
+                 'AND calendar in ({0});'.format(','.join('?' * len(self.calendars))))
+        stuple = (start.year, end.year) + tuple(self.calendars)
+        for calendar, year, mask in self.sql_ex(sql_s, stuple):
+            first = max(start, dt.date(year, 1, 1))
+            last = min(end, dt.date(year, 12, 31))
+            mask = int.from_bytes(mask, 'little') & _days_mask(first, last)
+            while mask:
+                bit = mask & -mask
+                days[dt.date(year, 1, 1) + dt.timedelta(days=bit.bit_length() - 1)].add(calendar)
+                mask ^= bit
+        return days
+
     def get_localized(self, start, end) \
-            -> Iterable[Tuple[str, str, dt.datetime, dt.datetime, str, str, str]]:
+            -> Iterable[Tuple[str, str, dt.datetime, dt.datetime, str, str, str,
+                              Optional[EventRecord]]]:
         """returns
         :type start: datetime.datetime
         :type end: datetime.datetime
         :param minimal: if set, we do not return an event but a minimal stand in
         :type minimal: bool
+        :returns: the events' source, href, start, end, ref, etag, calendar and
+            record (if available)
         """
         assert start.tzinfo is not None
         assert end.tzinfo is not None
         start = utils.to_unix_time(start)
         end = utils.to_unix_time(end)
+        self._ensure_window(start, end)
+        index_s, index_tuple = self._index_condition('recs_loc', start, end)
         sql_s = (
-            'SELECT item, recs_loc.href, dtstart, dtend, ref, etag, dtype, events.calendar '
-            'FROM recs_loc JOIN events ON '
+            'SELECT item, recs_loc.href, dtstart, dtend, recs_loc.ref, etag, dtype, '
+            'events.calendar, {2} FROM recs_loc JOIN events ON '
             'recs_loc.href = events.href AND '
-            'recs_loc.calendar = events.calendar WHERE '
+            'recs_loc.calendar = events.calendar '
+            'LEFT JOIN records ON '
+            'recs_loc.href = records.href AND '
+            'recs_loc.calendar = records.calendar AND '
+            'recs_loc.ref = records.ref WHERE {1}'
             '(dtstart >= ? AND dtstart <= ? OR '
             'dtend > ? AND dtend <= ? OR '
             'dtstart <= ? AND dtend >= ?) AND events.calendar in ({0}) '
             'ORDER BY dtstart')
-        stuple = tuple([start, end, start, end, start, end] + list(self.calendars))
-        result = self.sql_ex(sql_s.format(','.join(["?"] * len(self.calendars))), stuple)
-        for item, href, start, end, ref, etag, dtype, calendar in result:
+        stuple = index_tuple + tuple([start, end, start, end, start, end] + list(self.calendars))
+        result = self.sql_ex(sql_s.format(
+            ','.join(["?"] * len(self.calendars)), index_s, _RECORD_COLUMNS), stuple)
+        for item, href, start, end, ref, etag, dtype, calendar, *record in result:
             start = pytz.UTC.localize(dt.datetime.utcfromtimestamp(start))
             end = pytz.UTC.localize(dt.datetime.utcfromtimestamp(end))
-            yield item, href, start, end, ref, etag, calendar
+            yield item, href, start, end, ref, etag, calendar, _make_record(record)
 
     def get_floating_calendars(self, start: dt.datetime, end: dt.datetime) -> Iterable[str]:
         assert start.tzinfo is None
         assert end.tzinfo is None
         start_u = utils.to_unix_time(start)
         end_u = utils.to_unix_time(end)
+        self._ensure_window(start_u, end_u)
+        index_s, index_tuple = self._index_condition('recs_float', start_u, end_u)
         sql_s = (
             'SELECT events.calendar FROM '
             'recs_float JOIN events ON '
             'recs_float.href = events.href AND '
-            'recs_float.calendar = events.calendar WHERE '
+            'recs_float.calendar = events.calendar WHERE {1}'
             '(dtstart >= ? AND dtstart < ? OR '
             'dtend > ? AND dtend <= ? OR '
             'dtstart <= ? AND dtend > ? ) AND events.calendar in ({0}) '
             'ORDER BY dtstart')
-        stuple = tuple(
+        stuple = index_tuple + tuple(
             [start_u, end_u, start_u, end_u, start_u, end_u] + list(self.calendars))  # type: ignore
-        result = self.sql_ex(sql_s.format(','.join(["?"] * len(self.calendars))), stuple)
+        result = self.sql_ex(
+            sql_s.format(','.join(["?"] * len(self.calendars)), index_s), stuple)
         for calendar in result:
             yield calendar[0]
 
     def get_floating(self, start, end) \
-            -> Iterable[Tuple[str, str, dt.datetime, dt.datetime, str, str, str]]:
+            -> Iterable[Tuple[str, str, dt.datetime, dt.datetime, str, str, str,
+                              Optional[EventRecord]]]:
         """return floating events between `start` and `end`
 
         :type start: datetime.datetime
         :type end: datetime.datetime
+        :returns: see get_localized
         """
         assert start.tzinfo is None
         assert end.tzinfo is None
         start_u = utils.to_unix_time(start)
         end_u = utils.to_unix_time(end)
+        self._ensure_window(start_u, end_u)
+        index_s, index_tuple = self._index_condition('recs_float', start_u, end_u)
         sql_s = (
-            'SELECT item, recs_float.href, dtstart, dtend, ref, etag, dtype, events.calendar '
-            'FROM recs_float JOIN events ON '
+            'SELECT item, recs_float.href, dtstart, dtend, recs_float.ref, etag, dtype, '
+            'events.calendar, {2} FROM recs_float JOIN events ON '
             'recs_float.href = events.href AND '
-            'recs_float.calendar = events.calendar WHERE '
+            'recs_float.calendar = events.calendar '
+            'LEFT JOIN records ON '
+            'recs_float.href = records.href AND '
+            'recs_float.calendar = records.calendar AND '
+            'recs_float.ref = records.ref WHERE {1}'
             '(dtstart >= ? AND dtstart < ? OR '
             'dtend > ? AND dtend <= ? OR '
             'dtstart <= ? AND dtend > ? ) AND events.calendar in ({0}) '
             'ORDER BY dtstart')
-        stuple = tuple(
+        stuple = index_tuple + tuple(
             [start_u, end_u, start_u, end_u, start_u, end_u] + list(self.calendars))  # type: ignore
-        result = self.sql_ex(sql_s.format(','.join(["?"] * len(self.calendars))), stuple)
-        for item, href, start, end, ref, etag, dtype, calendar in result:
+        result = self.sql_ex(sql_s.format(
+            ','.join(["?"] * len(self.calendars)), index_s, _RECORD_COLUMNS), stuple)
+        for item, href, start, end, ref, etag, dtype, calendar, *record in result:
             start = dt.datetime.utcfromtimestamp(start)
             end = dt.datetime.utcfromtimestamp(end)
             if dtype == EventType.DATE:
                 start = start.date()
                 end = end.date()
-            yield item, href, start, end, ref, etag, calendar
+            yield item, href, start, end, ref, etag, calendar, _make_record(record)
 
     def get(self, href: str, calendar: str) -> str:
         """returns the ical string matching href and calendar"""
@@ -524,7 +1126,52 @@ class SQLiteDb(object):
 
     def search(self, search_string: str) \
             -> Iterable[Tuple[str, str, dt.datetime, dt.datetime, str, str, str]]:
-        """search for events matching `search_string`"""
+        """search for events matching `search_string`
+
+        If the full text search index is available, every word in
+        `search_string` needs to match (the beginning of) a word in the
+        event's summary, description, location, categories or attendees.
+        Words of the form `field:word` only match in that field (e.g.,
+        `location:berlin`). The best matches are returned first.
+
+        Otherwise (or for an empty `search_string`) all events containing
+        `search_string` anywhere in their iCalendar source are returned.
+        """
+        query = fts_query(search_string)
+        if self._fts and query:
+            return self._search_fts(query)
+        return self._search_like(search_string)
+
+    def _search_fts(self, query: str) \
+            -> Iterable[Tuple[str, str, dt.datetime, dt.datetime, str, str, str]]:
+        """search for events matching the FTS5 `query`, ordered by rank"""
+        results = []
+        for table in ['recs_loc', 'recs_float']:
+            sql_s = (
+                'SELECT item, {1}.href, dtstart, dtend, ref, etag, dtype, events.calendar, '
+                'events_fts.rank FROM events_fts '
+                'JOIN events ON events_fts.rowid = events.id '
+                'JOIN {1} ON {1}.href = events.href AND {1}.calendar = events.calendar '
+                'WHERE events_fts MATCH ? AND events.calendar in ({0});'
+            )
+            stuple = tuple([query] + list(self.calendars))
+            sql_s = sql_s.format(','.join(["?"] * len(self.calendars)), table)
+            results.extend((row, table) for row in self.sql_ex(sql_s, stuple))
+        results.sort(key=lambda result: (result[0][8], result[0][2]))
+        for (item, href, start, end, ref, etag, dtype, calendar, _), table in results:
+            start = dt.datetime.utcfromtimestamp(start)
+            end = dt.datetime.utcfromtimestamp(end)
+            if table == 'recs_loc':
+                start = pytz.UTC.localize(start)
+                end = pytz.UTC.localize(end)
+            if dtype == EventType.DATE:
+                start = start.date()
+                end = end.date()
+            yield item, href, start, end, ref, etag, calendar
+
+    def _search_like(self, search_string: str) \
+            -> Iterable[Tuple[str, str, dt.datetime, dt.datetime, str, str, str]]:
+        """search for events containing `search_string` in their source"""
         sql_s = (
             'SELECT item, recs_loc.href, dtstart, dtend, ref, etag, dtype, events.calendar '
             'FROM recs_loc JOIN events ON '
@@ -560,6 +1207,263 @@ class SQLiteDb(object):
             yield item, href, start, end, ref, etag, calendar
 
 
+# the events of all calendars, the full text search index refers to them by id
+_EVENTS_TABLE = '''CREATE TABLE IF NOT EXISTS {0} (
+    id INTEGER PRIMARY KEY,
+    href TEXT NOT NULL,
+    calendar TEXT NOT NULL,
+    sequence INT,
+    etag TEXT,
+    item TEXT,
+    recurring INT NOT NULL DEFAULT 0,
+    UNIQUE (href, calendar)
+    );'''
+
+# the recurrence instances of events with local (recs_loc) or floating
+# (recs_float) times, their R*Tree indexes refer to them by id
+_RECS_TABLE = '''CREATE TABLE IF NOT EXISTS {0} (
+    id INTEGER PRIMARY KEY,
+    dtstart INT NOT NULL,
+    dtend INT NOT NULL,
+    href TEXT NOT NULL REFERENCES events( href ),
+    rec_inst TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    dtype INT NOT NULL,
+    calendar TEXT NOT NULL,
+    UNIQUE (href, rec_inst, calendar)
+    );'''
+
+_RECORD_COLUMNS = ', '.join('records.' + field for field in EventRecord._fields)
+
+
+def _records(ical: icalendar.cal.Component, locale: Dict[str, Any]) \
+        -> List[Tuple[str, Optional[EventRecord]]]:
+    """the refs and records of all VEVENTs in `ical`, which must not have
+    been sanitized yet"""
+    return [(Event._get_ref(vevent, locale), record_from_vevent(vevent))
+            for vevent in ical.walk('VEVENT')]
+
+
+def _search_text(ical: icalendar.cal.Component) -> Tuple[str, ...]:
+    """the text of all VEVENTs in `ical` for the columns of the search index"""
+    fields = {column: [] for column, _ in SEARCH_FIELDS}  # type: Dict[str, List[str]]
+    for vevent in ical.walk('VEVENT'):
+        for column, prop in SEARCH_FIELDS:
+            values = vevent.get(prop, [])
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                if isinstance(value, str):
+                    fields[column].append(value)
+                else:
+                    fields[column].append(value.to_ical().decode('utf-8'))
+                if 'CN' in getattr(value, 'params', {}):
+                    fields[column].append(value.params['CN'])
+    return tuple('\n'.join(fields[column]) for column, _ in SEARCH_FIELDS)
+
+
+def prepare_update(vevent_str: str, href: str, calendar: str, locale: Dict[str, Any],
+                   window: Tuple[Optional[int], Optional[int]]=(None, None)) -> PreparedEvent:
+    """parse, check and expand an event, everything `SQLiteDb.update` does
+    before writing to the database
+
+    As this doesn't need the database, it can be run in other processes. See
+    `SQLiteDb.update` for the parameters.
+
+    :param window: the window of recurrence instances stored for `calendar`
+    """
+    ical = utils.cal_from_ics(vevent_str)
+    check_for_errors(ical, calendar, href)
+    # records need to be created before sanitizing the vevents, as they
+    # need to describe the event as parsed from `vevent_str`
+    records = _records(ical, locale)
+    if not utils.assert_only_one_uid(ical):
+        logger.warning(
+            "The .ics file at {}/{} contains multiple UIDs.\n"
+            "This should not occur in vdir .ics files.\n"
+            "If you didn't edit the file by hand, please report a bug "
+            "at https://github.com/pimutils/khal/issues .\n"
+            "If you want to import it, please use `khal import FILE`."
+            "".format(calendar, href)
+        )
+        raise NonUniqueUID
+    vevents = (utils.sanitize(c, locale['default_timezone'], href, calendar) for
+               c in ical.walk() if c.name == 'VEVENT')
+    recurring = False
+    reach = 0
+    # the instances are collected and then compared to those already stored
+    # by `SQLiteDb.update_prepared`, so that editing an event only touches
+    # the rows of the instances that actually changed
+    instances = {'recs_loc': dict(), 'recs_float': dict()}  # type: Dict[str, Dict]
+    for vevent in sorted(vevents, key=utils.sort_key):
+        check_for_errors(vevent, calendar, href)
+        check_support(vevent, href, calendar)
+        reach = max(reach, _collect_instances(vevent, href, window, instances))
+        if RECURRENCE_ID not in vevent and ('RRULE' in vevent or 'RDATE' in vevent):
+            recurring = True
+    return PreparedEvent(href, calendar, vevent_str, instances, records, recurring, reach,
+                         _search_text(ical))
+
+
+def _expand_instances(vevent: icalendar.cal.Event, href: str,
+                      window: Tuple[Optional[int], Optional[int]]) \
+        -> Tuple[str, bool, List[tuple], Optional[int]]:
+    """expand `vevent`'s recurrence rules (if needed)
+
+    :param window: only instances of recurring events starting between
+        those two unix timestamps are returned, None meaning unbounded
+    :returns: the table the instances belong in, whether `vevent` is a
+        RANGE=THISANDFUTURE override, the instances as
+        (dtstart, dtend, ref, dtype, rec_inst), or for THISANDFUTURE overrides
+        as (start shift, end shift, ref, rec_inst) to be applied to all
+        instances from rec_inst on, and the reach of the instances (None if
+        they don't count towards their calendar's reach)
+    """
+    # TODO FIXME this function is a steaming pile of shit
+    rec_id = vevent.get(RECURRENCE_ID)
+    if rec_id is None:
+        rrange = None
+    else:
+        rrange = rec_id.params.get('RANGE')
+
+    # testing on datetime.date won't work as datetime is a child of date
+    if not isinstance(vevent['DTSTART'].dt, dt.datetime):
+        dtype = EventType.DATE
+    else:
+        dtype = EventType.DATETIME
+    if ('TZID' in vevent['DTSTART'].params and dtype == EventType.DATETIME) or \
+            getattr(vevent['DTSTART'].dt, 'tzinfo', None):
+        recs_table = 'recs_loc'
+    else:
+        recs_table = 'recs_float'
+
+    reach = 0
+    thisandfuture = (rrange == THISANDFUTURE)
+    if thisandfuture:
+        start_shift, duration = calc_shift_deltas(vevent)
+        start_shift_seconds = start_shift.days * 3600 * 24 + start_shift.seconds
+        duration_seconds = duration.days * 3600 * 24 + duration.seconds
+        reach = max(start_shift_seconds + duration_seconds, -start_shift_seconds)
+
+    dtstartend = utils.expand(vevent, href, *window)
+    if not dtstartend:
+        # Does this event even have dates? Technically it is possible for
+        # events to be empty/non-existent by deleting all their recurrences
+        # through EXDATE.
+        return recs_table, thisandfuture, [], None
+
+    rows = []
+    for dtstart, dtend in dtstartend:
+        dbstart = utils.to_unix_time(dtstart)
+        dbend = utils.to_unix_time(dtend)
+
+        if rec_id is not None:
+            ref = rec_inst = str(utils.to_unix_time(rec_id.dt))
+        else:
+            rec_inst = str(dbstart)
+            ref = PROTO
+
+        if thisandfuture:
+            rows.append((
+                start_shift_seconds, start_shift_seconds + duration_seconds, ref, rec_inst))
+        else:
+            rows.append((dbstart, dbend, ref, dtype, rec_inst))
+            if rec_id is None:
+                reach = max(reach, dbend - dbstart)
+    if rec_id is None or thisandfuture:
+        return recs_table, thisandfuture, rows, reach
+    return recs_table, thisandfuture, rows, None
+
+
+def _collect_instances(vevent: icalendar.cal.Event, href: str,
+                       window: Tuple[Optional[int], Optional[int]],
+                       instances: Dict[str, Dict[str, tuple]]) -> int:
+    """expand `vevent` and add its instances to `instances`, by table and
+    rec_inst, as (dtstart, dtend, ref, dtype)
+
+    :returns: the reach of the instances
+    """
+    recs_table, thisandfuture, rows, reach = _expand_instances(vevent, href, window)
+    stored = instances[recs_table]
+    for row in rows:
+        if thisandfuture:
+            # mirrors the UPDATE statement in `SQLiteDb._update_impl`
+            shift, end_shift, ref, rec_inst = row
+            for inst, (_, _, _, inst_dtype) in list(stored.items()):
+                if inst >= rec_inst:
+                    stored[inst] = (int(inst) + shift, int(inst) + end_shift, ref, inst_dtype)
+        else:
+            dbstart, dbend, ref, inst_dtype, rec_inst = row
+            stored[rec_inst] = (dbstart, dbend, ref, inst_dtype)
+    return reach or 0
+
+
+def localized_overlaps(dtstart: int, dtend: int, start: int, end: int) -> bool:
+    """if a localized instance from `dtstart` to `dtend` is found between
+    `start` and `end` by `SQLiteDb.get_localized` (all in unix time)"""
+    return start <= dtstart <= end or dtstart <= end and dtend > start
+
+
+def floating_overlaps(dtstart: int, dtend: int, start: int, end: int) -> bool:
+    """if a floating instance from `dtstart` to `dtend` is found between
+    `start` and `end` by `SQLiteDb.get_floating` (all in unix time)"""
+    return start <= dtstart < end or start < dtend <= end or dtstart <= start < dtend
+
+
+def _days_mask(first: dt.date, last: dt.date) -> int:
+    """the occupancy bits of the days between `first` and `last` (both
+    included), which need to be in the same year"""
+    assert first.year == last.year
+    return (1 << first.timetuple().tm_yday + (last - first).days) - \
+        (1 << first.timetuple().tm_yday - 1)
+
+
+def _make_record(row: List[Any]) -> Optional[EventRecord]:
+    """return the EventRecord from the columns in _RECORD_COLUMNS, None if
+    there is no record"""
+    record = EventRecord(*row)
+    if record.summary is None:
+        return None
+    return record._replace(recurring=bool(record.recurring), alarm=bool(record.alarm))
+
+
+def fts_query(search_string: str) -> str:
+    """translate a search string into an FTS5 query
+
+    every word becomes a prefix query, words of the form `field:word` are
+    restricted to that field (one of SEARCH_FIELDS)
+
+    >>> fts_query('party location:berl')
+    '"party"* location : "berl"*'
+    """
+    columns = [column for column, _ in SEARCH_FIELDS]
+    terms = []
+    for word in search_string.split():
+        column, colon, term = word.partition(':')
+        if colon and term and column.lower() in columns:
+            prefix = column.lower() + ' : '
+        else:
+            prefix, term = '', word
+        terms.append('{}"{}"*'.format(prefix, term.replace('"', '""')))
+    return ' '.join(terms)
+
+
+class _WarningFilter(logging.Filter):
+    def filter(self, record):
+        return record.levelno < logging.WARNING
+
+
+@contextlib.contextmanager
+def _suppress_warnings():
+    """suppress khal's log messages of level WARNING or more severe"""
+    warning_filter = _WarningFilter()
+    logger.addFilter(warning_filter)
+    try:
+        yield
+    finally:
+        logger.removeFilter(warning_filter)
+
+
 def check_support(vevent: icalendar.cal.Event, href: str, calendar: str):
     """test if all icalendar features used in this event are supported,
     raise `UpdateFailed` otherwise.
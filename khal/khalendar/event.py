@@ -22,9 +22,11 @@
 """This module contains the event model with all relevant subclasses and some
 helper functions."""
 
+import copy
 import datetime as dt
 import logging
 import os
+from collections import namedtuple
 
 import icalendar
 import pytz
@@ -38,6 +40,14 @@ from ..parse_datetime import timedelta2str
 
 logger = logging.getLogger('khal')
 
+# the properties of an event needed for listing it, as stored in the database
+# `start_tz` and `end_tz` are the names of the pytz timezones DTSTART and DTEND
+# are localized in (None meaning the default timezone)
+EventRecord = namedtuple('EventRecord', [
+    'summary', 'location', 'description', 'categories', 'status', 'recurring',
+    'recurpattern', 'alarm', 'start_tz', 'end_tz',
+])
+
 
 class Event(object):
     """base Event class for representing a *recurring instance* of an Event
@@ -59,10 +69,23 @@ class Event(object):
         :type start: datetime.date
         :param end: end datetime of this event instance in unix time
         :type end: datetime.date
+        :param item: if `vevents` is None, the iCalendar text they are parsed
+            from once they are needed
+        :type item: str
+        :param record: if `vevents` is None, the properties of this event
+            used until `item` gets parsed
+        :type record: EventRecord
+        :param load_vevents: if `vevents` is None, returns the parsed `item`
+            instead of parsing it here, the vevents returned might be shared
+            with other events and get copied before this event changes them
+        :type load_vevents: callable
         """
         if self.__class__.__name__ == 'Event':
             raise ValueError('do not initialize this class directly')
         self._vevents = vevents
+        self._item = kwargs.pop('item', None)
+        self._load_vevents = kwargs.pop('load_vevents', None)
+        self._record = kwargs.pop('record', None)
         self._locale = kwargs.pop('locale', None)
         self.readonly = kwargs.pop('readonly', None)
         self.href = kwargs.pop('href', None)
@@ -114,6 +137,16 @@ class Event(object):
             cls = AllDayEvent
         return cls
 
+    @staticmethod
+    def _get_ref(vevent, locale):
+        """return the ref of `vevent` within the event it belongs to"""
+        if 'RECURRENCE-ID' not in vevent:
+            return 'PROTO'
+        if invalid_timezone(vevent['RECURRENCE-ID']):
+            recur_id = locale['default_timezone'].localize(vevent['RECURRENCE-ID'].dt)
+            return str(to_unix_time(recur_id))
+        return str(to_unix_time(vevent['RECURRENCE-ID'].dt))
+
     @classmethod
     def fromVEvents(cls, events_list, ref=None, **kwargs):
         """
@@ -123,16 +156,7 @@ class Event(object):
 
         vevents = dict()
         for event in events_list:
-            if 'RECURRENCE-ID' in event:
-                if invalid_timezone(event['RECURRENCE-ID']):
-                    default_timezone = kwargs['locale']['default_timezone']
-                    recur_id = default_timezone.localize(event['RECURRENCE-ID'].dt)
-                    ident = str(to_unix_time(recur_id))
-                else:
-                    ident = str(to_unix_time(event['RECURRENCE-ID'].dt))
-                vevents[ident] = event
-            else:
-                vevents['PROTO'] = event
+            vevents[cls._get_ref(event, kwargs.get('locale'))] = event
 
         if ref is None:
             ref = 'PROTO' if ref in vevents.keys() else list(vevents.keys())[0]
@@ -154,6 +178,48 @@ class Event(object):
         events = [item for item in calendar_collection.walk() if item.name == 'VEVENT']
         return cls.fromVEvents(events, ref, **kwargs)
 
+    @classmethod
+    def fromRecord(cls, event_str, record, ref, **kwargs):
+        """create an event instance from its `record`, `event_str` only gets
+        parsed once any other property of the event is needed (e.g., for
+        editing it)
+
+        :param record: might be None, then `event_str` is parsed as soon as
+            the event is created
+        :type record: EventRecord
+        """
+        instcls = cls._get_type_from_date(kwargs['start'])
+        return instcls(None, ref=ref, item=event_str, record=record, **kwargs)
+
+    @classmethod
+    def parse_vevents(cls, event_str, locale):
+        """parse `event_str` into a dict of its VEVENTs by their ref"""
+        vevents = cal_from_ics(event_str).walk('VEVENT')
+        return {cls._get_ref(vevent, locale): vevent for vevent in vevents}
+
+    @property
+    def _vevents(self):
+        if self._parsed_vevents is None:
+            if self._load_vevents is not None:
+                self._parsed_vevents = self._load_vevents()
+                self._shared = True
+            else:
+                self._parsed_vevents = self.parse_vevents(self._item, self._locale)
+            self._record = None
+        return self._parsed_vevents
+
+    @_vevents.setter
+    def _vevents(self, vevents):
+        self._parsed_vevents = vevents
+        self._shared = False
+
+    def _unshare(self):
+        """copy this event's vevents if they are shared with other events,
+        needs to be called before changing them"""
+        vevents = self._vevents
+        if self._shared:
+            self._vevents = copy.deepcopy(vevents)
+
     def __lt__(self, other):
         start = self.start_local
         other_start = other.start_local
@@ -178,6 +244,7 @@ class Event(object):
 
         beware, this methods performs some open heart surgery
         """
+        self._unshare()
         if type(start) != type(end):  # flake8: noqa
             raise ValueError('DTSTART and DTEND should be of the same type (datetime or date)')
         self.__class__ = self._get_type_from_date(start)
@@ -197,12 +264,16 @@ class Event(object):
 
     @property
     def recurring(self):
+        if self._record is not None:
+            return self._record.recurring
         return 'RRULE' in self._vevents[self.ref] or \
             'RECURRENCE-ID' in self._vevents[self.ref] or \
             'RDATE' in self._vevents[self.ref]
 
     @property
     def recurpattern(self):
+        if self._record is not None:
+            return self._record.recurpattern
         if 'RRULE' in self._vevents[self.ref]:
             return self._vevents[self.ref]['RRULE'].to_ical().decode('utf-8')
         else:
@@ -216,6 +287,7 @@ class Event(object):
             return icalendar.vRecur()
 
     def update_rrule(self, rrule):
+        self._unshare()
         self._vevents['PROTO'].pop('RRULE')
         if rrule is not None:
             self._vevents['PROTO'].add('RRULE', rrule)
@@ -233,6 +305,7 @@ class Event(object):
         """update the SEQUENCE number, call before saving this event"""
         # TODO we might want to do this automatically in raw() everytime
         # the event has changed, this will f*ck up the tests though
+        self._unshare()
         try:
             self._vevents[self.ref]['SEQUENCE'] += 1
         except KeyError:
@@ -243,6 +316,7 @@ class Event(object):
         if self._locale['unicode_symbols']:
             return dict(
                 recurring='\N{Clockwise gapped circle arrow}',
+                alarm='\N{Alarm clock}',
                 range='\N{Left right arrow}',
                 range_end='\N{Rightwards arrow to bar}',
                 range_start='\N{Rightwards arrow from bar}',
@@ -251,6 +325,7 @@ class Event(object):
         else:
             return dict(
                 recurring='(R)',
+                alarm='(A)',
                 range='<->',
                 range_end='->|',
                 range_start='|->',
@@ -280,10 +355,9 @@ class Event(object):
 
     @property
     def duration(self):
-        try:
+        if self._record is None and 'DURATION' in self._vevents[self.ref]:
             return self._vevents[self.ref]['DURATION'].dt
-        except KeyError:
-            return self.end - self.start
+        return self.end - self.start
 
     @property
     def uid(self):
@@ -351,6 +425,8 @@ class Event(object):
 
     @property
     def summary(self):
+        if self._record is not None:
+            return self._record.summary
         bday = self._vevents[self.ref].get('x-birthday', None)
         if bday:
             number = self.start_local.year - int(bday[:4])
@@ -374,6 +450,7 @@ class Event(object):
             return self._vevents[self.ref].get('SUMMARY', '')
 
     def update_summary(self, summary):
+        self._unshare()
         self._vevents[self.ref]['SUMMARY'] = summary
 
     @staticmethod
@@ -384,6 +461,12 @@ class Event(object):
         return alarm.get('ACTION') == 'DISPLAY' and \
             isinstance(alarm.get('TRIGGER').dt, dt.timedelta)
 
+    @property
+    def has_alarms(self):
+        if self._record is not None:
+            return self._record.alarm
+        return bool(self.alarms)
+
     @property
     def alarms(self):
         """
@@ -398,6 +481,7 @@ class Event(object):
         """
         Replaces all alarms in the event that can be handled with the ones provided.
         """
+        self._unshare()
         components = self._vevents[self.ref].subcomponents
         # remove all alarms that we can handle from the subcomponents
         components = [c for c in components
@@ -413,9 +497,12 @@ class Event(object):
 
     @property
     def location(self):
+        if self._record is not None:
+            return self._record.location
         return self._vevents[self.ref].get('LOCATION', '')
 
     def update_location(self, location):
+        self._unshare()
         if location:
             self._vevents[self.ref]['LOCATION'] = location
         else:
@@ -423,9 +510,12 @@ class Event(object):
 
     @property
     def categories(self):
-        return self._vevents[self.ref].get('CATEGORIES', '')
+        if self._record is not None:
+            return self._record.categories
+        return _categories_text(self._vevents[self.ref].get('CATEGORIES', ''))
 
     def update_categories(self, categories):
+        self._unshare()
         if categories.strip():
             self._vevents[self.ref]['CATEGORIES'] = categories
         else:
@@ -433,9 +523,12 @@ class Event(object):
 
     @property
     def description(self):
+        if self._record is not None:
+            return self._record.description
         return self._vevents[self.ref].get('DESCRIPTION', '')
 
     def update_description(self, description):
+        self._unshare()
         if description:
             self._vevents[self.ref]['DESCRIPTION'] = description
         else:
@@ -449,6 +542,12 @@ class Event(object):
             recurstr = ''
         return recurstr
 
+    @property
+    def _alarm_str(self):
+        if self.has_alarms:
+            return ' ' + self.symbol_strings['alarm']
+        return ''
+
     def format(self, format_string, relative_to, env={}, colors=True):
         """
         :param colors: determines if colors codes should be printed or not
@@ -572,6 +671,7 @@ class Event(object):
 
         attributes["repeat-symbol"] = self._recur_str
         attributes["repeat-pattern"] = self.recurpattern
+        attributes["alarm-symbol"] = self._alarm_str
         attributes["title"] = self.summary
         attributes["description"] = self.description.strip()
         attributes["description-separator"] = ""
@@ -624,6 +724,7 @@ class Event(object):
 
     def delete_instance(self, instance):
         """delete an instance from this event"""
+        self._unshare()
         assert self.recurring
         delete_instance(self._vevents['PROTO'], instance)
 
@@ -643,6 +744,8 @@ class Event(object):
 
     @property
     def status(self):
+        if self._record is not None:
+            return self._record.status
         return self._vevents[self.ref].get('STATUS', '')
 
 
@@ -656,6 +759,29 @@ class LocalizedEvent(DatetimeEvent):
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        if self._record is not None:
+            starttz = self._record.start_tz and pytz.timezone(self._record.start_tz)
+            endtz = self._record.end_tz and pytz.timezone(self._record.end_tz)
+        else:
+            starttz, endtz = self._get_timezones(kwargs)
+        if starttz is None:
+            starttz = self._locale['default_timezone']
+        if endtz is None:
+            endtz = self._locale['default_timezone']
+
+        if is_aware(self._start):
+            self._start = self._start.astimezone(starttz)
+        else:
+            self._start = starttz.localize(self._start)
+
+        if is_aware(self._end):
+            self._end = self._end.astimezone(endtz)
+        else:
+            self._end = endtz.localize(self._end)
+
+    def _get_timezones(self, kwargs):
+        """return the timezones DTSTART and DTEND are localized in, None if
+        they are not localized"""
         try:
             starttz = getattr(self._vevents[self.ref]['DTSTART'].dt, 'tzinfo', None)
         except KeyError:
@@ -670,24 +796,11 @@ class LocalizedEvent(DatetimeEvent):
                 msg
             )
 
-        if starttz is None:
-            starttz = self._locale['default_timezone']
         try:
             endtz = getattr(self._vevents[self.ref]['DTEND'].dt, 'tzinfo', None)
         except KeyError:
             endtz = starttz
-        if endtz is None:
-            endtz = self._locale['default_timezone']
-
-        if is_aware(self._start):
-            self._start = self._start.astimezone(starttz)
-        else:
-            self._start = starttz.localize(self._start)
-
-        if is_aware(self._end):
-            self._end = self._end.astimezone(endtz)
-        else:
-            self._end = endtz.localize(self._end)
+        return starttz, endtz
 
     @property
     def start_local(self):
@@ -736,10 +849,66 @@ class AllDayEvent(Event):
 
     @property
     def duration(self):
-        try:
+        if self._record is None and 'DURATION' in self._vevents[self.ref]:
             return self._vevents[self.ref]['DURATION'].dt
-        except KeyError:
-            return self.end - self.start + dt.timedelta(days=1)
+        return self.end - self.start + dt.timedelta(days=1)
+
+
+def _categories_text(categories):
+    """return the value(s) of a CATEGORIES property as a comma separated string"""
+    if not isinstance(categories, list):
+        categories = [categories]
+    return ','.join(
+        value if isinstance(value, str) else value.to_ical().decode('utf-8')
+        for value in categories)
+
+
+def _pytz_name(tzinfo):
+    """return the name of `tzinfo` if it can be recreated from that name via
+    pytz, None otherwise"""
+    zone = getattr(tzinfo, 'zone', None)
+    if zone is None:
+        return None
+    try:
+        timezone = pytz.timezone(zone)
+    except pytz.UnknownTimeZoneError:
+        return None
+    if timezone is tzinfo or getattr(timezone, '_tzinfos', None) is \
+            getattr(tzinfo, '_tzinfos', False):
+        return zone
+    return None
+
+
+def record_from_vevent(vevent):
+    """return the EventRecord of `vevent`
+
+    :type vevent: icalendar.cal.Event
+    :returns: None if the event can only be shown after parsing it (e.g.,
+        birthdays or events localized in a VTIMEZONE pytz doesn't know)
+    :rtype: EventRecord
+    """
+    if 'X-BIRTHDAY' in vevent or 'DTSTART' not in vevent:
+        return None
+    start_tz = getattr(vevent['DTSTART'].dt, 'tzinfo', None)
+    end_tz = getattr(vevent['DTEND'].dt, 'tzinfo', None) if 'DTEND' in vevent else start_tz
+    start_tz_name, end_tz_name = _pytz_name(start_tz), _pytz_name(end_tz)
+    if (start_tz is not None and start_tz_name is None) or \
+            (end_tz is not None and end_tz_name is None):
+        return None
+
+    return EventRecord(
+        summary=vevent.get('SUMMARY', ''),
+        location=vevent.get('LOCATION', ''),
+        description=vevent.get('DESCRIPTION', ''),
+        categories=_categories_text(vevent.get('CATEGORIES', '')),
+        status=vevent.get('STATUS', ''),
+        recurring=any(prop in vevent for prop in ['RRULE', 'RECURRENCE-ID', 'RDATE']),
+        recurpattern=vevent['RRULE'].to_ical().decode('utf-8') if 'RRULE' in vevent else '',
+        alarm=any(component.name == 'VALARM' and Event._can_handle_alarm(component)
+                  for component in vevent.subcomponents),
+        start_tz=start_tz_name,
+        end_tz=end_tz_name,
+    )
 
 
 def create_timezone(tz, first_date=None, last_date=None):
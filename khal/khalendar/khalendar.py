@@ -25,23 +25,49 @@ CalendarCollection should enable modifying and querying a collection of
 calendars. Each calendar is defined by the contents of a vdir, but uses an
 SQLite db for caching (see backend if you're interested).
 """
+import contextlib
+import copy
 import datetime as dt
 import itertools
 import logging
 import os
 import os.path
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union  # noqa
-
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional, Set,  # noqa
+                    Tuple, Union)
+
+from .. import utils
 from . import backend
-from .event import Event
+from .event import Event, EventRecord
 from .exceptions import (CouldNotCreateDbDir, DuplicateUid, NonUniqueUID,
                          ReadOnlyCalendarError, UnsupportedFeatureError,
                          UpdateFailed)
 from .vdir import (AlreadyExistingError, CollectionNotFoundError, Vdir,
-                   get_etag_from_file)
+                   get_etag_from_file, is_legacy_etag)
+from .watcher import VdirWatcher
 
 logger = logging.getLogger('khal')
 
+# events are only parsed in parallel if at least this many of a calendar
+# changed, otherwise starting the worker processes isn't worth it
+PARALLEL_MIN = 50
+
+# if more events of a calendar changed, the days they are on aren't looked up
+# (update_db reports that events might have changed on any day)
+MAX_TRACKED_CHANGES = 100
+
+# the number of days whose events are fetched from the cache at once by
+# `CalendarCollection.get_events_by_day`, limits the memory used for long ranges
+QUERY_DAYS = 31
+
+# updates running in the background (see `update_in_thread`) commit after
+# this many events, the thread using the collection may have to wait for them
+# when writing to the db
+BACKGROUND_BATCH = 20
+
 
 def create_directory(path: str):
     if not os.path.isdir(path):
@@ -54,6 +80,96 @@ def create_directory(path: str):
             raise CouldNotCreateDbDir()
 
 
+class _LogRecords(list):
+    """a queue for logging.handlers.QueueHandler, collecting log records"""
+    put_nowait = list.append
+
+
+def _log_skipped(error: Exception, href: str, calendar: str) -> None:
+    """log that the event at `href` could not be updated because of `error`,
+    must be called while handling `error`"""
+    if not isinstance(error, (UpdateFailed, UnsupportedFeatureError, NonUniqueUID)):
+        logger.exception('Unknown exception happened.')
+    logger.warning(
+        'Skipping {0}/{1}: {2}\n'
+        'This event will not be available in khal.'.format(calendar, href, str(error)))
+
+
+def _prepare_vevent(task: Tuple[Vdir, str, str, Dict[str, Any], tuple]) \
+        -> Tuple[Optional[backend.PreparedEvent], str, List[logging.LogRecord]]:
+    """read, parse and expand an event in a worker process
+
+    :returns: the prepared event (None if it can't be used), its etag and the
+        log records emitted meanwhile, which are returned to the main process
+        instead of being emitted here
+    """
+    import logging.handlers
+    storage, href, calendar, locale, window = task
+    records = _LogRecords()
+    handlers, propagate = logger.handlers, logger.propagate
+    logger.handlers, logger.propagate = [logging.handlers.QueueHandler(records)], False
+    try:
+        event, etag = storage.get(href)
+        try:
+            prepared = backend.prepare_update(
+                event.raw, href, calendar, locale, window)  # type: Optional[backend.PreparedEvent]
+        except Exception as e:
+            _log_skipped(e, href, calendar)
+            prepared = None
+    finally:
+        logger.handlers, logger.propagate = handlers, propagate
+    return prepared, etag, records
+
+
+def _unix_bounds(event: Event) -> Tuple[int, int]:
+    """return the start and end of `event` in unix time, as stored in the
+    cache"""
+    if event.allday:
+        # the end of an allday event is inclusive, the one stored exclusive
+        return (utils.to_unix_time(dt.datetime.combine(event.start, dt.time.min)),
+                utils.to_unix_time(dt.datetime.combine(
+                    event.end + dt.timedelta(days=1), dt.time.min)))
+    return utils.to_unix_time(event.start), utils.to_unix_time(event.end)
+
+
+class VEventsCache(object):
+    """LRU cache of parsed events, keyed by their calendar, href and etag
+
+    All instances of a recurring event share the vevents parsed once, events
+    copy them before changing them (see Event._unshare).
+    """
+
+    def __init__(self, locale: Dict[str, Any], size: int=1000) -> None:
+        self._locale = locale
+        self._size = size
+        # (calendar, href) -> (etag, vevents), least recently used first
+        self._cache = OrderedDict()  # type: OrderedDict
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, calendar: str, href: str, etag: str, item: str) -> Dict[str, Any]:
+        """return the vevents parsed from `item`, the event's source"""
+        key = (calendar, href)
+        if key in self._cache and self._cache[key][0] == etag:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key][1]
+        self.misses += 1
+        logger.debug('parsing {}/{}, parsed events cache hit rate: {:.0%} ({} of {})'.format(
+            calendar, href, self.hits / (self.hits + self.misses),
+            self.hits, self.hits + self.misses))
+        vevents = Event.parse_vevents(item, self._locale)
+        self._cache[key] = (etag, vevents)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._size:
+            self._cache.popitem(last=False)
+        return vevents
+
+    def invalidate(self, calendar: str, href: str) -> None:
+        """remove the event at `href` in `calendar` from the cache"""
+        self._cache.pop((calendar, href), None)
+
+
 class CalendarCollection(object):
     """CalendarCollection allows access to various calendars stored in vdirs
 
@@ -68,7 +184,18 @@ class CalendarCollection(object):
                  highlight_event_days: bool=False,
                  locale: Dict[str, Any]=dict(),
                  dbpath: Optional[str]=None,
+                 horizon: Optional[dt.timedelta]=None,
+                 jobs: int=1,
+                 update: bool=True,
+                 max_cache_age: Optional[dt.timedelta]=None,
                  ) -> None:
+        """
+        :param jobs: number of processes parsing and expanding events when
+            updating the db
+        :param update: if False, the db is not updated from the vdirs yet,
+            see `update_db` and `update_in_thread`
+        :param max_cache_age: passed to the initial `update_db`
+        """
         assert dbpath is not None
         assert calendars is not None
         self._calendars = calendars
@@ -95,9 +222,17 @@ class CalendarCollection(object):
         self.color = color
         self.highlight_event_days = highlight_event_days
         self._locale = locale
-        self._backend = backend.SQLiteDb(self.names, dbpath, self._locale)
+        self._jobs = jobs
+        self._dbpath = dbpath
+        self._horizon = horizon
+        self._backend = backend.SQLiteDb(self.names, dbpath, self._locale, horizon=horizon)
+        self._vevents_cache = VEventsCache(self._locale)
         self._last_ctags = dict()  # type: Dict[str, str]
-        self.update_db()
+        # the calendars with events on a day, see `get_calendars_between`
+        self._day_calendars = dict()  # type: Dict[dt.date, Set[str]]
+        self._day_calendars_generation = 0
+        if update:
+            self.update_db(max_age=max_cache_age)
 
     @property
     def writable_names(self) -> List[str]:
@@ -150,48 +285,131 @@ class CalendarCollection(object):
         localized_events = self.get_localized(localize(start), localize(end))
         return itertools.chain(floating_events, localized_events)
 
-    def get_calendars_on(self, day: dt.date) -> List[str]:
-        start = dt.datetime.combine(day, dt.time.min)
-        end = dt.datetime.combine(day, dt.time.max)
+    def get_events_by_day(self, start: dt.datetime, end: dt.datetime
+                          ) -> Iterator[Tuple[dt.datetime, dt.datetime, List[Event]]]:
+        """yields the events between `start` and `end`, by day
+
+        The cache is queried once for every `QUERY_DAYS` days, each day gets the
+        events `get_localized` and `get_floating` would find for it, sorted.
+
+        :returns: (day's start, day's end, events) tuples
+        """
         localize = self._locale['local_timezone'].localize
-        calendars = itertools.chain(
-            self._backend.get_floating_calendars(start, end),
-            self._backend.get_localized_calendars(localize(start), localize(end)),
-        )
-        return list(set(calendars))
+        while start < end:
+            query_end = min(end, dt.datetime.combine(
+                start.date() + dt.timedelta(days=QUERY_DAYS - 1), dt.time.max))
+            localized = [(event, ) + _unix_bounds(event)
+                         for event in self.get_localized(localize(start), localize(query_end))]
+            floating = [(event, ) + _unix_bounds(event)
+                        for event in self.get_floating(start, query_end)]
+
+            while start < query_end:
+                if start.date() == query_end.date():
+                    day_end = query_end
+                else:
+                    day_end = dt.datetime.combine(start.date(), dt.time.max)
+                start_u = utils.to_unix_time(localize(start))
+                end_u = utils.to_unix_time(localize(day_end))
+                events = sorted(event for event, dtstart, dtend in localized
+                                if backend.localized_overlaps(dtstart, dtend, start_u, end_u))
+                start_u, end_u = utils.to_unix_time(start), utils.to_unix_time(day_end)
+                events_float = sorted(event for event, dtstart, dtend in floating
+                                      if backend.floating_overlaps(dtstart, dtend, start_u, end_u))
+                yield start, day_end, sorted(events + events_float)
+                start = dt.datetime(*start.date().timetuple()[:3]) + dt.timedelta(days=1)
 
-    def update(self, event: Event):
-        """update `event` in vdir and db"""
+    def get_calendars_on(self, day: dt.date) -> List[str]:
+        return sorted(self.get_calendars_between(day, day)[day])
+
+    def get_calendars_between(self, start: dt.date, end: dt.date) -> Dict[dt.date, Set[str]]:
+        """return the calendars with events on each day between `start` and
+        `end` (both included)
+
+        The days are remembered until events on them change.
+        """
+        days = [start + dt.timedelta(days=number) for number in range((end - start).days + 1)]
+        if all(day in self._day_calendars for day in days):
+            return {day: self._day_calendars[day] for day in days}
+        generation = self._day_calendars_generation
+        calendars = self._backend.get_calendars_between(start, end)
+        # unless events changed meanwhile
+        if generation == self._day_calendars_generation:
+            self._day_calendars.update(calendars)
+        return calendars
+
+    def _forget_days_of(self, href: str, calendar: str) -> List[Tuple[dt.date, dt.date]]:
+        """forget the calendars remembered for the days the event at `href`
+        is on
+
+        :returns: the (first, last) intervals of these days
+        """
+        days = self._backend.get_day_intervals(href, calendar)
+        self._forget_calendars_between(days)
+        return days
+
+    def _forget_calendars_between(
+            self, days: Optional[List[Tuple[dt.date, dt.date]]]=None) -> None:
+        """forget the calendars remembered for the days in the (first, last)
+        intervals `days` (all days if None)"""
+        self._day_calendars_generation += 1
+        if days is None:
+            self._day_calendars.clear()
+            return
+        for day in [day for day in self._day_calendars
+                    if any(first <= day <= last for first, last in days)]:
+            self._day_calendars.pop(day, None)
+
+    def update(self, event: Event) -> List[Tuple[dt.date, dt.date]]:
+        """update `event` in vdir and db
+
+        :returns: the (first, last) intervals of the days the event was or
+            now is on
+        """
         assert event.etag
         if self._calendars[event.calendar]['readonly']:
             raise ReadOnlyCalendarError()
         with self._backend.at_once():
+            ctag = self._local_ctag(event.calendar)
             event.etag = self._storages[event.calendar].update(event.href, event, event.etag)
+            self._vevents_cache.invalidate(event.calendar, event.href)
+            days = self._forget_days_of(event.href, event.calendar)
             self._backend.update(event.raw, event.href, event.etag, calendar=event.calendar)
-            self._backend.set_ctag(self._local_ctag(event.calendar), calendar=event.calendar)
+            days += self._forget_days_of(event.href, event.calendar)
+            self._set_ctag(event.calendar, ctag)
+        return utils.merge_date_intervals(days)
+
+    def force_update(self, event: Event,
+                     collection: Optional[str]=None) -> List[Tuple[dt.date, dt.date]]:
+        """update `event` even if an event with the same uid/href already exists
 
-    def force_update(self, event: Event, collection: Optional[str]=None):
-        """update `event` even if an event with the same uid/href already exists"""
+        :returns: like `update`
+        """
         calendar = collection if collection is not None else event.calendar
         if self._calendars[calendar]['readonly']:
             raise ReadOnlyCalendarError()
 
         with self._backend.at_once():
+            ctag = self._local_ctag(calendar)
             try:
                 href, etag = self._storages[calendar].upload(event)
             except AlreadyExistingError as error:
                 href = error.existing_href
                 _, etag = self._storages[calendar].get(href)
                 etag = self._storages[calendar].update(href, event, etag)
+            self._vevents_cache.invalidate(calendar, href)
+            days = self._forget_days_of(href, calendar)
             self._backend.update(event.raw, href, etag, calendar=calendar)
-            self._backend.set_ctag(self._local_ctag(calendar), calendar=calendar)
+            days += self._forget_days_of(href, calendar)
+            self._set_ctag(calendar, ctag)
+        return utils.merge_date_intervals(days)
 
-    def new(self, event: Event, collection: Optional[str]=None):
+    def new(self, event: Event, collection: Optional[str]=None) -> List[Tuple[dt.date, dt.date]]:
         """save a new event to the vdir and the database
 
         param event: the event that should be updated, will get a new href and
             etag properties
         type event: event.Event
+        :returns: the (first, last) intervals of the days the event is on
         """
         calendar = collection if collection is not None else event.calendar
         if hasattr(event, 'etag'):
@@ -200,20 +418,48 @@ class CalendarCollection(object):
             raise ReadOnlyCalendarError()
 
         with self._backend.at_once():
-
+            ctag = self._local_ctag(calendar)
             try:
                 event.href, event.etag = self._storages[calendar].upload(event)
             except AlreadyExistingError as Error:
                 href = getattr(Error, 'existing_href', None)
                 raise DuplicateUid(href)
+            self._vevents_cache.invalidate(calendar, event.href)
             self._backend.update(event.raw, event.href, event.etag, calendar=calendar)
-            self._backend.set_ctag(self._local_ctag(calendar), calendar=calendar)
+            days = self._forget_days_of(event.href, calendar)
+            self._set_ctag(calendar, ctag)
+        return days
 
-    def delete(self, href: str, etag: str, calendar: str):
+    def delete(self, href: str, etag: str, calendar: str) -> List[Tuple[dt.date, dt.date]]:
+        """delete the event at `href` from the vdir and the database
+
+        :returns: the (first, last) intervals of the days the event was on
+        """
         if self._calendars[calendar]['readonly']:
             raise ReadOnlyCalendarError()
-        self._storages[calendar].delete(href, etag)
-        self._backend.delete(href, calendar=calendar)
+        with self._backend.at_once():
+            ctag = self._local_ctag(calendar)
+            self._storages[calendar].delete(href, etag)
+            self._vevents_cache.invalidate(calendar, href)
+            days = self._forget_days_of(href, calendar)
+            self._backend.delete(href, calendar=calendar)
+            self._set_ctag(calendar, ctag)
+        return days
+
+    def _set_ctag(self, calendar: str, ctag: str) -> None:
+        """remember that the db is up to date with `calendar`'s vdir, after
+        this collection changed it, if it was up to date with the vdir's
+        `ctag` from before the change
+
+        Otherwise the vdir changed meanwhile (e.g. synced by vdirsyncer), the
+        db's (or this collection's) outdated ctag is kept, so the next update
+        finds these changes.
+        """
+        local_ctag = self._local_ctag(calendar)
+        if self._backend.get_ctag(calendar) == ctag:
+            self._backend.set_ctag(local_ctag, calendar=calendar)
+        if self._last_ctags.get(calendar) == ctag:
+            self._last_ctags[calendar] = local_ctag
 
     def get_event(self, href: str, calendar: str) -> Event:
         """get an event by its href from the datatbase"""
@@ -229,7 +475,23 @@ class CalendarCollection(object):
                          ref: str='PROTO',
                          etag: str=None,
                          calendar: str=None,
+                         record: EventRecord=None,
                          ) -> Event:
+        if start is not None:
+            return Event.fromRecord(
+                item,
+                record,
+                ref,
+                load_vevents=partial(self._vevents_cache.get, calendar, href, etag, item),
+                locale=self._locale,
+                href=href,
+                calendar=calendar,
+                etag=etag,
+                start=start,
+                end=end,
+                color=self._calendars[calendar]['color'],
+                readonly=self._calendars[calendar]['readonly'],
+            )
         event = Event.fromString(
             item,
             locale=self._locale,
@@ -244,11 +506,17 @@ class CalendarCollection(object):
         )
         return event
 
-    def change_collection(self, event: Event, new_collection: str):
+    def change_collection(self, event: Event,
+                          new_collection: str) -> List[Tuple[dt.date, dt.date]]:
+        """move `event` to `new_collection`
+
+        :returns: like `update`
+        """
         href, etag, calendar = event.href, event.etag, event.calendar
         event.etag = None
-        self.new(event, new_collection)
-        self.delete(href, etag, calendar=calendar)
+        days = self.new(event, new_collection)
+        days += self.delete(href, etag, calendar=calendar)
+        return utils.merge_date_intervals(days)
 
     def new_event(self, ical: str, collection: str):
         """creates and returns (but does not insert) new event from ical
@@ -256,14 +524,136 @@ class CalendarCollection(object):
         calendar = collection or self.writable_names[0]
         return Event.fromString(ical, locale=self._locale, calendar=calendar)
 
-    def update_db(self):
+    def update_db(self, max_age: Optional[dt.timedelta]=None
+                  ) -> Optional[List[Tuple[dt.date, dt.date]]]:
         """update the db from the vdir,
 
         should be called after every change to the vdir
+
+        :param max_age: if given, calendars that were found to be up to date
+            less than `max_age` ago are trusted without checking their vdirs,
+            and the calendars found to be up to date now are recorded as such
+            (without it, nothing is written to the db unless a vdir changed)
+        :returns: the (first, last) intervals of the days on which events
+            changed, None if the db was (or is being) changed by another
+            process, this collection was never updated before or too many
+            events changed, then events might have changed on any day
         """
-        for calendar in self._calendars:
-            if self._needs_update(calendar, remember=True):
-                self._db_update(calendar)
+        now = time.time()
+        days = list()  # type: List[Tuple[dt.date, dt.date]]
+        unknown = False
+        # the locks are released once the transaction is committed
+        with contextlib.ExitStack() as locks, self._backend.at_once():
+            for calendar in self._calendars:
+                if max_age is not None and self._recently_checked(calendar, now, max_age):
+                    continue
+                last_ctag = self._last_ctags.get(calendar)
+                if not self._needs_update(calendar, remember=True):
+                    unknown = unknown or last_ctag != self._last_ctags[calendar]
+                    self._set_checked(calendar, now, max_age)
+                    continue
+                if not locks.enter_context(self._backend.update_lock(calendar)):
+                    logger.debug('{} is being updated by another process'.format(calendar))
+                    unknown = True
+                    continue
+                # the other process might just have finished updating it
+                if self._needs_update(calendar):
+                    changed = self._db_update(calendar)
+                    # writing to the db anyway
+                    self._backend.set_checked(now, calendar)
+                else:
+                    changed = None
+                    self._set_checked(calendar, now, max_age)
+                if changed is None:
+                    unknown = True
+                else:
+                    days.extend(changed)
+        if unknown:
+            self._forget_calendars_between()
+            return None
+        return utils.merge_date_intervals(days)
+
+    def _set_checked(self, calendar: str, now: float, max_age: Optional[dt.timedelta]) -> None:
+        """record that `calendar` was found up to date at `now`, if it's
+        needed for trusting it later (see `update_db`), writing to the db
+        waits for any other process writing to it"""
+        if max_age is None:
+            return
+        checked = self._backend.get_checked(calendar)
+        if checked is not None and 0 <= now - checked < max_age.total_seconds() / 2:
+            return
+        self._backend.set_checked(now, calendar)
+
+    def _recently_checked(self, calendar: str, now: float, max_age: dt.timedelta) -> bool:
+        checked = self._backend.get_checked(calendar)
+        if checked is None or not 0 <= now - checked < max_age.total_seconds():
+            return False
+        logger.debug('{} was checked {:.0f}s ago, not checking it again'.format(
+            calendar, now - checked))
+        return True
+
+    def update_in_thread(self, done: Callable[[Any, Dict[str, str]], None],
+                         changes: Optional[Dict[str, Set[str]]]=None) -> None:
+        """update the db like `update_db` or, if `changes` are given, like
+        `update_hrefs`, but in a new thread with its own connection to the db
+
+        The update is committed in batches (see BACKGROUND_BATCH), so writes
+        from the thread using this collection don't wait for all of it, which
+        may read some of its changes before they are passed to
+        `finish_update`. Databases in memory are updated in the calling
+        thread.
+
+        :param done: called from the new thread once the update is committed,
+            with `update_db`'s (or `update_hrefs`') return value (or the
+            exception that was raised) and the ctags of the updated
+            calendars, which the thread using this collection passes on to
+            `finish_update`
+        """
+        if self._dbpath == ':memory:':
+            # can't be shared between connections
+            updater = self
+        else:
+            updater = copy.copy(self)
+            updater._vevents_cache = VEventsCache(self._locale)
+            updater._last_ctags = dict(self._last_ctags)
+            updater._day_calendars = dict()
+
+        def run():
+            try:
+                if updater is not self:
+                    updater._backend = backend.SQLiteDb(
+                        self.names, self._dbpath, self._locale, horizon=self._horizon,
+                        batch=BACKGROUND_BATCH)
+                try:
+                    if changes is None:
+                        result = updater.update_db()
+                    else:
+                        result = updater.update_hrefs(changes)
+                finally:
+                    if updater is not self:
+                        updater._backend.conn.close()
+            except Exception as error:
+                logger.debug('Updating the db failed', exc_info=True)
+                done(error, dict())
+                return
+            # this collection is left alone, it might be used meanwhile
+            done(result, dict(updater._last_ctags))
+
+        if updater is self:
+            run()
+        else:
+            threading.Thread(target=run, daemon=True).start()
+
+    def finish_update(self, result: Any, last_ctags: Dict[str, str]) -> None:
+        """let this collection see the changes of an update run by
+        `update_in_thread`, with the arguments it passed to `done`
+
+        must be called from the thread using this collection
+        """
+        if isinstance(result, Exception):
+            return
+        self._last_ctags.update(last_ctags)
+        self._forget_calendars_between(result)
 
     def needs_update(self) -> bool:
         """Check if you need to call update_db.
@@ -287,7 +677,7 @@ class CalendarCollection(object):
         # and the API would be made even uglier than it already is...
         for calendar in self._calendars:
             if self._needs_update(calendar) or \
-                    self._last_ctags[calendar] != self._local_ctag(calendar):
+                    self._last_ctags.get(calendar) != self._local_ctag(calendar):
                 return True
         return False
 
@@ -298,23 +688,123 @@ class CalendarCollection(object):
             self._last_ctags[calendar] = local_ctag
         return local_ctag != self._backend.get_ctag(calendar)
 
-    def _db_update(self, calendar: str):
-        """implements the actual db update on a per calendar base"""
+    def _db_update(self, calendar: str) -> Optional[List[Tuple[dt.date, dt.date]]]:
+        """implements the actual db update on a per calendar base
+
+        :returns: the (first, last) intervals of the days on which events
+            changed, None if too many events changed to look them up
+        """
         local_ctag = self._local_ctag(calendar)
-        db_hrefs = set(href for href, etag in self._backend.list(calendar))
+        db_etags = dict(self._backend.list(calendar))
         storage_hrefs = set()
 
         with self._backend.at_once():
+            changed = list()
             for href, etag in self._storages[calendar].list():
                 storage_hrefs.add(href)
-                db_etag = self._backend.get_etag(href, calendar=calendar)
-                if etag != db_etag:
+                db_etag = db_etags.get(href)
+                if db_etag is not None and is_legacy_etag(db_etag, etag):
+                    self._backend.set_etag(href, etag, calendar=calendar)
+                elif etag != db_etag:
                     logger.debug('Updating {0} because {1} != {2}'.format(href, etag, db_etag))
-                    self._update_vevent(href, calendar=calendar)
-            for href in db_hrefs - storage_hrefs:
+                    self._vevents_cache.invalidate(calendar, href)
+                    changed.append(href)
+            deleted = db_etags.keys() - storage_hrefs
+            track = len(changed) + len(deleted) <= MAX_TRACKED_CHANGES
+            days = list()
+            if track:
+                for href in changed:
+                    days.extend(self._backend.get_day_intervals(href, calendar))
+            self._update_vevents(changed, calendar=calendar)
+            for href in deleted:
+                self._vevents_cache.invalidate(calendar, href)
+                if track:
+                    days.extend(self._backend.get_day_intervals(href, calendar))
                 self._backend.delete(href, calendar=calendar)
+            if track:
+                for href in changed:
+                    days.extend(self._backend.get_day_intervals(href, calendar))
             self._backend.set_ctag(local_ctag, calendar=calendar)
             self._last_ctags[calendar] = local_ctag
+        if not track:
+            self._forget_calendars_between()
+            return None
+        days = utils.merge_date_intervals(days)
+        self._forget_calendars_between(days)
+        return days
+
+    def watch(self) -> VdirWatcher:
+        """return a watcher reporting changed files in the calendars' vdirs,
+        whose changes can then be passed to `update_hrefs`
+
+        :raises WatcherUnavailable: if the vdirs can't be watched
+        """
+        return VdirWatcher({name: (storage.path, storage.fileext)
+                            for name, storage in self._storages.items()})
+
+    def update_hrefs(self, changes: Dict[str, Set[str]]) -> List[Tuple[dt.date, dt.date]]:
+        """update the db with the (changed, added or deleted) events at the
+        given hrefs by calendar, without checking any other files
+
+        :returns: the (first, last) intervals of the days on which events
+            changed
+        """
+        days = list()  # type: List[Tuple[dt.date, dt.date]]
+        with self._backend.at_once():
+            for calendar, hrefs in changes.items():
+                local_ctag = self._local_ctag(calendar)
+                changed = list()
+                for href in sorted(hrefs):
+                    try:
+                        etag = get_etag_from_file(
+                            os.path.join(self._storages[calendar].path, href))
+                    except FileNotFoundError:
+                        etag = None
+                    if etag == self._backend.get_etag(href, calendar=calendar):
+                        # e.g. written by ourselves
+                        continue
+                    logger.debug('Updating {0}/{1} because it changed'.format(calendar, href))
+                    days.extend(self._backend.get_day_intervals(href, calendar))
+                    self._vevents_cache.invalidate(calendar, href)
+                    if etag is None:
+                        self._backend.delete(href, calendar=calendar)
+                    else:
+                        changed.append(href)
+                self._update_vevents(changed, calendar=calendar)
+                for href in changed:
+                    days.extend(self._backend.get_day_intervals(href, calendar))
+                self._backend.set_ctag(local_ctag, calendar=calendar)
+                self._last_ctags[calendar] = local_ctag
+        days = utils.merge_date_intervals(days)
+        self._forget_calendars_between(days)
+        return days
+
+    def _update_vevents(self, hrefs: List[str], calendar: str) -> None:
+        """should only be called during db_update, updates the db with the
+        events at `hrefs`, which are parsed and expanded in `jobs` worker
+        processes if there are enough of them"""
+        if self._jobs < 2 or len(hrefs) < PARALLEL_MIN or \
+                self._calendars[calendar].get('ctype') == 'birthdays':
+            for href in hrefs:
+                self._update_vevent(href, calendar=calendar)
+            return
+        window = self._backend.get_window(calendar)
+        tasks = [(self._storages[calendar], href, calendar, self._locale, window)
+                 for href in hrefs]
+        chunksize = max(1, len(tasks) // (self._jobs * 4))
+        # only imported when needed, to keep khal's startup fast
+        import multiprocessing
+        with multiprocessing.Pool(self._jobs) as pool:
+            # imap returns the results in order, so all log messages are
+            # emitted in the same order as when updating serially
+            for href, (prepared, etag, records) in zip(
+                    hrefs, pool.imap(_prepare_vevent, tasks, chunksize)):
+                for record in records:
+                    logger.handle(record)
+                if prepared is None:
+                    self._backend.delete(href, calendar=calendar)
+                else:
+                    self._backend.update_prepared(prepared, etag)
 
     def _update_vevent(self, href: str, calendar: str) -> bool:
         """should only be called during db_update, only updates the db,
@@ -328,18 +818,22 @@ class CalendarCollection(object):
             update(event.raw, href=href, etag=etag, calendar=calendar)
             return True
         except Exception as e:
-            if not isinstance(e, (UpdateFailed, UnsupportedFeatureError, NonUniqueUID)):
-                logger.exception('Unknown exception happened.')
-            logger.warning(
-                'Skipping {0}/{1}: {2}\n'
-                'This event will not be available in khal.'.format(calendar, href, str(e)))
+            _log_skipped(e, href, calendar)
+            self._backend.delete(href, calendar=calendar)
             return False
 
     def search(self, search_string: str) -> Iterable[Event]:
-        """search for the db for events matching `search_string`"""
+        """search for the db for events matching `search_string`, best matches
+        first (see SQLiteDb.search)"""
         return (self._construct_event(*args) for args in self._backend.search(search_string))
 
     def get_day_styles(self, day: dt.date, focus: bool) -> Optional[Union[str, Tuple[str, str]]]:
+        if day not in self._day_calendars:
+            # the other days of its month (as shown in ikhal's calendar) are
+            # usually needed right after this one
+            first = day.replace(day=1)
+            last = (first + dt.timedelta(days=31)).replace(day=1)
+            self.get_calendars_between(first - dt.timedelta(days=6), last + dt.timedelta(days=5))
         calendars = self.get_calendars_on(day)
         if len(calendars) == 0:
             return None
@@ -61,33 +61,34 @@ def get_etag_from_file(f):
     '''Get mtime-based etag from a filepath, file-like object or raw file
     descriptor.
 
-    This function will flush/sync the file as much as necessary to obtain a
-    correct mtime.
+    File-like objects and file descriptors are expected to belong to files we
+    just wrote, this function will flush/sync them as much as necessary to
+    obtain a correct mtime. Filepaths are only stat'ed.
     '''
-    close_f = False
+    if isinstance(f, str):
+        return _etag_from_stat(os.stat(f))
     if hasattr(f, 'read'):
         f.flush()
         f = f.fileno()
-    elif isinstance(f, str):
-        flags = 0
-        if os.path.isdir(f):
-            flags = os.O_DIRECTORY
-        f = os.open(f, flags)
-        close_f = True
 
     # assure that all internal buffers associated with this file are
     # written to disk
-    try:
-        os.fsync(f)
-        stat = os.fstat(f)
-    finally:
-        if close_f:
-            os.close(f)
+    os.fsync(f)
+    return _etag_from_stat(os.fstat(f))
 
+
+def _etag_from_stat(stat):
+    '''etag made of the mtime, size and inode of a file'''
     mtime = getattr(stat, 'st_mtime_ns', None)
     if mtime is None:
         mtime = stat.st_mtime
-    return '{:.9f}'.format(mtime)
+    return '{:.9f};{};{}'.format(mtime, stat.st_size, stat.st_ino)
+
+
+def is_legacy_etag(old, new):
+    '''if `old` is an etag of an older khal version (consisting only of the
+    mtime) for the same file version as `new`'''
+    return ';' not in old and new.split(';', 1)[0] == old
 
 
 class VdirError(IOError):
@@ -188,17 +189,22 @@ class VdirBase:
         return _generate_href(uid) + self.fileext
 
     def list(self):
-        for fname in os.listdir(self.path):
-            fpath = os.path.join(self.path, fname)
-            if os.path.isfile(fpath) and fname.endswith(self.fileext):
-                yield fname, get_etag_from_file(fpath)
+        if not hasattr(os, 'scandir'):  # Python 3.4
+            for fname in os.listdir(self.path):
+                fpath = os.path.join(self.path, fname)
+                if os.path.isfile(fpath) and fname.endswith(self.fileext):
+                    yield fname, get_etag_from_file(fpath)
+            return
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(self.fileext) and entry.is_file():
+                yield entry.name, _etag_from_stat(entry.stat())
 
     def get(self, href):
         fpath = self._get_filepath(href)
         try:
             with open(fpath, 'rb') as f:
                 return (Item(f.read().decode(self.encoding)),
-                        get_etag_from_file(fpath))
+                        _etag_from_stat(os.fstat(f.fileno())))
         except IOError as e:
             if e.errno == errno.ENOENT:
                 raise NotFoundError(href)
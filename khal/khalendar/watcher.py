@@ -0,0 +1,152 @@
+# Copyright (c) 2013-2017 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Watching vdirs for changes with Linux' inotify, so that changed events can be
+updated as soon as they are written without polling the vdirs.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+from typing import Dict, Set, Tuple  # noqa
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# files in vdirs are usually written atomically by renaming or linking
+# temporary files, other tools write them in place, which is only reported
+# once the file was closed
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# something happened that can't be attributed to single files, e.g. the
+# vdir was removed or events were lost, the whole calendar needs to be
+# checked again
+RESCAN_MASK = IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+_EVENT = struct.Struct('iIII')
+
+
+class WatcherUnavailable(OSError):
+
+    """the vdirs can't be watched, e.g., on systems other than Linux"""
+
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        raise WatcherUnavailable('inotify is only available on Linux')
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise WatcherUnavailable('libc does not support inotify')
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class VdirWatcher(object):
+    """Watch the directories of several calendars for changed files
+
+    The watcher's file descriptor becomes readable when files changed, e.g.,
+    to be used with urwid's MainLoop.watch_file(), `read()` then returns the
+    changes.
+    """
+
+    def __init__(self, vdirs: Dict[str, Tuple[str, str]]) -> None:
+        """
+        :param vdirs: the directory and the file extension of the events of
+            each calendar, by calendar name
+        :raises WatcherUnavailable: if inotify can't be used
+        """
+        libc = _libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatcherUnavailable(ctypes.get_errno(), 'inotify_init1 failed')
+        self._fileexts = dict()  # type: Dict[str, str]
+        self._calendars = dict()  # type: Dict[int, str]
+        try:
+            for calendar, (path, fileext) in vdirs.items():
+                wd = libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+                if wd < 0:
+                    error = ctypes.get_errno()
+                    raise WatcherUnavailable(
+                        error, 'cannot watch {}: {}'.format(path, os.strerror(error)))
+                self._calendars[wd] = calendar
+                self._fileexts[calendar] = fileext
+        except Exception:
+            self.close()
+            raise
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def read(self) -> Tuple[Dict[str, Set[str]], Set[str]]:
+        """read all pending changes, without blocking
+
+        :returns: the hrefs of changed (or created or deleted) files by
+            calendar, and the calendars that need to be checked completely
+            (e.g., because changes were lost)
+        """
+        changes = dict()  # type: Dict[str, Set[str]]
+        rescan = set()  # type: Set[str]
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    rescan.update(self._fileexts)
+                    continue
+                calendar = self._calendars.get(wd)
+                if calendar is None:
+                    continue
+                if mask & RESCAN_MASK:
+                    rescan.add(calendar)
+                elif name.endswith(self._fileexts[calendar]):
+                    changes.setdefault(calendar, set()).add(name)
+        for calendar in rescan:
+            changes.pop(calendar, None)
+        return changes, rescan
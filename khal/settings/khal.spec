@@ -68,6 +68,26 @@ type = option('calendar', 'birthdays', 'discover', default='calendar')
 # khal stores its internal caching database here, by default this will be in the *$XDG_DATA_HOME/khal/khal.db* (this will most likely be *~/.local/share/khal/khal.db*).
 path = expand_db_path(default=None)
 
+# By default, khal stores every instance of recurring events in its database,
+# for events repeating indefinitely up until the year 2037. If this is set to a
+# timedelta (e.g. `730d`), only instances starting within that timedelta of
+# today are stored, other instances are added on demand, once they are needed.
+# This makes the database considerably smaller and faster to build when using
+# many recurring events.
+recurrence_horizon = timedelta(default=None)
+
+# The number of processes khal uses to parse events when building or updating
+# its database, setting this to the number of CPU cores makes building the
+# database of large calendars faster. Can be overridden with `--jobs`.
+jobs = integer(default=1, min=1)
+
+# Before doing anything, khal checks if any events were changed in the vdirs
+# and updates its database accordingly. If this is set to a timedelta (e.g.
+# `300s`), commands that only read events (like `list` or `calendar`) trust
+# the database without checking the vdirs again, if it was checked less than
+# that long ago. Can be overridden with `--refresh` and `--no-refresh`.
+max_cache_age = timedelta(default=None)
+
 # It is mandatory to set (long)date-, time-, and datetimeformat options, all others options in the **[locale]** section are optional and have (sensible) defaults.
 [locale]
 
@@ -22,22 +22,35 @@
 
 import logging
 import os
+import pickle
+import re
 
 import xdg.BaseDirectory
+from atomicwrites import atomic_write
 from configobj import (ConfigObj, ConfigObjError, flatten_errors,
                        get_extra_values)
-from khal import __productname__
+from khal import __productname__, __version__
 from validate import Validator
 
 from .exceptions import (CannotParseConfigFileError, InvalidSettingsError,
                          NoConfigFile)
 from .utils import (config_checks, expand_db_path, expand_path,
-                    get_color_from_vdir, get_vdir_type, is_color, is_timedelta,
-                    is_timezone, weeknumber_option, monthdisplay_option)
+                    get_color_from_vdir, get_glob_dirs, get_vdir_type, is_color,
+                    is_timedelta, is_timezone, weeknumber_option, monthdisplay_option)
 
 logger = logging.getLogger('khal')
 SPECPATH = os.path.join(os.path.dirname(__file__), 'khal.spec')
 
+# besides the config file itself, the validated configuration depends on
+# these environment variables (when expanding paths or finding the local
+# timezone) and files (where tzlocal finds the local timezone), config files
+# referencing any other variables are not cached
+CACHE_ENVIRON = ['HOME', 'TZ', 'XDG_DATA_HOME']
+TIMEZONE_FILES = ['/etc/localtime', '/etc/timezone']
+
+# the references to environment variables expanded by os.path.expandvars
+ENVIRON_REFERENCE = re.compile(r'\$(\w+|\{[^}]*\})')
+
 
 def find_configuration_file():
     """Return the configuration filename.
@@ -69,12 +82,91 @@ def find_configuration_file():
     return None
 
 
+class _Warnings(logging.Handler):
+    """collects the messages of all warnings logged while validating the
+    config, so they can be logged again when the cached config is used"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = list()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def _cache_path():
+    return os.path.join(xdg.BaseDirectory.xdg_cache_home, __productname__, 'config.pickle')
+
+
+def _cache_key(config_path):
+    return (__version__, os.path.abspath(config_path),
+            [os.environ.get(name) for name in CACHE_ENVIRON])
+
+
+def referenced_environ(config_path):
+    """return the names of the environment variables referenced in the config
+    file at `config_path`, which `expand_path` expands"""
+    with open(config_path) as f:
+        return sorted(set(name.strip('{}') for name in ENVIRON_REFERENCE.findall(f.read())))
+
+
+def _stat(path):
+    """return what changes when the file or directory at `path` changes"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _load_cached_config(config_path):
+    """return the configuration cached for `config_path` if none of the
+    files and directories it was built from changed since, else None"""
+    try:
+        with open(_cache_path(), 'rb') as f:
+            cached = pickle.load(f)
+    except Exception:
+        # no cache yet, or written by an incompatible version
+        return None
+    if cached['key'] != _cache_key(config_path):
+        return None
+    for path, stat in cached['stats'].items():
+        if _stat(path) != stat:
+            logger.debug('{} changed, not using the cached config'.format(path))
+            return None
+    logger.debug('using the cached config from {}'.format(_cache_path()))
+    for message in cached['warnings']:
+        logger.warning(message)
+    return cached['config']
+
+
+def _save_cached_config(config_path, config, stats, warnings):
+    cached = {
+        'key': _cache_key(config_path),
+        'stats': stats,
+        'config': config,
+        'warnings': warnings,
+    }
+    try:
+        os.makedirs(os.path.dirname(_cache_path()), exist_ok=True)
+        with atomic_write(_cache_path(), mode='wb', overwrite=True) as f:
+            pickle.dump(cached, f)
+    except Exception as error:
+        logger.debug('cannot cache the config: {}'.format(error))
+
+
 def get_config(
         config_path=None,
         _get_color_from_vdir=get_color_from_vdir,
         _get_vdir_type=get_vdir_type):
     """reads the config file, validates it and return a config dict
 
+    The validated config is cached and reused as long as neither the config
+    file, the config spec, the vdirs' color and displayname files nor the
+    directories the vdirs of `type = discover` calendars were found in
+    change. Config files referencing environment variables (which paths are
+    expanded with) are not cached.
+
     :param config_path: path to a custom config file, if none is given the
                         default locations will be searched
     :type config_path: str
@@ -90,6 +182,36 @@ def get_config(
 
     logger.debug('using the config file at {}'.format(config_path))
 
+    # the cached config can't have been built with other functions, nor
+    # with the values of the environment variables the config file references
+    cache = (_get_color_from_vdir is get_color_from_vdir and
+             _get_vdir_type is get_vdir_type)
+    try:
+        cache = cache and not referenced_environ(config_path)
+    except (OSError, UnicodeDecodeError):
+        cache = False
+    if cache:
+        config = _load_cached_config(config_path)
+        if config is not None:
+            return config
+
+    warnings = _Warnings()
+    logger.addHandler(warnings)
+    try:
+        stats = {path: _stat(path) for path in [config_path, SPECPATH] + TIMEZONE_FILES}
+        user_config = _validate_config(config_path, _get_color_from_vdir, _get_vdir_type, stats)
+    finally:
+        logger.removeHandler(warnings)
+    # a plain dict, like the cached one
+    user_config = user_config.dict()
+    if cache:
+        _save_cached_config(config_path, user_config, stats, warnings.messages)
+    return user_config
+
+
+def _validate_config(config_path, _get_color_from_vdir, _get_vdir_type, stats):
+    """reads and validates the config file, adds the stats of all
+    files and directories it depends on to `stats`"""
     try:
         user_config = ConfigObj(config_path,
                                 configspec=SPECPATH,
@@ -134,7 +256,16 @@ def get_config(
     if abort or not results:
         raise InvalidSettingsError()
 
+    for calendar in user_config['calendars'].values():
+        if isinstance(calendar, dict) and calendar['type'] == 'discover':
+            stats.update((path, _stat(path)) for path in get_glob_dirs(calendar['path']))
     config_checks(user_config, _get_color_from_vdir, _get_vdir_type)
+    # the vdirs' color and displayname may be used, not their directories,
+    # which change with every event added or removed
+    paths = [os.path.join(calendar['path'], key)
+             for calendar in user_config['calendars'].values()
+             for key in ['color', 'displayname']]
+    stats.update((path, _stat(path)) for path in paths)
 
     extras = get_extra_values(user_config)
     for section, value in extras:
@@ -30,7 +30,6 @@ import xdg
 from tzlocal import get_localzone
 from validate import VdtValueError
 
-from ..khalendar.vdir import CollectionNotFoundError, Vdir
 from ..parse_datetime import guesstimedeltafstr
 from ..terminal import COLORS
 from .exceptions import InvalidSettingsError
@@ -148,11 +147,18 @@ def test_default_calendar(config):
         raise InvalidSettingsError()
 
 
-def get_color_from_vdir(path):
+def get_vdir_meta(path, key):
+    """return the metadata `key` of the vdir at `path` (like Vdir.get_meta),
+    without importing the khalendar package, which loads the whole backend"""
     try:
-        color = Vdir(path, '.ics').get_meta('color')
-    except CollectionNotFoundError:
-        color = None
+        with open(os.path.join(path, key), 'rb') as f:
+            return f.read().decode('utf-8') or None
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def get_color_from_vdir(path):
+    color = get_vdir_meta(path, 'color')
     if color is None or color is '':
         logger.debug('Found no or empty file `color` in {}'.format(path))
         return None
@@ -167,7 +173,7 @@ def get_color_from_vdir(path):
 
 def get_unique_name(path, names):
     # TODO take care of edge cases, make unique name finding less brain-dead
-    name = Vdir(path, '.ics').get_meta('displayname')
+    name = get_vdir_meta(path, 'displayname')
     if name is None or name == '':
         logger.debug('Found no or empty file `displayname` in {}'.format(path))
         name = os.path.split(path)[-1]
@@ -184,6 +190,28 @@ def get_all_vdirs(path):
     return items
 
 
+def get_glob_dirs(path):
+    """returns the directories whose contents determine which paths
+    `get_all_vdirs` finds for `path`, these (or their mtimes) change when
+    vdirs are added or removed
+    """
+    head, *parts = path.split(os.sep)
+    dirs = [head or os.sep]
+    globbed = list()
+    for part in parts:
+        if not part:
+            continue
+        if globbed or glob.has_magic(part):
+            globbed.extend(dirs)
+        if glob.has_magic(part):
+            dirs = [match for directory in dirs
+                    for match in glob.glob(join(glob.escape(directory), part))
+                    if os.path.isdir(match)]
+        else:
+            dirs = [join(directory, part) for directory in dirs]
+    return globbed or [path]
+
+
 def get_vdir_type(_):
     # TODO implement
     return 'calendar'
@@ -138,11 +138,15 @@ def merge_columns(lcolumn, rcolumn, width=25):
     out its (real) width automatically since it might contain ANSI
     escape sequences.
     """
-
-    missing = len(rcolumn) - len(lcolumn)
-    if missing > 0:
-        lcolumn = lcolumn + missing * [width * ' ']
-
-    rows = ['    '.join(one) for one in zip_longest(
-        lcolumn, rcolumn, fillvalue='')]
-    return rows
+    return list(iter_merge_columns(lcolumn, rcolumn, width))
+
+
+def iter_merge_columns(lcolumn, rcolumn, width=25):
+    """like `merge_columns`, but yields the rows as soon as both columns
+    (which may be any iterables) provide them"""
+    for left, right in zip_longest(lcolumn, rcolumn):
+        if left is None:
+            left = width * ' '
+        if right is None:
+            right = ''
+        yield '    '.join((left, right))
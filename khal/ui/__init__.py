@@ -21,8 +21,10 @@
 
 import datetime as dt
 import logging
+import os
 import signal
 import sys
+from functools import partial
 
 import click
 import urwid
@@ -30,6 +32,7 @@ import urwid
 from .. import utils
 from ..khalendar.event import Event
 from ..khalendar.exceptions import ReadOnlyCalendarError
+from ..khalendar.watcher import WatcherUnavailable
 from . import colors
 from .widgets import ExtendedEdit as Edit, NPile, NColumns, NListBox, linebox
 from .base import Pane, Window
@@ -75,6 +78,14 @@ logger = logging.getLogger('khal')
 ALL = 1
 INSTANCES = 2
 
+# DayWalker fetches the events of this many days before and after a day at
+# once, and again once the days half as far away aren't fetched yet
+PREFETCH_DAYS = 14
+
+# DayWalker drops the days farther than this from the focus, they are built
+# again when scrolled to
+KEEP_DAYS = 100
+
 
 class DateConversionError(Exception):
     pass
@@ -286,7 +297,8 @@ class DListBox(EventListBox):
 
     def clean(self):
         """reset event most recently in focus"""
-        if self._old_focus is not None:
+        # the days before it might have been dropped meanwhile
+        if self._old_focus is not None and self._old_focus < len(self.body):
             self.body[self._old_focus].body[0].set_attr_map({None: 'date'})
 
     def ensure_date(self, day):
@@ -353,6 +365,8 @@ class DayWalker(urwid.SimpleFocusListWalker):
         self._last_day = this_date
         self._first_day = this_date
         self._collection = collection
+        # the (sorted) events by day, see `_events_on`
+        self._day_events = dict()
 
         super().__init__(list())
         self.ensure_date(this_date)
@@ -363,6 +377,12 @@ class DayWalker(urwid.SimpleFocusListWalker):
         # isn't very costly either
         item_no = None
 
+        if len(self) != 0 and not \
+                self[0].date - dt.timedelta(days=KEEP_DAYS) <= day <= \
+                self[-1].date + dt.timedelta(days=KEEP_DAYS):
+            # don't build all days in between, only to drop them again
+            del self[:]
+            self._day_events.clear()
         if len(self) == 0:
             pile = self._get_events(day)
             self.append(pile)
@@ -421,6 +441,7 @@ class DayWalker(urwid.SimpleFocusListWalker):
         """
         start = start.date() if isinstance(start, dt.datetime) else start
         end = end.date() if isinstance(end, dt.datetime) else end
+        self._forget_events(start, end, everything)
 
         if everything:
             start = self[0].date
@@ -429,6 +450,8 @@ class DayWalker(urwid.SimpleFocusListWalker):
             start = max(self[0].date, start)
             end = min(self[-1].date, end)
 
+        if start <= end:
+            self._fetch_events(start, end)
         day = start
         while day <= end:
             self.update_events_ondate(day)
@@ -445,8 +468,32 @@ class DayWalker(urwid.SimpleFocusListWalker):
         while position <= 0:
             self._autoprepend()
             position += 1
+        position = self._evict(position)
         return super().set_focus(position)
 
+    def _evict(self, position):
+        """drop the days (and their fetched events) farther than KEEP_DAYS
+        from the day at `position`
+
+        :returns: the position of that day afterwards
+        :rtype: int
+        """
+        front = max(0, position - KEEP_DAYS)
+        back = min(len(self), position + KEEP_DAYS + 1)
+        if front == 0 and back == len(self):
+            return position
+        del self[back:]
+        del self[:front]
+        self._first_day = self[0].date
+        self._last_day = self[-1].date
+        first = self._first_day - dt.timedelta(days=PREFETCH_DAYS)
+        last = self._last_day + dt.timedelta(days=PREFETCH_DAYS)
+        for day in [day for day in self._day_events if not first <= day <= last]:
+            del self._day_events[day]
+        logger.debug('DayWalker: {} days built, events of {} days fetched'.format(
+            len(self), len(self._day_events)))
+        return position - front
+
     def _autoextend(self):
         self._last_day += dt.timedelta(days=1)
         pile = self._get_events(self._last_day)
@@ -474,7 +521,7 @@ class DayWalker(urwid.SimpleFocusListWalker):
             conf=self._conf,
         )
         event_list.append(urwid.AttrMap(date_header, 'date'))
-        self.events = sorted(self._collection.get_events_on(day))
+        self.events = self._events_on(day)
         event_list.extend([
             urwid.AttrMap(
                 U_Event(event, conf=self._conf, this_date=day, delete_status=self.delete_status),
@@ -485,6 +532,44 @@ class DayWalker(urwid.SimpleFocusListWalker):
             (len(event_list) + 1) if self.events else 1
         )
 
+    def _events_on(self, day):
+        """return the events on `day`
+
+        If `day` or the days up to PREFETCH_DAYS // 2 around it haven't been
+        fetched yet, the missing days up to PREFETCH_DAYS around it are
+        fetched with one query, so scrolling finds the next days already
+        fetched.
+
+        :type day: datetime.date
+        :rtype: list(khal.khalendar.event.Event)
+        """
+        near = range(-(PREFETCH_DAYS // 2), PREFETCH_DAYS // 2 + 1)
+        if any(day + dt.timedelta(days=delta) not in self._day_events for delta in near):
+            missing = [day + dt.timedelta(days=delta)
+                       for delta in range(-PREFETCH_DAYS, PREFETCH_DAYS + 1)]
+            missing = [one for one in missing if one not in self._day_events]
+            self._fetch_events(missing[0], missing[-1])
+        return self._day_events[day]
+
+    def _fetch_events(self, start, end):
+        """fetch the events of all days between `start` and `end` (inclusive)
+
+        :type start: datetime.date
+        :type end: datetime.date
+        """
+        for day_start, _, events in self._collection.get_events_by_day(
+                dt.datetime.combine(start, dt.time.min), dt.datetime.combine(end, dt.time.max)):
+            self._day_events[day_start.date()] = events
+
+    def _forget_events(self, start, end, everything=False):
+        """forget the fetched events of the days between `start` and `end`
+        (inclusive), or of all days if `everything` is True"""
+        if everything:
+            self._day_events.clear()
+            return
+        for day in [day for day in self._day_events if start <= day <= end]:
+            del self._day_events[day]
+
     def selectable(self):
         """mark this widget as selectable"""
         return True
@@ -539,6 +624,7 @@ class StaticDayWalker(DayWalker):
         """
         start = start.date() if isinstance(start, dt.datetime) else start
         end = end.date() if isinstance(end, dt.datetime) else end
+        self._forget_events(start, end, everything)
 
         update = everything
         for one in self:
@@ -669,7 +755,22 @@ class EventColumn(urwid.WidgetWrap):
             min_date = self.pane.calendar.base_widget.walker.earliest_date
             max_date = self.pane.calendar.base_widget.walker.latest_date
         self.pane.base_widget.calendar.base_widget.reset_styles_range(min_date, max_date)
-        self.dlistbox.body.update_range(min_date, max_date)
+        self.dlistbox.body.update_range(min_date, max_date, everything)
+
+    def update_days(self, days):
+        """update the displayed dates in the (first, last) intervals `days`,
+        as returned by the collection after events changed, or all of them
+        if `days` is None
+        """
+        if days is None:
+            self.update(None, None, everything=True)
+            return
+        walker = self.pane.calendar.base_widget.walker
+        for first, last in days:
+            first = max(first, walker.earliest_date)
+            last = min(last, walker.latest_date)
+            if first <= last:
+                self.update(first, last, everything=False)
 
     def refresh_titles(self, min_date, max_date, everything):
         """refresh titles in DateListBoxes
@@ -696,33 +797,17 @@ class EventColumn(urwid.WidgetWrap):
                 ('alert', 'Calendar `{}` is read-only.'.format(event.calendar)))
             return
 
-        if isinstance(event.start_local, dt.datetime):
-            original_start = event.start_local.date()
-        else:
-            original_start = event.start_local
-        if isinstance(event.end_local, dt.datetime):
-            original_end = event.end_local.date()
-        else:
-            original_end = event.end_local
-
-        def update_colors(new_start, new_end, everything=False):
+        def update_colors(new_start, days):
             """reset colors in the calendar widget and dates in DayWalker
-            between min(new_start, original_start)
+            on the days the event was or now is on
 
             :type new_start: datetime.date
-            :type new_end: datetime.date
-            :param everything: set to True if event is a recurring one, than everything
-                  gets reseted
+            :param days: (first, last) intervals of the changed days, as
+                returned by the collection
             """
-            # TODO cleverer support for recurring events, where more than start and
-            # end dates are affected (complicated)
             if isinstance(new_start, dt.datetime):
                 new_start = new_start.date()
-            if isinstance(new_end, dt.datetime):
-                new_end = new_end.date()
-            start = min(original_start, new_start)
-            end = max(original_end, new_end)
-            self.pane.eventscolumn.base_widget.update(start, end, everything)
+            self.pane.eventscolumn.base_widget.update_days(days)
 
             # set original focus date
             self.pane.calendar.original_widget.set_focus_date(new_start)
@@ -747,12 +832,8 @@ class EventColumn(urwid.WidgetWrap):
                 calendar=event.calendar,
                 etag=event.etag,
             )
-            self.pane.collection.update(new_event)
-            update_colors(
-                new_event.start_local,
-                new_event.end_local,
-                (event.recurring or new_event.recurring)
-            )
+            days = self.pane.collection.update(new_event)
+            update_colors(new_event.start_local, days)
         else:
             self.editor = True
             editor = EventEditor(self.pane, event, update_colors, always_save=always_save)
@@ -844,17 +925,13 @@ class EventColumn(urwid.WidgetWrap):
         # up on disk but not be displayed in khal
         event = self.focus_event.event.duplicate()
         try:
-            self.pane.collection.new(event)
+            days = self.pane.collection.new(event)
         except ReadOnlyCalendarError:
             event.calendar = self.pane.collection.default_calendar_name or \
                 self.pane.collection.writable_names[0]
             self.edit(event, always_save=True)
-        start_date, end_date = event.start_local, event.end_local
-        if isinstance(start_date, dt.datetime):
-            start_date = start_date.date()
-        if isinstance(end_date, dt.datetime):
-            end_date = end_date.date()
-        self.pane.eventscolumn.base_widget.update(start_date, end_date, event.recurring)
+        else:
+            self.pane.eventscolumn.base_widget.update_days(days)
         try:
             self._old_focus = self.focus_position
         except IndexError:
@@ -1255,6 +1332,66 @@ def _add_calendar_colors(palette, collection):
     return palette
 
 
+class CacheRefresher(object):
+    """Update the cache db from the vdirs in the background and redraw the
+    affected days once the update is done
+
+    Only one update runs at a time, updates requested meanwhile are merged
+    and run afterwards.
+    """
+
+    def __init__(self, loop, pane):
+        self._pane = pane
+        self._pipe = loop.watch_pipe(self._updated)
+        self._results = []
+        self._changes = dict()
+        self._everything = False
+        self.running = False
+
+    def refresh(self, changes=None):
+        """update the events at the hrefs in `changes` (by calendar), or all
+        calendars if `changes` is None"""
+        if changes is None:
+            self._everything = True
+        else:
+            for calendar, hrefs in changes.items():
+                self._changes.setdefault(calendar, set()).update(hrefs)
+        if not self.running:
+            self._start()
+
+    def _start(self):
+        if self._everything:
+            changes = None
+        elif self._changes:
+            changes = self._changes
+        else:
+            return
+        self._everything, self._changes = False, dict()
+        self.running = True
+        self._pane.window.set_status('updating...')
+        self._pane.collection.update_in_thread(self._done, changes)
+
+    def _done(self, result, last_ctags):
+        """called from the updating thread"""
+        self._results.append((result, last_ctags))
+        os.write(self._pipe, b'.')
+
+    def _updated(self, data):
+        """called from the main loop once an update is done"""
+        result, last_ctags = self._results.pop(0)
+        self.running = False
+        self._pane.window.set_status()
+        # only now the collection, used by the main loop, sees the changes
+        self._pane.collection.finish_update(result, last_ctags)
+        if isinstance(result, Exception):
+            logger.error('Updating the cache failed: {}'.format(result))
+        else:
+            # only the displayed days on which events changed are redrawn
+            self._pane.eventscolumn.base_widget.update_days(result)
+        self._start()
+        return True
+
+
 def start_pane(pane, callback, program_info='', quit_keys=['q']):
     """Open the user interface with the given initial pane."""
 
@@ -1325,15 +1462,28 @@ def start_pane(pane, callback, program_info='', quit_keys=['q']):
 
     loop.set_alarm_in(60, redraw_today, pane)
 
+    refresher = CacheRefresher(loop, pane)
+    refresher.refresh()
+
     def check_for_updates(loop, pane):
-        if pane.collection.needs_update():
-            pane.window.alert('detected external vdir modification, updating...')
-            pane.collection.update_db()
-            pane.eventscolumn.base_widget.update(None, None, everything=True)
-            pane.window.alert('detected external vdir modification, updated.')
+        if not refresher.running and pane.collection.needs_update():
+            refresher.refresh()
         loop.set_alarm_in(60, check_for_updates, pane)
 
-    loop.set_alarm_in(60, check_for_updates, pane)
+    def watched_changes(watcher):
+        changes, rescan = watcher.read()
+        if rescan:
+            refresher.refresh()
+        elif changes:
+            refresher.refresh(changes)
+
+    try:
+        watcher = pane.collection.watch()
+    except WatcherUnavailable as error:
+        logger.debug('Polling for vdir modifications: {}'.format(error))
+        loop.set_alarm_in(60, check_for_updates, pane)
+    else:
+        loop.watch_file(watcher.fileno(), partial(watched_changes, watcher))
     # Make urwid use 256 color mode.
     loop.screen.set_terminal_properties(
         colors=256, bright_is_bold=pane._conf['view']['bold_for_light_color'])
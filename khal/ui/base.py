@@ -148,6 +148,7 @@ class Window(urwid.Frame):
         self._track = []
 
         header = urwid.AttrWrap(urwid.Text(''), 'header')
+        self._footer_text = footer
         footer = urwid.AttrWrap(urwid.Text(footer), 'footer')
         urwid.Frame.__init__(
             self, urwid.Text(''), header=header, footer=footer,
@@ -241,6 +242,17 @@ class Window(urwid.Frame):
 
         self.header.w.set_text(text[:-1] or '')
 
+    def set_status(self, status=None):
+        """Show `status` in the footer line until it is reset with None.
+
+        Unlike alerts, the status stays until it is no longer valid, e.g.,
+        while something is running in the background.
+        """
+        if status:
+            self.footer.w.set_text([self._footer_text, ('black', ' | '), status])
+        else:
+            self.footer.w.set_text(self._footer_text)
+
 
 class AlertDaemon(threading.Thread):
     def __init__(self, set_msg_func):
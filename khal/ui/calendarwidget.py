@@ -26,12 +26,19 @@ if anything doesn't work as expected, please open an issue for khal
 
 import calendar
 import datetime as dt
+import logging
 from collections import defaultdict
 from locale import LC_ALL, LC_TIME, getlocale, setlocale
 
 import urwid
 from khal.utils import get_month_abbr_len
 
+logger = logging.getLogger('khal')
+
+# CalendarWalker drops the months more than this many weeks away from the
+# focus, they are built again when scrolled to
+KEEP_WEEKS = 53
+
 setlocale(LC_ALL, '')
 
 
@@ -314,10 +321,13 @@ class CListBox(urwid.ListBox):
         if key in self.keybindings['mark'] + ['esc'] and self._marked:
                 self._unmark_all()
                 self._marked = False
+                self.body.evict = True
                 return
         if key in self.keybindings['mark']:
             self._marked = {'date': self.body.focus_date,
                             'pos': (self.focus_position, self.focus.focus_col)}
+            # the marked rows' positions must not change
+            self.body.evict = False
         if self._marked and key in self.keybindings['other']:
             row, col = self._marked['pos']
             self._marked = {'date': self.body.focus_date,
@@ -359,6 +369,8 @@ class CalendarWalker(urwid.SimpleFocusListWalker):
         self.on_press = on_press
         self.keybindings = keybindings
         self.get_styles = get_styles
+        # if weeks far from the focus are dropped
+        self.evict = True
         weeks = self._construct_month(initial.year, initial.month)
         urwid.SimpleFocusListWalker.__init__(self, weeks)
 
@@ -369,8 +381,33 @@ class CalendarWalker(urwid.SimpleFocusListWalker):
         while position <= 0:
             no_additional_weeks = self._autoprepend()
             position += no_additional_weeks
+        if self.evict:
+            position = self._evict(position)
         return urwid.SimpleFocusListWalker.set_focus(self, position)
 
+    def _evict(self, position):
+        """drop the months more than KEEP_WEEKS weeks away from the week at
+        `position`, only whole months are dropped so that `_autoextend` and
+        `_autoprepend` continue with the right ones
+
+        :returns: the position of that week afterwards
+        :rtype: int
+        """
+        front = max(0, position - KEEP_WEEKS)
+        while front > 0 and (self[front][1].date - dt.timedelta(days=1)).month == \
+                self[front][7].date.month:
+            front -= 1
+        back = min(len(self), position + KEEP_WEEKS + 1)
+        while back < len(self) and (self[back - 1][7].date + dt.timedelta(days=1)).month == \
+                self[back - 1][1].date.month:
+            back += 1
+        if front == 0 and back == len(self):
+            return position
+        del self[back:]
+        del self[:front]
+        logger.debug('CalendarWalker: {} weeks built'.format(len(self)))
+        return position - front
+
     @property
     def focus_date(self):
         """return the date the focus is currently set to
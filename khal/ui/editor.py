@@ -321,8 +321,9 @@ class EventEditor(urwid.WidgetWrap):
     def __init__(self, pane, event, save_callback=None, always_save=False):
         """
         :type event: khal.event.Event
-        :param save_callback: call when saving event with new start and end
-             dates and recursiveness of original and edited event as parameters
+        :param save_callback: call when saving event with its new start and
+             the (first, last) intervals of the days it was or now is on as
+             parameters
         :type save_callback: callable
         :param always_save: save event even if it has not changed
         :type always_save: bool
@@ -492,19 +493,16 @@ class EventEditor(urwid.WidgetWrap):
             self.event.increment_sequence()
             if self.event.etag is None:  # has not been saved before
                 self.event.calendar = self.calendar_chooser.active['name']
-                self.collection.new(self.event)
+                days = self.collection.new(self.event)
             elif self.calendar_chooser.changed:
-                self.collection.change_collection(
+                days = self.collection.change_collection(
                     self.event,
                     self.calendar_chooser.active['name']
                 )
             else:
-                self.collection.update(self.event)
+                days = self.collection.update(self.event)
 
-            self._save_callback(
-                self.event.start_local, self.event.end_local,
-                self.event.recurring or self.recurrenceeditor.changed,
-            )
+            self._save_callback(self.event.start_local, days)
         self._abort_confirmed = False
         self.pane.window.backtrack()
 
@@ -272,7 +272,7 @@ def get_month_abbr_len():
     return max(len(month_abbr[i]) for i in range(1, 13)) + 1
 
 
-def expand(vevent, href=''):
+def expand(vevent, href='', start=None, end=None):
     """
     Constructs a list of start and end dates for all recurring instances of the
     event defined in vevent.
@@ -288,6 +288,12 @@ def expand(vevent, href=''):
     :param href: the href of the vevent, used for more informative logging and
                  nothing else
     :type href: str
+    :param start: if given, only instances of recurring events starting at or
+                  after this unix timestamp are returned
+    :type start: int
+    :param end: if given, only instances of recurring events starting before
+                this unix timestamp are returned
+    :type end: int
     :returns: list of start and end (date)times of the expanded event
     :rtype: list(tuple(datetime, datetime))
     """
@@ -351,6 +357,14 @@ def expand(vevent, href=''):
             rrule._until = pytz.UTC.localize(
                 rrule._until).astimezone(events_tz).replace(tzinfo=None)
 
+        if next(iter(rrule), None) is None:
+            raise UnsupportedRecurrence()
+
+        if end is not None:
+            # one day of slack, as `end` is in UTC and DTSTART is local time
+            window_until = dt.datetime.utcfromtimestamp(end) + dt.timedelta(days=1)
+            rrule._until = min(rrule._until, window_until)
+
         rrule = map(sanitize_datetime, rrule)
 
         logger.debug('calculating recurrence dates for {}, this might take some time.'.format(href))
@@ -358,8 +372,6 @@ def expand(vevent, href=''):
         # RRULE and RDATE may specify the same date twice, it is recommended by
         # the RFC to consider this as only one instance
         dtstartl = set(rrule)
-        if not dtstartl:
-            raise UnsupportedRecurrence()
     else:
         dtstartl = {vevent['DTSTART'].dt}
 
@@ -379,15 +391,24 @@ def expand(vevent, href=''):
     if expand:
         dtstartl.update(get_dates(vevent, 'RDATE') or ())
 
+    def in_window(date):
+        return (start is None or start <= to_unix_time(date)) and \
+            (end is None or to_unix_time(date) < end)
+
     # remove excluded dates
     if expand:
         for date in get_dates(vevent, 'EXDATE') or ():
             try:
                 dtstartl.remove(date)
             except KeyError:
-                logger.warning(
-                    'In event {}, excluded instance starting at {} not found, '
-                    'event might be invalid.'.format(href, date))
+                # instances outside the window have not been calculated
+                if in_window(date):
+                    logger.warning(
+                        'In event {}, excluded instance starting at {} not found, '
+                        'event might be invalid.'.format(href, date))
+
+    if expand and (rrule_param is not None or 'RDATE' in vevent):
+        dtstartl = {date for date in dtstartl if in_window(date)}
 
     dtstartend = [(start, start + duration) for start in dtstartl]
     # not necessary, but I prefer deterministic output
@@ -521,6 +542,23 @@ def to_unix_time(dtime: dt.datetime) -> float:
     return unix_time
 
 
+def merge_date_intervals(intervals):
+    """merge overlapping and adjacent intervals of days
+
+    :param intervals: (first, last) tuples of dates, both included
+    :returns: the merged intervals, sorted
+    :rtype: list(tuple(datetime.date, datetime.date))
+    """
+    merged = list()
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + dt.timedelta(days=1):
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
 def to_naive_utc(dtime):
     """convert a datetime object to UTC and than remove the tzinfo, if
     datetime is naive already, return it
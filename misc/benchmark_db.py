@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Benchmark the range queries of khal's sqlite cache.
+
+Fills a database with synthetic recurrence instances and times the queries
+run when ikhal loads a day and when `khal list` lists a range of days, once
+with the R*Tree index and once without it, as well as `khal search` with and
+without the full text search index.
+
+    python misc/benchmark_db.py --rows 1000000
+"""
+
+import argparse
+import datetime as dt
+import os
+import random
+import tempfile
+import time
+
+import pytz
+
+from khal import utils
+from khal.khalendar import backend
+
+LOCALE = {
+    'local_timezone': pytz.timezone('Europe/Berlin'),
+    'default_timezone': pytz.timezone('Europe/Berlin'),
+}
+CALENDAR = 'home'
+START = dt.datetime(2000, 1, 1)
+YEARS = 40
+INSTANCES_PER_EVENT = 10
+WORDS = ['meeting', 'party', 'dentist', 'review', 'lunch', 'call', 'standup', 'trip']
+EVENT = """BEGIN:VEVENT
+SUMMARY:{summary}
+DESCRIPTION:{description}
+LOCATION:Room {number}
+DTSTART;TZID=Europe/Berlin:20140409T093000
+DTEND;TZID=Europe/Berlin:20140409T103000
+UID:{number}
+END:VEVENT"""
+
+
+def fill(db, rows):
+    """insert `rows` instances, spread evenly over events and half of them
+    floating, without going through the (slow) parsing and expansion"""
+    random.seed(0)
+    span = int(YEARS * 365.25 * 24 * 60 * 60)
+    start_u = utils.to_unix_time(pytz.utc.localize(START))
+    events, search, recs_loc, recs_float = [], [], [], []
+    for number in range(rows // INSTANCES_PER_EVENT):
+        href = '{}.ics'.format(number)
+        summary = '{} {}'.format(random.choice(WORDS), number)
+        description = ' '.join(random.choice(WORDS) for _ in range(20))
+        events.append((number + 1, href, CALENDAR, 0, 'etag', EVENT.format(
+            summary=summary, description=description, number=number)))
+        search.append((number + 1, summary, description, 'Room {}'.format(number)))
+        recs = recs_float if number % 2 else recs_loc
+        for inst in range(INSTANCES_PER_EVENT):
+            dtstart = start_u + random.randrange(span)
+            dtend = dtstart + random.choice([15 * 60, 60 * 60, 8 * 60 * 60, 24 * 60 * 60])
+            recs.append((dtstart, dtend, href, str(inst), str(inst), 0, CALENDAR))
+    with db.at_once():
+        db.cursor.executemany(
+            'INSERT INTO events (id, href, calendar, sequence, etag, item) '
+            'VALUES (?, ?, ?, ?, ?, ?);', events)
+        db.cursor.executemany(
+            'INSERT INTO events_fts (rowid, summary, description, location) '
+            'VALUES (?, ?, ?, ?);', search)
+        for table, recs in [('recs_loc', recs_loc), ('recs_float', recs_float)]:
+            db.cursor.executemany(
+                'INSERT INTO {} (dtstart, dtend, href, rec_inst, ref, dtype, calendar) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?);'.format(table), recs)
+            # computed when committing
+            db._mark_changed(table, CALENDAR)
+
+
+def day_loads(db, days):
+    """what ikhal's DayWalker queries when scrolling through `days` days"""
+    tz = LOCALE['local_timezone']
+    day = dt.date(2020, 1, 1)
+    for _ in range(days):
+        start = dt.datetime.combine(day, dt.time.min)
+        end = dt.datetime.combine(day, dt.time.max)
+        list(db.get_localized(tz.localize(start), tz.localize(end)))
+        list(db.get_floating(start, end))
+        day += dt.timedelta(days=1)
+
+
+def khal_list(db, days):
+    """what `khal list` queries, plus the calendars on the days `khal
+    calendar` highlights, both once for all days"""
+    tz = LOCALE['local_timezone']
+    start = dt.datetime(2020, 1, 1)
+    end = start + dt.timedelta(days=days)
+    list(db.get_localized(tz.localize(start), tz.localize(end)))
+    list(db.get_floating(start, end))
+    db.get_calendars_between(start.date(), end.date())
+
+
+def search(db, searches):
+    """what `khal search` queries"""
+    for number in range(searches):
+        list(db.search('Room {}'.format(number * 997)))
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help='number of instances to insert (default: %(default)s)')
+    parser.add_argument('--days', type=int, default=30,
+                        help='number of days to load (default: %(default)s)')
+    parser.add_argument('--searches', type=int, default=10,
+                        help='number of searches (default: %(default)s)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = backend.SQLiteDb([CALENDAR], os.path.join(tmpdir, 'khal.db'), LOCALE)
+        if not (db._rtree and db._fts):
+            parser.exit(1, 'sqlite3 has been compiled without R*Tree or FTS5 support\n')
+        print('inserting {} instances: {:.1f}s'.format(
+            args.rows, timeit(fill, db, args.rows)))
+        for rtree in [False, True]:
+            db._rtree = rtree
+            print('{} index:'.format('with' if rtree else 'without'))
+            print('  ikhal, {} day loads: {:.3f}s'.format(
+                args.days, timeit(day_loads, db, args.days)))
+            print('  khal list, {} days: {:.3f}s'.format(
+                args.days, timeit(khal_list, db, args.days)))
+        for fts in [False, True]:
+            db._fts = fts
+            print('{} full text search index:'.format('with' if fts else 'without'))
+            print('  khal search, {} searches: {:.3f}s'.format(
+                args.searches, timeit(search, db, args.searches)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Benchmark the time khal's subcommands spend importing modules.
+
+Runs every subcommand in a fresh interpreter with `python -X importtime`
+against a small calendar (whose cache was built before) and prints the total
+import time and the number of imported modules. Subcommands importing more
+than their budget, or importing modules they should not need, fail the
+benchmark.
+
+    python misc/benchmark_imports.py --runs 5 --scale 2
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+CONFIG = """
+[calendars]
+[[home]]
+path = {path}
+[locale]
+timeformat = %H:%M
+dateformat = %d.%m.
+longdateformat = %d.%m.%Y
+datetimeformat = %d.%m. %H:%M
+longdatetimeformat = %d.%m.%Y %H:%M
+[sqlite]
+path = {db}
+"""
+
+EVENT = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:benchmark
+SUMMARY:An event
+DTSTART;VALUE=DATE:20140909
+DTEND;VALUE=DATE:20140910
+RRULE:FREQ=WEEKLY
+END:VEVENT
+END:VCALENDAR
+"""
+
+# subcommand: (arguments, import time budget in ms, modules it must not import)
+SUBCOMMANDS = {
+    '--help': ([], 120, ['khal.khalendar', 'icalendar', 'urwid']),
+    'printformats': ([], 120, ['khal.khalendar', 'icalendar', 'urwid']),
+    'printcalendars': ([], 200, ['urwid', 'multiprocessing']),
+    'list': (['09.09.2014'], 200, ['urwid', 'multiprocessing']),
+    'at': (['09.09.2014', '12:00'], 200, ['urwid', 'multiprocessing']),
+    'calendar': (['09.09.2014'], 200, ['urwid', 'multiprocessing']),
+    'search': (['event'], 200, ['urwid', 'multiprocessing']),
+}
+
+RUN = textwrap.dedent("""
+    import sys
+    from khal.cli import main_khal
+    try:
+        main_khal(sys.argv[1:])
+    except SystemExit:
+        pass
+    print(' '.join(sys.modules), file=sys.stderr)
+""")
+
+IMPORT_TIME = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\S.*)$')
+
+
+def measure(config, args):
+    """return the total import time (in ms) of running khal with `args` and
+    the imported modules"""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', RUN, '-c', config] + args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    lines = process.stderr.splitlines()
+    total = 0
+    for line in lines:
+        match = IMPORT_TIME.match(line)
+        # only top level imports, their time includes that of nested ones
+        if match and not match.group(2).startswith(' '):
+            total += int(match.group(1))
+    return total / 1000, set(lines[-1].split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of runs of each subcommand, the fastest counts '
+                             '(default: %(default)s)')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='multiply all budgets, for slower machines (default: %(default)s)')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'home')
+        os.makedirs(path)
+        with open(os.path.join(path, 'event.ics'), 'w') as f:
+            f.write(EVENT)
+        config = os.path.join(tmpdir, 'config')
+        with open(config, 'w') as f:
+            f.write(CONFIG.format(path=path, db=os.path.join(tmpdir, 'khal.db')))
+        measure(config, ['list'])  # build the cache
+
+        for command, (arguments, budget, forbidden) in SUBCOMMANDS.items():
+            results = [measure(config, [command] + arguments) for _ in range(args.runs)]
+            import_time = min(result[0] for result in results)
+            modules = results[0][1]
+            budget *= args.scale
+            problems = ['imports ' + module for module in forbidden if module in modules]
+            if import_time > budget:
+                problems.append('over budget of {:.0f}ms'.format(budget))
+            failed = failed or bool(problems)
+            print('{:<15} {:6.1f}ms {:4} modules  {}'.format(
+                command, import_time, len(modules), ', '.join(problems) or 'ok'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
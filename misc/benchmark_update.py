@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Benchmark building khal's sqlite cache from a vdir.
+
+Creates a vdir with simple and recurring events and times how long it takes
+to build the cache from scratch (what happens the first time khal runs) and
+to update it after some of the events have changed.
+
+    python misc/benchmark_update.py --files 20000 --jobs 4
+"""
+
+import argparse
+import datetime as dt
+import logging
+import os
+import random
+import tempfile
+import time
+
+import pytz
+
+from khal.khalendar import CalendarCollection
+
+LOCALE = {
+    'local_timezone': pytz.timezone('Europe/Berlin'),
+    'default_timezone': pytz.timezone('Europe/Berlin'),
+}
+
+EVENT = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//khal//benchmark//EN
+BEGIN:VEVENT
+UID:{uid}
+SUMMARY:Event {uid}
+DTSTART;TZID=Europe/Berlin:{start:%Y%m%dT%H%M%S}
+DTEND;TZID=Europe/Berlin:{end:%Y%m%dT%H%M%S}
+{rrule}END:VEVENT
+END:VCALENDAR
+"""
+RRULES = [
+    '',
+    '',
+    '',
+    'RRULE:FREQ=WEEKLY;COUNT=52\n',
+    'RRULE:FREQ=DAILY;COUNT=30\n',
+    'RRULE:FREQ=MONTHLY;COUNT=120\n',
+]
+
+
+def write_vdir(path, files):
+    random.seed(0)
+    os.makedirs(path)
+    for number in range(files):
+        start = dt.datetime(2015, 1, 1, 8) + dt.timedelta(
+            days=random.randrange(3650), hours=random.randrange(10))
+        with open(os.path.join(path, '{}.ics'.format(number)), 'w') as f:
+            f.write(EVENT.format(
+                uid=number, start=start, end=start + dt.timedelta(hours=1),
+                rrule=random.choice(RRULES)))
+
+
+def build(calendars, dbpath, jobs):
+    return CalendarCollection(calendars=calendars, locale=LOCALE, dbpath=dbpath, jobs=jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=20000,
+                        help='number of .ics files in the vdir (default: %(default)s)')
+    parser.add_argument('--changed', type=int, default=1000,
+                        help='number of files changed before updating (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processes parsing events (default: %(default)s)')
+    args = parser.parse_args()
+    logging.getLogger('khal').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'home')
+        write_vdir(path, args.files)
+        calendars = {'home': {'name': 'home', 'path': path, 'color': '', 'readonly': False}}
+        dbpath = os.path.join(tmpdir, 'khal.db')
+
+        start = time.perf_counter()
+        build(calendars, dbpath, args.jobs)
+        print('building the cache for {} files: {:.1f}s'.format(
+            args.files, time.perf_counter() - start))
+
+        time.sleep(1)  # make sure the etags change
+        for number in range(0, args.files, args.files // args.changed):
+            # files get replaced atomically (like vdirsyncer does), which also
+            # changes the vdir's mtime
+            filename = os.path.join(path, '{}.ics'.format(number))
+            with open(filename) as f:
+                text = f.read()
+            with open(filename + '.tmp', 'w') as f:
+                f.write(text.replace('SUMMARY:Event', 'SUMMARY:Changed event'))
+            os.replace(filename + '.tmp', filename)
+        start = time.perf_counter()
+        build(calendars, dbpath, args.jobs)
+        print('updating the cache for {} changed files: {:.1f}s'.format(
+            args.changed, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 
 import datetime as dt
+import sqlite3
 from operator import itemgetter
 
 import icalendar
@@ -8,18 +9,67 @@ import pytest
 from khal.khalendar import backend
 from khal.khalendar.exceptions import OutdatedDbVersionError, UpdateFailed
 
-from .utils import BERLIN, LOCALE_BERLIN, _get_text
+from .utils import BERLIN, DB_VERSION_5, LOCALE_BERLIN, LOCALE_SYDNEY, _get_text
 
 calname = 'home'
 
 
-def test_new_db_version():
+def test_new_db_version(monkeypatch):
     dbi = backend.SQLiteDb(calname, ':memory:', locale=LOCALE_BERLIN)
-    backend.DB_VERSION += 1
+    monkeypatch.setattr(backend, 'DB_VERSION', backend.DB_VERSION + 1)
     with pytest.raises(OutdatedDbVersionError):
         dbi._check_table_version()
 
 
+def test_newer_db_version(tmpdir, monkeypatch):
+    dbpath = str(tmpdir) + '/khal.db'
+    backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN).conn.close()
+    monkeypatch.setattr(backend, 'DB_VERSION', backend.DB_VERSION - 1)
+    with pytest.raises(OutdatedDbVersionError):
+        backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+
+
+def test_migrate_from_5(tmpdir):
+    """a version 5 db (khal 0.9's) is migrated in place and ends up like a
+    new one"""
+    fresh = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    for href, text in [('recuid.ics', _get_text('event_rrule_recuid')),
+                       ('d_rr.ics', _get_text('event_d_rr')),
+                       ('simple.ics', _get_text('event_dt_simple')),
+                       ('future.ics', event_rrule_this_and_future)]:
+        fresh.update(text, href=href, etag='abcd', calendar=calname)
+
+    dbpath = str(tmpdir) + '/khal.db'
+    conn = sqlite3.connect(dbpath)
+    for statement in DB_VERSION_5:
+        conn.execute(statement)
+    conn.execute("INSERT INTO calendars (calendar, resource) VALUES (?, '');", (calname, ))
+    conn.executemany(
+        'INSERT INTO events (href, calendar, sequence, etag, item) VALUES (?, ?, ?, ?, ?);',
+        fresh.sql_ex('SELECT href, calendar, sequence, etag, item FROM events;', ()))
+    for table in ['recs_loc', 'recs_float']:
+        columns = 'dtstart, dtend, href, rec_inst, ref, dtype, calendar'
+        conn.executemany(
+            'INSERT INTO {} ({}) VALUES (?, ?, ?, ?, ?, ?, ?);'.format(table, columns),
+            fresh.sql_ex('SELECT {} FROM {};'.format(columns, table), ()))
+    conn.commit()
+    conn.close()
+
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert db.sql_ex('SELECT version FROM version;', ()) == [(backend.DB_VERSION, )]
+    for sql_s in ['SELECT calendar, window_start, window_end, reach FROM calendars;',
+                  'SELECT href, recurring FROM events ORDER BY href;',
+                  'SELECT * FROM records ORDER BY href, ref;',
+                  'SELECT * FROM occupancy ORDER BY calendar, year;']:
+        assert db.sql_ex(sql_s, ()) == fresh.sql_ex(sql_s, ())
+    start = BERLIN.localize(dt.datetime(2014, 4, 1))
+    end = BERLIN.localize(dt.datetime(2014, 9, 1))
+    assert sorted(db.get_localized(start, end), key=str) == \
+        sorted(fresh.get_localized(start, end), key=str)
+    if db._fts:
+        assert list(db.search('Arbeit')) == list(fresh.search('Arbeit'))
+
+
 def test_event_rrule_recurrence_id():
     dbi = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
     assert dbi.list(calname) == list()
@@ -174,7 +224,7 @@ def test_event_recuid_rrule_no_master():
     assert events[0][3] == dt.datetime(2014, 6, 30, 12, 0)
     assert events[1][2] == dt.datetime(2014, 7, 7, 8, 30)
     assert events[1][3] == dt.datetime(2014, 7, 7, 12, 0)
-    events = dbi.search('VEVENT')
+    events = dbi.search('Arbeit')
     assert len(list(events)) == 2
 
 
@@ -561,6 +611,60 @@ def test_update_one_should_not_affect_others():
     assert len(events) == 1
 
 
+event_rrule_recuid_master = _get_text('event_rrule_recuid').split(
+    'BEGIN:VEVENT\nUID:event_rrule_recurrence_id\nSUMMARY:Arbeit\nRECURRENCE-ID')[0] + \
+    'END:VCALENDAR\n'
+
+
+def _instances(db):
+    return sorted(db.sql_ex(
+        'SELECT id, dtstart, dtend, href, rec_inst, ref, dtype FROM recs_loc;', ()))
+
+
+@pytest.mark.parametrize('old,new', [
+    # summary changed
+    (event_rrule_recurrence_id_reverse,
+     event_rrule_recurrence_id_reverse.replace('SUMMARY:Arbeit', 'SUMMARY:Work')),
+    # override added
+    (event_rrule_recuid_master, _get_text('event_rrule_recuid')),
+    # override removed
+    (_get_text('event_rrule_recuid'), _get_text('event_rrule_recuid_update')),
+    # recurrence rule changed
+    (event_rrule_recurrence_id_reverse,
+     event_rrule_recurrence_id_reverse.replace('COUNT=6', 'COUNT=3;INTERVAL=2')),
+    (_get_text('event_rrule_recuid'), event_rrule_this_and_future),
+    (event_rrule_this_and_future, _get_text('event_rrule_recuid')),
+], ids=['summary', 'override_added', 'override_removed', 'rrule', 'thisandfuture_added',
+        'thisandfuture_removed'])
+def test_update_same_as_fresh(old, new):
+    """updating an event leaves the same instances as inserting it anew"""
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    db.update(old, href='12345.ics', etag='abcd', calendar=calname)
+    db.update(new, href='12345.ics', etag='abcd', calendar=calname)
+    fresh = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    fresh.update(new, href='12345.ics', etag='abcd', calendar=calname)
+    assert sorted(row[1:] for row in _instances(db)) == \
+        sorted(row[1:] for row in _instances(fresh))
+
+
+def test_update_only_writes_changed_instances():
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    master = event_rrule_recuid_master
+    db.update(master, href='12345.ics', etag='abcd', calendar=calname)
+    db.update(_get_text('event_dt_simple'), href='simple.ics', etag='abcd', calendar=calname)
+    before = _instances(db)
+    assert len(before) == 7
+
+    db.update(master.replace('SUMMARY:Arbeit', 'SUMMARY:Work'),
+              href='12345.ics', etag='efgh', calendar=calname)
+    assert _instances(db) == before
+
+    db.update(_get_text('event_rrule_recuid'), href='12345.ics', etag='ijkl', calendar=calname)
+    after = _instances(db)
+    assert len(after) == 7
+    assert len(set(before) - set(after)) == 1
+
+
 def test_no_dtend():
     """test support for events with no dtend"""
     db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
@@ -707,3 +811,457 @@ def test_vcard_two_birthdays():
     db.update_birthday(card_two_birthdays, 'unix.vcf', calendar=calname)
     events = list(db.get_floating(start, end))
     assert len(events) == 0
+
+
+event_daily_open_ended = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:daily_standup
+SUMMARY:Standup
+RRULE:FREQ=DAILY
+EXDATE;TZID=Europe/Berlin:20140703T091500
+DTSTART;TZID=Europe/Berlin:20140630T091500
+DTEND;TZID=Europe/Berlin:20140630T093000
+END:VEVENT
+BEGIN:VEVENT
+UID:daily_standup
+SUMMARY:Standup (moved)
+RECURRENCE-ID;TZID=Europe/Berlin:20160111T091500
+DTSTART;TZID=Europe/Berlin:20160111T140000
+DTEND;TZID=Europe/Berlin:20160111T141500
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.mark.parametrize('text', [
+    event_daily_open_ended,
+    event_rrule_this_and_future,
+    event_rrule_multi_this_and_future_allday,
+    _get_text('event_rrule_recuid'),
+    _get_text('event_d_rr'),
+    _get_text('event_dt_rd'),
+    _get_text('event_dtr_exdatez'),
+    _get_text('event_r_past'),
+])
+def test_recurrence_horizon_same_results(text):
+    """instances expanded on demand must not differ from a full expansion"""
+    full = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    windowed = backend.SQLiteDb(
+        [calname], ':memory:', locale=LOCALE_BERLIN, horizon=dt.timedelta(days=60))
+    for db in [full, windowed]:
+        db.update(text, href='12345.ics', etag='abcd', calendar=calname)
+
+    for start, end in [
+            (dt.datetime(2014, 6, 1), dt.datetime(2014, 9, 1)),
+            (dt.datetime(2016, 1, 1), dt.datetime(2016, 2, 1)),
+            (dt.datetime(2015, 4, 1), dt.datetime(2015, 5, 1)),
+            (dt.datetime(2030, 1, 1), dt.datetime(2030, 1, 8)),
+            (dt.datetime(2037, 12, 1), dt.datetime(2038, 2, 1)),
+            (dt.datetime(1990, 1, 1), dt.datetime(2040, 1, 1)),
+    ]:
+        for db in [full, windowed]:
+            db.localized = sorted(db.get_localized(BERLIN.localize(start), BERLIN.localize(end)))
+            db.floating = sorted(db.get_floating(start, end))
+        assert full.localized == windowed.localized
+        assert full.floating == windowed.floating
+
+
+def test_recurrence_horizon_stores_less():
+    full = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    windowed = backend.SQLiteDb(
+        [calname], ':memory:', locale=LOCALE_BERLIN, horizon=dt.timedelta(days=60))
+    for db in [full, windowed]:
+        db.update(event_daily_open_ended, href='12345.ics', etag='abcd', calendar=calname)
+    count_s = 'SELECT count(*) FROM recs_loc;'
+    assert full.sql_ex(count_s, ())[0][0] > 8000
+    assert windowed.sql_ex(count_s, ())[0][0] < 150
+
+
+def test_recurrence_horizon_disabled_expands_everything(tmpdir):
+    """opening a database in which only a window was expanded without a
+    horizon expands all remaining instances"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb(
+        [calname], dbpath, locale=LOCALE_BERLIN, horizon=dt.timedelta(days=60))
+    db.update(event_daily_open_ended, href='12345.ics', etag='abcd', calendar=calname)
+    db.conn.close()
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert db.sql_ex('SELECT count(*) FROM recs_loc;', ())[0][0] > 8000
+    assert db.sql_ex('SELECT window_start, window_end FROM calendars;', ()) == [(None, None)]
+
+
+@pytest.mark.parametrize('text', [
+    event_daily_open_ended,
+    event_rrule_this_and_future,
+    event_rrule_multi_this_and_future_allday,
+    _get_text('event_dt_simple'),
+    _get_text('event_d_rr'),
+])
+def test_rtree_index_same_results(text):
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    if not db._rtree:
+        pytest.skip('sqlite has no R*Tree support')
+    db.update(text, href='12345.ics', etag='abcd', calendar=calname)
+    for start, end in [
+            (dt.datetime(2014, 4, 9), dt.datetime(2014, 4, 10)),
+            (dt.datetime(2014, 6, 30, 9, 30), dt.datetime(2014, 7, 1)),
+            (dt.datetime(2014, 6, 1), dt.datetime(2014, 9, 1)),
+            (dt.datetime(2016, 1, 11), dt.datetime(2016, 1, 12)),
+            (dt.datetime(1990, 1, 1), dt.datetime(2040, 1, 1)),
+    ]:
+        db._rtree = True
+        indexed = (sorted(db.get_localized(BERLIN.localize(start), BERLIN.localize(end))),
+                   sorted(db.get_floating(start, end)),
+                   sorted(db.get_localized_calendars(
+                       BERLIN.localize(start), BERLIN.localize(end))),
+                   sorted(db.get_floating_calendars(start, end)))
+        db._rtree = False
+        scanned = (sorted(db.get_localized(BERLIN.localize(start), BERLIN.localize(end))),
+                   sorted(db.get_floating(start, end)),
+                   sorted(db.get_localized_calendars(
+                       BERLIN.localize(start), BERLIN.localize(end))),
+                   sorted(db.get_floating_calendars(start, end)))
+        assert indexed == scanned
+
+
+def test_batch(tmpdir):
+    """with `batch`, events are committed in batches even within at_once"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN, batch=2)
+    other = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    text = _get_text('event_dt_simple')
+    with db.at_once():
+        db.update(text, href='one.ics', etag='abcd', calendar=calname)
+        assert other.list(calname) == []
+        db.update(text, href='two.ics', etag='abcd', calendar=calname)
+        assert len(other.list(calname)) == 2
+        db.delete('one.ics', calendar=calname)
+        assert len(other.list(calname)) == 2
+    assert other.list(calname) == [('two.ics', 'abcd')]
+    assert other.get_calendars_between(dt.date(2014, 4, 9), dt.date(2014, 4, 9)) == \
+        {dt.date(2014, 4, 9): {calname}}
+
+
+def test_rtree_index_in_sync(tmpdir):
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    if not db._rtree:
+        pytest.skip('sqlite has no R*Tree support')
+
+    def count(table):
+        return db.sql_ex('SELECT count(*) FROM {};'.format(table), ())[0][0]
+
+    db.update(event_rrule_this_and_future, href='12345.ics', etag='abcd', calendar=calname)
+    db.update(_get_text('event_d_rr'), href='d.ics', etag='abcd', calendar=calname)
+    assert count('recs_loc_index') == count('recs_loc') > 0
+    assert count('recs_float_index') == count('recs_float') > 0
+    assert db.sql_ex(
+        'SELECT count(*) FROM recs_loc JOIN recs_loc_index ON recs_loc.id = recs_loc_index.id '
+        'WHERE recs_loc.dtstart < recs_loc_index.dtstart - 1 OR '
+        'recs_loc.dtend > recs_loc_index.dtend + 1;', ()) == [(0, )]
+
+    db.delete('12345.ics', calendar=calname)
+    assert count('recs_loc_index') == count('recs_loc') == 0
+
+    # indexes missing from an existing database get populated
+    db.update(event_rrule_this_and_future, href='12345.ics', etag='abcd', calendar=calname)
+    db.sql_ex('DROP TABLE recs_loc_index;', ())
+    db.sql_ex('DROP TRIGGER recs_loc_insert;', ())
+    db.sql_ex('DROP TRIGGER recs_loc_update;', ())
+    db.sql_ex('DROP TRIGGER recs_loc_delete;', ())
+    db.conn.close()
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert count('recs_loc_index') == count('recs_loc') > 0
+
+
+def _index_mismatches(db, table):
+    """the number of instances in `table` not matched by their R*Tree entry"""
+    return db.sql_ex(
+        'SELECT count(*) FROM {0} LEFT JOIN {0}_index ON {0}.id = {0}_index.id '
+        'WHERE {0}_index.id IS NULL OR {0}.dtstart < {0}_index.dtstart - 1 OR '
+        '{0}.dtend > {0}_index.dtend + 1;'.format(table), ())[0][0]
+
+
+def test_rtree_index_survives_vacuum(tmpdir):
+    """VACUUM may renumber implicit rowids, the index must not rely on them"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    if not db._rtree:
+        pytest.skip('sqlite has no R*Tree support')
+    db.update(_get_text('event_dt_simple'), href='simple.ics', etag='abcd', calendar=calname)
+    db.update(event_rrule_this_and_future, href='12345.ics', etag='abcd', calendar=calname)
+    db.update(_get_text('event_rrule_recuid'), href='recuid.ics', etag='abcd', calendar=calname)
+    db.delete('12345.ics', calendar=calname)
+    start = BERLIN.localize(dt.datetime(2014, 4, 1))
+    end = BERLIN.localize(dt.datetime(2014, 9, 1))
+    before = sorted(db.get_localized(start, end), key=str)
+    assert before
+
+    db.conn.execute('VACUUM;')
+    db.conn.close()
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert _index_mismatches(db, 'recs_loc') == 0
+    assert sorted(db.get_localized(start, end), key=str) == before
+
+
+def test_migrate_from_9(tmpdir):
+    """the instances of a version 9 db keep the rowids their index refers to
+    as ids"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    if not db._rtree:
+        pytest.skip('sqlite has no R*Tree support')
+    db.update(event_rrule_this_and_future, href='12345.ics', etag='abcd', calendar=calname)
+    db.update(_get_text('event_d_rr'), href='d.ics', etag='abcd', calendar=calname)
+    db.delete('12345.ics', calendar=calname)
+    db.update(_get_text('event_rrule_recuid'), href='recuid.ics', etag='abcd', calendar=calname)
+    instances = {table: db.sql_ex('SELECT * FROM {} ORDER BY id;'.format(table), ())
+                 for table in ['recs_loc', 'recs_float']}
+    # back to the layout of version 9, instances referenced by their rowids
+    columns = 'dtstart, dtend, href, rec_inst, ref, dtype, calendar'
+    with db.at_once():
+        for table in ['recs_loc', 'recs_float']:
+            db.sql_ex('ALTER TABLE {0} RENAME TO {0}_new;'.format(table), ())
+            db.sql_ex('''CREATE TABLE {} (
+                dtstart INT NOT NULL,
+                dtend INT NOT NULL,
+                href TEXT NOT NULL REFERENCES events( href ),
+                rec_inst TEXT NOT NULL,
+                ref TEXT NOT NULL,
+                dtype INT NOT NULL,
+                calendar TEXT NOT NULL,
+                primary key (href, rec_inst, calendar)
+                );'''.format(table), ())
+            db.sql_ex('INSERT INTO {0} (rowid, {1}) SELECT id, {1} FROM {0}_new;'.format(
+                table, columns), ())
+            db.sql_ex('DROP TABLE {}_new;'.format(table), ())
+        db.sql_ex('UPDATE version SET version = 9;', ())
+    db.conn.close()
+
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert db.sql_ex('SELECT version FROM version;', ()) == [(backend.DB_VERSION, )]
+    for table in ['recs_loc', 'recs_float']:
+        assert db.sql_ex('SELECT * FROM {} ORDER BY id;'.format(table), ()) == instances[table]
+        assert _index_mismatches(db, table) == 0
+    # the triggers keep the index in sync again
+    db.delete('recuid.ics', calendar=calname)
+    db.update(event_rrule_this_and_future, href='12345.ics', etag='abcd', calendar=calname)
+    for table in ['recs_loc', 'recs_float']:
+        assert _index_mismatches(db, table) == 0
+        assert db.sql_ex('SELECT count(*) FROM {}_index;'.format(table), ()) == \
+            db.sql_ex('SELECT count(*) FROM {};'.format(table), ())
+
+
+def _calendars_by_day(db, start, end):
+    """the calendars on each day between `start` and `end`, queried day by day"""
+    days = dict()
+    day = start
+    while day <= end:
+        day_start = dt.datetime.combine(day, dt.time.min)
+        day_end = dt.datetime.combine(day, dt.time.max)
+        localize = db.locale['local_timezone'].localize
+        days[day] = set(db.get_localized_calendars(localize(day_start), localize(day_end))) | \
+            set(db.get_floating_calendars(day_start, day_end))
+        day += dt.timedelta(days=1)
+    return days
+
+
+@pytest.mark.parametrize('horizon', [None, dt.timedelta(days=60)])
+def test_occupancy(tmpdir, horizon):
+    """the occupancy kept up to date while events change matches the
+    instances and one rebuilt from scratch"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb(['home', 'work'], dbpath, locale=LOCALE_BERLIN, horizon=horizon)
+    start, end = dt.date(2013, 12, 1), dt.date(2015, 2, 1)
+    occupancy_s = 'SELECT * FROM occupancy ORDER BY calendar, year;'
+    for update in [
+            ('home', '12345.ics', event_rrule_recuid_master),
+            ('home', '12345.ics', _get_text('event_rrule_recuid')),
+            ('home', '12345.ics', event_rrule_this_and_future),
+            ('work', 'simple.ics', _get_text('event_dt_simple')),
+            ('work', 'allday.ics', event_rrule_multi_this_and_future_allday),
+            ('work', 'daily.ics', event_daily_open_ended),
+            ('home', 'd.ics', _get_text('event_d_rr')),
+            ('work', 'simple.ics', None),
+            ('home', '12345.ics', None),
+            ('home', 'unix.vcf', card),
+    ]:
+        calendar, href, text = update
+        if text is None:
+            db.delete(href, calendar=calendar)
+        elif href.endswith('.vcf'):
+            db.update_birthday(text, href=href, calendar=calendar)
+        else:
+            db.update(text, href=href, etag='abcd', calendar=calendar)
+        assert db.get_calendars_between(start, end) == _calendars_by_day(db, start, end)
+
+    rebuilt = backend.SQLiteDb(['home', 'work'], dbpath, locale=LOCALE_BERLIN, horizon=horizon)
+    incremental = rebuilt.sql_ex(occupancy_s, ())
+    assert incremental
+    rebuilt.sql_ex('UPDATE calendars SET occupancy_tz = NULL;', ())
+    with rebuilt.at_once():
+        rebuilt._check_occupancy()
+    assert rebuilt.sql_ex(occupancy_s, ()) == incremental
+    rebuilt.conn.close()
+
+    # rebuilt when opened in another timezone
+    db.conn.close()
+    db = backend.SQLiteDb(['home', 'work'], dbpath, locale=LOCALE_SYDNEY, horizon=horizon)
+    assert db.sql_ex('SELECT DISTINCT occupancy_tz FROM calendars;', ()) == \
+        [('Australia/Sydney', )]
+    assert db.get_calendars_between(start, end) == _calendars_by_day(db, start, end)
+
+
+event_searchable = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:searchable
+SUMMARY:Team meeting
+DESCRIPTION:Discuss the roadmap\\, bring coffee
+LOCATION:Berlin
+CATEGORIES:work,planning
+ATTENDEE;CN=Jane Doe:mailto:jane@example.com
+DTSTART;TZID=Europe/Berlin:20140409T093000
+DTEND;TZID=Europe/Berlin:20140409T103000
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+def test_search_fts():
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    if not db._fts:
+        pytest.skip('sqlite has no FTS5 support')
+    db.update(event_searchable, href='search.ics', etag='abcd', calendar=calname)
+    db.update(_get_text('event_dt_simple'), href='simple.ics', etag='abcd', calendar=calname)
+
+    def hrefs(search_string):
+        return [result[1] for result in db.search(search_string)]
+
+    assert hrefs('meeting') == ['search.ics']
+    assert hrefs('MEET') == ['search.ics']
+    assert hrefs('coffee roadmap') == ['search.ics']
+    assert hrefs('planning') == ['search.ics']
+    assert hrefs('jane') == ['search.ics']
+    assert hrefs('Doe') == ['search.ics']
+    assert hrefs('location:berl') == ['search.ics']
+    assert hrefs('summary:berlin') == []
+    assert hrefs('meeting event') == []
+    assert hrefs('tzid') == []
+    assert hrefs('VEVENT') == []
+    assert hrefs('event') == ['simple.ics']
+    db.delete('search.ics', calendar=calname)
+    assert hrefs('meeting') == []
+    assert db.sql_ex('SELECT count(*) FROM events_fts;', ()) == [(1, )]
+
+
+def test_search_fts_ranked():
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    if not db._fts:
+        pytest.skip('sqlite has no FTS5 support')
+    db.update(event_searchable, href='search.ics', etag='abcd', calendar=calname)
+    db.update(event_searchable.replace('UID:searchable', 'UID:other').replace(
+        'SUMMARY:Team meeting', 'SUMMARY:Meeting about the meeting'),
+        href='other.ics', etag='abcd', calendar=calname)
+    assert [result[1] for result in db.search('meeting')] == ['other.ics', 'search.ics']
+
+
+def test_search_fts_populated(tmpdir):
+    """the search index is built for existing databases"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    if not db._fts:
+        pytest.skip('sqlite has no FTS5 support')
+    db.update(event_searchable, href='search.ics', etag='abcd', calendar=calname)
+    db.sql_ex('DROP TABLE events_fts;', ())
+    db.conn.close()
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert [result[1] for result in db.search('location:berlin')] == ['search.ics']
+
+
+def test_search_fts_survives_vacuum(tmpdir):
+    """VACUUM may renumber implicit rowids, the search index must not rely
+    on them"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    if not db._fts:
+        pytest.skip('sqlite has no FTS5 support')
+    db.update(_get_text('event_dt_simple'), href='simple.ics', etag='abcd', calendar=calname)
+    db.update(event_searchable, href='search.ics', etag='abcd', calendar=calname)
+    db.delete('simple.ics', calendar=calname)
+    db.conn.execute('VACUUM;')
+    db.conn.close()
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert [result[1] for result in db.search('meeting')] == ['search.ics']
+
+
+def test_migrate_from_10(tmpdir):
+    """the events of a version 10 db keep the rowids their search index
+    refers to as ids"""
+    dbpath = str(tmpdir) + '/khal.db'
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    if not db._fts:
+        pytest.skip('sqlite has no FTS5 support')
+    db.update(_get_text('event_dt_simple'), href='simple.ics', etag='abcd', calendar=calname)
+    db.update(event_searchable, href='search.ics', etag='abcd', calendar=calname)
+    db.delete('simple.ics', calendar=calname)
+    events = db.sql_ex('SELECT * FROM events ORDER BY id;', ())
+    # back to the layout of version 10, events referenced by their rowids
+    columns = 'href, calendar, sequence, etag, item, recurring'
+    with db.at_once():
+        db.sql_ex('ALTER TABLE events RENAME TO events_new;', ())
+        db.sql_ex('''CREATE TABLE events (
+            href TEXT NOT NULL,
+            calendar TEXT NOT NULL,
+            sequence INT,
+            etag TEXT,
+            item TEXT,
+            recurring INT NOT NULL DEFAULT 0,
+            primary key (href, calendar)
+            );''', ())
+        db.sql_ex('INSERT INTO events (rowid, {0}) SELECT id, {0} FROM events_new;'.format(
+            columns), ())
+        db.sql_ex('DROP TABLE events_new;', ())
+        db.sql_ex('UPDATE version SET version = 10;', ())
+    db.conn.close()
+
+    db = backend.SQLiteDb([calname], dbpath, locale=LOCALE_BERLIN)
+    assert db.sql_ex('SELECT version FROM version;', ()) == [(backend.DB_VERSION, )]
+    assert db.sql_ex('SELECT * FROM events ORDER BY id;', ()) == events
+    assert [result[1] for result in db.search('meeting')] == ['search.ics']
+    # the trigger keeps the index in sync again
+    db.delete('search.ics', calendar=calname)
+    assert db.sql_ex('SELECT count(*) FROM events_fts;', ()) == [(0, )]
+
+
+def test_search_like():
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    db._fts = False
+    db.update(event_searchable, href='search.ics', etag='abcd', calendar=calname)
+    assert [result[1] for result in db.search('eeting')] == ['search.ics']
+
+
+def test_records():
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    text = _get_text('event_rrule_recuid').replace(
+        'SUMMARY:Arbeit\nRECURRENCE-ID', 'SUMMARY:Arbeit (lang)\nRECURRENCE-ID')
+    db.update(text, href='12345.ics', etag='abcd', calendar=calname)
+    events = sorted(db.get_localized(
+        BERLIN.localize(dt.datetime(2014, 6, 30)), BERLIN.localize(dt.datetime(2014, 7, 22))))
+    assert len(events) == 4
+    records = [event[7] for event in sorted(events, key=itemgetter(2))]
+    assert [record.summary for record in records] == [
+        'Arbeit', 'Arbeit (lang)', 'Arbeit', 'Arbeit']
+    assert all(record.recurring for record in records)
+    assert records[0].start_tz == 'Europe/Berlin'
+
+    db.delete('12345.ics', calendar=calname)
+    assert db.sql_ex('SELECT count(*) FROM records;', ()) == [(0, )]
+
+
+def test_records_birthdays():
+    """birthdays' summaries depend on the instance, so they have no records"""
+    db = backend.SQLiteDb([calname], ':memory:', locale=LOCALE_BERLIN)
+    db.update_birthday(card, 'unix.vcf', calendar=calname)
+    events = list(db.get_floating(start, end))
+    assert len(events) == 1
+    assert events[0][7] is None
@@ -6,6 +6,8 @@ import unicodedata
 import pytest
 from khal.calendar_display import getweeknumber, str_week, vertical_month
 
+from .utils import cal1
+
 today = dt.date.today()
 yesterday = today - dt.timedelta(days=1)
 tomorrow = today + dt.timedelta(days=1)
@@ -338,3 +340,27 @@ def test_vertical_month_abbr_fr():
             raise
     finally:
         locale.setlocale(locale.LC_ALL, 'C')
+
+
+def test_vertical_month_highlight(coll_vdirs):
+    """the days with events are looked up with one query for all months"""
+    coll, vdirs = coll_vdirs
+    for day in ['20111205', '20120229']:
+        coll.new(coll.new_event(
+            'BEGIN:VEVENT\nUID:{0}\nSUMMARY:An Event\nDTSTART;VALUE=DATE:{0}\n'
+            'END:VEVENT\n'.format(day), cal1))
+    calls = []
+    get_calendars_between = coll.get_calendars_between
+    coll.get_calendars_between = lambda *args: calls.append(args) or get_calendars_between(*args)
+    options = dict(month=12, year=2011, today=dt.date(2011, 12, 12), collection=coll,
+                   highlight_event_days=True, color='dark red')
+    vert_str = vertical_month(**options)
+    assert calls == [(dt.date(2011, 11, 28), dt.date(2012, 3, 4))]
+    assert '\x1b[31m 5\x1b[0m' in vert_str[2]
+    assert '\x1b[31m29\x1b[0m' in vert_str[-1]
+
+    # the same as asking the collection for every day
+    coll.get_calendars_between = get_calendars_between
+    week = [dt.date(2011, 12, 5) + dt.timedelta(days=number) for number in range(7)]
+    assert str_week(week, options['today'], coll, 'fg', color='dark red',
+                    highlight_event_days=True) in vert_str[2]
@@ -1,5 +1,6 @@
 import datetime as dt
 import os
+import subprocess
 import sys
 
 import pytest
@@ -357,6 +358,42 @@ def test_printformats(runner):
     assert not result.exception
 
 
+@pytest.mark.parametrize('args,unneeded', [
+    (['printformats'], ['khal.khalendar', 'icalendar', 'urwid']),
+    (['list'], ['urwid', 'multiprocessing']),
+])
+def test_lazy_imports(runner, args, unneeded):
+    """subcommands only import the (slow to import) modules they need"""
+    runner = runner(days=2)
+    code = ('import sys; from khal.cli import main_khal; '
+            'main_khal(sys.argv[1:], standalone_mode=False); '
+            'print(" ".join(sys.modules))')
+    env = dict(os.environ, XDG_CACHE_HOME=str(runner.tmpdir.join('.cache')))
+    modules = subprocess.check_output(
+        [sys.executable, '-c', code, '-c', str(runner.config_file)] + args,
+        env=env, universal_newlines=True).split()
+    assert [module for module in unneeded if module in modules] == []
+
+
+def test_list_broken_pipe(runner):
+    """list stops without a traceback once nobody reads its output anymore,
+    e.g. when piped into `head`"""
+    runner = runner(days=2)
+    runner.calendars['one'].join('daily.ics').write(_get_text('event_d_rr').replace(
+        'RRULE:FREQ=DAILY;COUNT=10', 'RRULE:FREQ=DAILY'))
+    env = dict(os.environ, XDG_CACHE_HOME=str(runner.tmpdir.join('.cache')))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'khal', '-c', str(runner.config_file),
+         'list', '09.04.2014', '5000d'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, universal_newlines=True)
+    assert process.stdout.readline() == 'Wednesday, 09.04.2014\n'
+    process.stdout.close()
+    stderr = process.stderr.read()
+    process.stderr.close()
+    assert process.wait() == 1
+    assert stderr == ''
+
+
 # "see #810"
 @pytest.mark.xfail
 def test_repeating(runner):
@@ -40,6 +40,14 @@ def coll_vdirs_birthday(tmpdir):
     return coll, vdirs
 
 
+@pytest.fixture(autouse=True)
+def xdg_cache_home(tmpdir, monkeypatch):
+    """don't use or write to the user's cache (e.g., the cached config)"""
+    path = str(tmpdir.join('.cache'))
+    monkeypatch.setattr('xdg.BaseDirectory.xdg_cache_home', path)
+    return path
+
+
 @pytest.fixture(autouse=True)
 def never_echo_bytes(monkeypatch):
     '''Click's echo function will not strip colorcodes if we call `click.echo`
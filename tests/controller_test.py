@@ -4,7 +4,8 @@ from textwrap import dedent
 import pytest
 from freezegun import freeze_time
 from khal import exceptions
-from khal.controllers import import_ics, khal_list, start_end_from_daterange
+from khal.controllers import (format_events, get_events_between, import_ics, khal_list,
+                              start_end_from_daterange)
 from khal.khalendar.vdir import Item
 
 from . import utils
@@ -90,6 +91,48 @@ class TestGetAgenda:
         assert 'no events' in '\n'.join(
             khal_list(coll, [], conf, agenda_format=event_format, day_format="{name}")).lower()
 
+    @pytest.mark.parametrize('query_days,queries_expected', [(31, 2), (6, 8)])
+    def test_one_query(self, coll_vdirs, monkeypatch, query_days, queries_expected):
+        """listing a range queries the cache once (per QUERY_DAYS), but finds
+        the same events for each day as querying it day by day"""
+        monkeypatch.setattr('khal.khalendar.khalendar.QUERY_DAYS', query_days)
+        coll, vdirs = coll_vdirs
+        for name in ['event_d_long', 'event_d_same_start_end', 'event_dt_floating',
+                     'event_dt_long', 'event_dt_london', 'event_dt_rr', 'event_d_rr',
+                     'event_dt_simple', 'event_no_dst']:
+            ics = _get_text(name).replace('V042MJ8B3SJNFXQOJL6P53OFMHJE8Z3VZWOU', name)
+            coll.new(coll.new_event(ics, utils.cal1))
+        coll.new(coll.new_event(dedent("""
+            BEGIN:VEVENT
+            UID:midnight
+            SUMMARY:Until midnight
+            DTSTART;TZID=Europe/Berlin:20140409T220000
+            DTEND;TZID=Europe/Berlin:20140410T000000
+            END:VEVENT
+            """), utils.cal1))
+        start, end = dt.datetime(2014, 4, 1, 10), dt.datetime(2014, 4, 20, 12)
+
+        expected = []
+        day = start
+        while day < end:
+            day_end = min(end, dt.datetime.combine(day.date(), dt.time.max))
+            expected.append(get_events_between(
+                coll, conf['locale'], day, day_end, agenda_format='{title}',
+                notstarted=True, original_start=utils.BERLIN.localize(start)))
+            day = dt.datetime.combine(day.date() + dt.timedelta(days=1), dt.time.min)
+
+        queries = []
+        get_localized, get_floating = coll.get_localized, coll.get_floating
+        coll.get_localized = lambda *args: queries.append(args) or get_localized(*args)
+        coll.get_floating = lambda *args: queries.append(args) or get_floating(*args)
+        days = list(coll.get_events_by_day(start, end))
+        assert len(queries) == queries_expected
+        assert [format_events(
+            events, day_start, day_end, agenda_format='{title}', notstarted=True,
+            original_start=utils.BERLIN.localize(start)) for day_start, day_end, events in days
+        ] == expected
+        assert any(expected)
+
 
 class TestImport:
     def test_import(self, coll_vdirs):
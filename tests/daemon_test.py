@@ -0,0 +1,151 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import khal.cli
+import pytest
+from click.testing import CliRunner
+from khal.cli import main_khal
+
+from .utils import _get_text
+
+CONFIG = """
+[calendars]
+[[home]]
+path = {path}
+color = dark blue
+[locale]
+timeformat = %H:%M
+dateformat = %d.%m.
+longdateformat = %d.%m.%Y
+datetimeformat = %d.%m. %H:%M
+longdatetimeformat = %d.%m.%Y %H:%M
+local_timezone = Europe/Berlin
+default_timezone = Europe/Berlin
+[sqlite]
+path = {db}
+"""
+
+
+@pytest.fixture
+def daemon(tmpdir, xdg_cache_home):
+    path = tmpdir.mkdir('home')
+    path.join('event.ics').write(_get_text('event_dt_simple'))
+    config = tmpdir.join('config')
+    config.write(CONFIG.format(path=path, db=tmpdir.join('khal.db')))
+    # the same, with the vdir's path in an environment variable
+    tmpdir.join('config_environ').write(CONFIG.format(path='$CALDIR', db=tmpdir.join('khal.db')))
+    socket_path = str(tmpdir.join('khal.db-daemon.sock'))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'khal', '-c', str(config), 'daemon'],
+        env=dict(os.environ, XDG_CACHE_HOME=xdg_cache_home, CALDIR=str(path)))
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.1)
+    else:
+        process.kill()
+        pytest.fail('the daemon did not start')
+    yield process, str(config), path
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def test_forward(daemon, monkeypatch):
+    process, config, path = daemon
+
+    def build_collection(*args, **kwargs):
+        raise AssertionError('not forwarded to the daemon')
+    original = khal.cli.build_collection
+    monkeypatch.setattr(khal.cli, 'build_collection', build_collection)
+    runner = CliRunner()
+
+    result = runner.invoke(main_khal, ['-c', config, 'list', '09.04.2014'])
+    assert not result.exception
+    assert result.output == 'Wednesday, 09.04.2014\n09:30-10:30 An Event\n'
+
+    # written atomically, like vdirsyncer does
+    path.join('event.tmp').write(_get_text('event_dt_simple').replace('An Event', 'Changed'))
+    os.rename(str(path.join('event.tmp')), str(path.join('event.ics')))
+    result = runner.invoke(main_khal, ['-c', config, 'search', 'Changed'])
+    assert result.output == '09.04. 09:30-09.04. 10:30 Changed\n'
+
+    result = runner.invoke(main_khal, ['-c', config, 'list', '-a', 'unknown'])
+    assert result.exit_code == 2
+    assert 'Unknown calendar unknown' in result.output
+
+    process.terminate()
+    assert process.wait(10) == 0
+    assert not os.path.exists(config[:-len('config')] + 'khal.db-daemon.sock')
+    monkeypatch.setattr(khal.cli, 'build_collection', original)
+    result = runner.invoke(main_khal, ['-c', config, 'list', '09.04.2014'])
+    assert result.output == 'Wednesday, 09.04.2014\n09:30-10:30 Changed\n'
+
+
+def test_different_environ(daemon, monkeypatch):
+    """commands of clients with a different environment aren't forwarded, they
+    might print something else than in the daemon"""
+    process, config, path = daemon
+    assert os.stat(config[:-len('config')] + 'khal.db-daemon.sock').st_mode & 0o777 == 0o600
+
+    calls = list()
+    original = khal.cli.build_collection
+
+    def build_collection(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(khal.cli, 'build_collection', build_collection)
+    runner = CliRunner()
+
+    result = runner.invoke(main_khal, ['-c', config, 'list', '09.04.2014'])
+    assert result.output == 'Wednesday, 09.04.2014\n09:30-10:30 An Event\n'
+    assert calls == []
+
+    result = runner.invoke(main_khal, ['-c', config, 'list', '09.04.2014'],
+                           env={'TZ': 'America/New_York', 'LC_TIME': 'C'})
+    assert result.output == 'Wednesday, 09.04.2014\n09:30-10:30 An Event\n'
+    assert len(calls) == 1
+
+
+def test_different_referenced_environ(daemon, monkeypatch, tmpdir):
+    """commands of clients with other values for the variables referenced in
+    the config file aren't forwarded"""
+    process, config, path = daemon
+    config = config + '_environ'
+    other = tmpdir.mkdir('other')
+    other.join('event.ics').write(_get_text('event_dt_simple').replace('An Event', 'Other'))
+
+    calls = list()
+    original = khal.cli.build_collection
+
+    def build_collection(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(khal.cli, 'build_collection', build_collection)
+    runner = CliRunner()
+
+    result = runner.invoke(main_khal, ['-c', config, 'list', '09.04.2014'],
+                           env={'CALDIR': str(path)})
+    assert result.output == 'Wednesday, 09.04.2014\n09:30-10:30 An Event\n'
+    assert calls == []
+
+    result = runner.invoke(main_khal, ['-c', config, 'list', '09.04.2014'],
+                           env={'CALDIR': str(other)})
+    assert result.output == 'Wednesday, 09.04.2014\n09:30-10:30 Other\n'
+    assert len(calls) == 1
+
+
+def test_idle_client(daemon, monkeypatch):
+    """a client which never sends its request doesn't block the daemon"""
+    process, config, path = daemon
+
+    def build_collection(*args, **kwargs):
+        raise AssertionError('not forwarded to the daemon')
+    monkeypatch.setattr(khal.cli, 'build_collection', build_collection)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as idle:
+        idle.connect(config[:-len('config')] + 'khal.db-daemon.sock')
+        result = CliRunner().invoke(main_khal, ['-c', config, 'list', '09.04.2014'])
+    assert result.output == 'Wednesday, 09.04.2014\n09:30-10:30 An Event\n'
@@ -5,7 +5,8 @@ import pytz
 from freezegun import freeze_time
 from icalendar import vRecur, vText
 from khal.khalendar.event import (AllDayEvent, Event, FloatingEvent,
-                                  LocalizedEvent, create_timezone)
+                                  LocalizedEvent, create_timezone,
+                                  record_from_vevent)
 
 from .utils import (BERLIN, BOGOTA, GMTPLUS3, LOCALE_BERLIN, LOCALE_BOGOTA,
                     LOCALE_MIXED, NEW_YORK, _get_text, normalize_component)
@@ -456,6 +457,71 @@ def test_event_alarm():
     assert event.alarms == [(dt.timedelta(-1, 82800), vText('new event'))]
 
 
+def test_event_alarm_symbol():
+    event = Event.fromString(_get_text('event_dt_simple'), **EVENT_KWARGS)
+    assert event.format('{title}{alarm-symbol}', dt.date(2014, 4, 9)) == 'An Event\x1b[0m'
+    event.update_alarms([(dt.timedelta(-1, 82800), 'new event')])
+    assert event.format('{title}{alarm-symbol}', dt.date(2014, 4, 9)) == \
+        'An Event \N{Alarm clock}\x1b[0m'
+
+
+@pytest.mark.parametrize('name,start,end', [
+    ('event_dt_simple',
+     BERLIN.localize(dt.datetime(2014, 4, 9, 9, 30)),
+     BERLIN.localize(dt.datetime(2014, 4, 9, 10, 30))),
+    ('event_dt_simple_updated',
+     BERLIN.localize(dt.datetime(2014, 4, 9, 9, 30)),
+     BERLIN.localize(dt.datetime(2014, 4, 9, 10, 30))),
+    ('event_dt_london',
+     pytz.UTC.localize(dt.datetime(2014, 4, 9, 13, 30)),
+     pytz.UTC.localize(dt.datetime(2014, 4, 9, 14, 30))),
+    ('event_dt_floating', dt.datetime(2014, 4, 9, 9, 30), dt.datetime(2014, 4, 9, 10, 30)),
+    ('event_d_rr', dt.date(2014, 3, 28), dt.date(2014, 3, 29)),
+])
+def test_from_record(name, start, end):
+    """events created from records are formatted like fully parsed ones"""
+    text = _get_text(name)
+    event = Event.fromString(text, start=start, end=end, **EVENT_KWARGS)
+    vevent = [item for item in event._vevents.values()][0]
+    record = record_from_vevent(vevent)
+    from_record = Event.fromRecord(text, record, 'PROTO', start=start, end=end, **EVENT_KWARGS)
+    format_ = ('{start-long} {end-long} {duration} {start-end-time-style} {title}'
+               '{repeat-symbol}{alarm-symbol} {repeat-pattern} {description} {location} '
+               '{categories} {status} {all-day}')
+    assert type(from_record) is type(event)
+    assert from_record.start == event.start
+    assert from_record.end == event.end
+    assert from_record.format(format_, start) == event.format(format_, start)
+    assert from_record._record is not None
+
+
+def test_from_record_parses_on_demand():
+    text = _get_text('event_dt_simple')
+    record = record_from_vevent(Event.fromString(text, **EVENT_KWARGS)._vevents['PROTO'])
+    start = BERLIN.localize(dt.datetime(2014, 4, 9, 9, 30))
+    end = BERLIN.localize(dt.datetime(2014, 4, 9, 10, 30))
+    event = Event.fromRecord(text, record, 'PROTO', start=start, end=end, **EVENT_KWARGS)
+    assert event.summary == 'An Event'
+    assert event._record is not None
+    assert event.uid == 'V042MJ8B3SJNFXQOJL6P53OFMHJE8Z3VZWOU'
+    assert event._record is None
+    event.update_summary('Another Event')
+    assert event.summary == 'Another Event'
+
+
+def test_record_from_vevent():
+    event = Event.fromString(_get_text('event_dt_simple_updated'), **EVENT_KWARGS)
+    record = record_from_vevent(event._vevents['PROTO'])
+    assert record.summary == 'A not so simple Event'
+    assert record.location == 'anywhere'
+    assert record.categories == 'meeting'
+    assert record.recurring is False
+    assert record.alarm is False
+    assert record.start_tz == record.end_tz == 'Europe/Berlin'
+    event = Event.fromString(_get_text('event_dt_floating'), **EVENT_KWARGS)
+    assert record_from_vevent(event._vevents['PROTO']).start_tz is None
+
+
 def test_create_timezone_static():
     gmt = pytz.timezone('Etc/GMT-8')
     assert create_timezone(gmt).to_ical().split() == [
@@ -1,8 +1,11 @@
 import datetime as dt
 import logging
+import multiprocessing
 import os
+import sqlite3
+import threading
 from textwrap import dedent
-from time import sleep
+from time import sleep, time
 
 import khal.khalendar.exceptions
 import khal.utils
@@ -11,11 +14,11 @@ from freezegun import freeze_time
 from khal.khalendar import CalendarCollection
 from khal.khalendar.backend import CouldNotCreateDbDir
 from khal.khalendar.event import Event
-from khal.khalendar.vdir import Item
+from khal.khalendar.vdir import Item, Vdir
 
 from . import utils
 from .utils import (_get_text, cal1, cal2, cal3, normalize_component, DumbItem,
-                    BERLIN, LONDON, SYDNEY, LOCALE_SYDNEY, LOCALE_BERLIN)
+                    BERLIN, LONDON, SYDNEY, LOCALE_SYDNEY, LOCALE_BERLIN, DB_VERSION_5)
 
 today = dt.date.today()
 yesterday = today - dt.timedelta(days=1)
@@ -243,6 +246,30 @@ class TestCollection(object):
         assert len(events) == 1
         assert events[0].summary == 'really simple event'
 
+    def test_vevents_shared(self, coll_vdirs):
+        """all instances of a recurring event share one parse, which doesn't
+        change when one of them gets edited"""
+        coll, vdirs = coll_vdirs
+        coll.new(Event.fromString(
+            _get_text('event_dt_rr'), calendar=cal1, locale=LOCALE_BERLIN), cal1)
+        events = list(coll.get_floating(
+            dt.datetime(2014, 4, 9), dt.datetime(2014, 4, 12, 23, 59)))
+        assert len(events) == 4
+        assert all(event.uid == events[0].uid for event in events)
+        assert all(event._vevents is events[0]._vevents for event in events)
+        assert (coll._vevents_cache.hits, coll._vevents_cache.misses) == (3, 1)
+
+        events[0].update_summary('changed')
+        assert events[0].summary == 'changed'
+        assert all(event.summary == 'An Event' for event in events[1:])
+        assert events[1]._vevents is events[2]._vevents
+        coll.update(events[0])
+        events = list(coll.get_floating(
+            dt.datetime(2014, 4, 9), dt.datetime(2014, 4, 12, 23, 59)))
+        assert events[0].uid == events[1].uid
+        assert coll._vevents_cache.misses == 2
+        assert all(event.summary == 'changed' for event in events)
+
     def test_newevent(self, coll_vdirs):
         coll, vdirs = coll_vdirs
         bday = dt.datetime.combine(aday, dt.time.min)
@@ -287,7 +314,7 @@ class TestCollection(object):
         event = Event.fromString(
             _get_text('event_dt_recuid_no_master'), calendar=cal1, locale=LOCALE_BERLIN)
         coll.new(event, cal1)
-        assert len(list(coll.search('Event'))) == 1
+        assert len(list(coll.search('Infrastructure'))) == 1
 
     def test_search_recurrence_id_only_multi(self, coll_vdirs):
         """test searching for recurring events which only have a recuid event,
@@ -297,7 +324,7 @@ class TestCollection(object):
         event = Event.fromString(
             _get_text('event_dt_multi_recuid_no_master'), calendar=cal1, locale=LOCALE_BERLIN)
         coll.new(event, cal1)
-        events = list(sorted(coll.search('Event')))
+        events = list(sorted(coll.search('Arbeit')))
         assert len(events) == 2
         assert events[0].format(
             '{start} {end} {title}', dt.date.today()) == '30.06. 07:30 30.06. 12:00 Arbeit\x1b[0m'
@@ -501,6 +528,116 @@ def test_only_update_old_event(coll_vdirs, monkeypatch, sleep_time):
     assert updated_hrefs == [href_three]
 
 
+def test_db_update_bulk_etags(coll_vdirs, monkeypatch, sleep_time):
+    """the etags of a calendar are all compared at once, not queried one by
+    one"""
+    coll, vdirs = coll_vdirs
+    for number in range(3):
+        vdirs[cal1].upload(Item(event_allday_template.replace(
+            'uid3@host1.com', 'uid{}'.format(number)).format('20140909', '20140910')))
+    coll.update_db()
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 3
+
+    def get_etag(href, calendar):
+        raise AssertionError('get_etag called')
+    monkeypatch.setattr(coll._backend, 'get_etag', get_etag)
+    sleep(sleep_time)
+    href, etag = next(iter(vdirs[cal1].list()))
+    vdirs[cal1].delete(href, etag)
+    coll.update_db()
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 2
+
+
+def test_update_db_max_age(coll_vdirs, sleep_time):
+    """calendars checked less than max_age ago are trusted without looking at
+    their vdirs"""
+    coll, vdirs = coll_vdirs
+    coll.update_db()
+    sleep(sleep_time)
+    vdirs[cal1].upload(Item(event_allday_template.format('20140909', '20140910')))
+    coll.update_db(max_age=dt.timedelta(hours=1))
+    assert list(coll.get_events_on(dt.date(2014, 9, 9))) == []
+
+    coll.update_db(max_age=dt.timedelta(0))
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 1
+    checked = coll._backend.get_checked(cal1)
+    assert time() - checked < 60
+
+    # unchanged calendars also count as checked
+    coll.update_db(max_age=dt.timedelta(0))
+    assert coll._backend.get_checked(cal1) >= checked
+
+
+def test_update_db_read_only(tmpdir, monkeypatch):
+    """checking unchanged calendars doesn't write to the db, so it doesn't
+    wait for other processes writing to it"""
+    path = str(tmpdir) + '/' + cal1
+    os.makedirs(path)
+    calendars = {cal1: {'name': cal1, 'path': path, 'color': '', 'readonly': False}}
+    Vdir(path, '.ics').upload(Item(event_allday_template.format('20140909', '20140910')))
+    dbpath = str(tmpdir) + '/khal.db'
+    CalendarCollection(calendars=calendars, dbpath=dbpath, locale=LOCALE_BERLIN,
+                       max_cache_age=dt.timedelta(hours=1))._backend.conn.close()
+
+    monkeypatch.setattr('khal.khalendar.backend.BUSY_TIMEOUT', 0.1)
+    other = sqlite3.connect(dbpath, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE;')
+    for max_cache_age in [None, dt.timedelta(hours=1)]:
+        coll = CalendarCollection(calendars=calendars, dbpath=dbpath, locale=LOCALE_BERLIN,
+                                  max_cache_age=max_cache_age)
+        coll.update_db()
+        assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 1
+        coll._backend.conn.close()
+    other.rollback()
+
+
+def test_parallel_update(tmpdir, monkeypatch, caplog, fix_caplog):
+    """events parsed in worker processes end up in the db just like those
+    parsed serially, with the same log messages in the same order"""
+    monkeypatch.setattr(khal.khalendar.khalendar, 'PARALLEL_MIN', 2)
+    caplog.set_level(logging.WARNING)
+    path = tmpdir.mkdir('home')
+    for name in ['event_rrule_recuid', 'event_dt_multi_uid', 'event_d_rr', 'event_dt_simple',
+                 'event_dtr_exdatez', 'event_dt_local_missing_tz']:
+        path.join(name + '.ics').write(_get_text(name))
+    calendars = {'home': {'name': 'home', 'path': str(path), 'color': '', 'readonly': False}}
+
+    results = list()
+    for jobs in [1, 2]:
+        caplog.clear()
+        coll = CalendarCollection(calendars=calendars, locale=LOCALE_BERLIN, jobs=jobs,
+                                  dbpath=str(tmpdir.join('{}.db'.format(jobs))))
+        results.append((
+            [record.message for record in caplog.records],
+            sorted(coll._backend.list('home')),
+            [sorted(coll._backend.sql_ex('SELECT {} FROM {};'.format(columns, table), ()))
+             for table, columns in [
+                 ('recs_loc', 'dtstart, dtend, href, rec_inst, ref, dtype, calendar'),
+                 ('recs_float', 'dtstart, dtend, href, rec_inst, ref, dtype, calendar'),
+                 ('records', '*')]],
+        ))
+    assert results[0] == results[1]
+    assert len(results[0][1]) == 5
+    assert any('multiple UIDs' in message for message in results[0][0])
+
+
+def test_legacy_etags(coll_vdirs, monkeypatch):
+    """etags of older versions (the mtime only) are converted without
+    reading the events again"""
+    coll, vdirs = coll_vdirs
+    href, etag = vdirs[cal1].upload(coll.new_event(event_today, cal1))
+    coll.update_db()
+    assert coll._backend.get_etag(href, cal1) == etag
+    coll._backend.set_etag(href, etag.split(';')[0], calendar=cal1)
+    coll._backend.set_ctag('', calendar=cal1)
+
+    updated_hrefs = []
+    monkeypatch.setattr(coll, '_update_vevent', lambda href, calendar: updated_hrefs.append(href))
+    coll.update_db()
+    assert updated_hrefs == []
+    assert coll._backend.get_etag(href, cal1) == etag
+
+
 card = """BEGIN:VCARD
 VERSION:3.0
 FN:Unix
@@ -580,3 +717,277 @@ def test_birthdays_no_year(coll_vdirs_birthday):
     events = list(coll.get_floating(dt.datetime(1971, 3, 11), dt.datetime(1971, 3, 11, 23, 59, 59)))
     assert len(events) == 1
     assert 'Unix\'s birthday' == events[0].summary
+
+
+def test_open_khal_09_db(tmpdir):
+    """the db of khal 0.9 is migrated when opened and then updated from the
+    vdirs as usual"""
+    path = tmpdir.mkdir('home')
+    path.join('one.ics').write(
+        event_allday_template.replace('uid3@host1.com', 'one').format('20140909', '20140910'))
+    dbpath = str(tmpdir.join('khal.db'))
+    conn = sqlite3.connect(dbpath)
+    for statement in DB_VERSION_5:
+        conn.execute(statement)
+    conn.execute("INSERT INTO calendars (calendar, resource) VALUES ('home', '');")
+    conn.commit()
+    conn.close()
+
+    calendars = {'home': {'name': 'home', 'path': str(path), 'color': '', 'readonly': False}}
+    coll = CalendarCollection(calendars=calendars, locale=LOCALE_BERLIN, dbpath=dbpath)
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 1
+    assert coll.get_calendars_on(dt.date(2014, 9, 9)) == ['home']
+
+
+def test_update_hrefs(coll_vdirs, sleep_time):
+    """only the given hrefs are updated, the days they touched are returned"""
+    coll, vdirs = coll_vdirs
+    href_one, etag_one = vdirs[cal1].upload(Item(
+        event_allday_template.replace('uid3@host1.com', 'one').format('20140909', '20140910')))
+    href_two, _ = vdirs[cal1].upload(Item(
+        event_allday_template.replace('uid3@host1.com', 'two').format('20140912', '20140913')))
+    assert coll.update_hrefs({cal1: {href_one}}) == [(dt.date(2014, 9, 9), dt.date(2014, 9, 9))]
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 1
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 12)))) == 0
+
+    # unchanged files (e.g. written by khal itself) are skipped
+    assert coll.update_hrefs({cal1: {href_one}}) == []
+
+    sleep(sleep_time)
+    vdirs[cal1].update(href_one, Item(
+        event_allday_template.replace('uid3@host1.com', 'one').format('20140915', '20140916')),
+        etag_one)
+    assert coll.update_hrefs({cal1: {href_one}}) == [
+        (dt.date(2014, 9, 9), dt.date(2014, 9, 9)), (dt.date(2014, 9, 15), dt.date(2014, 9, 15))]
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 0
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 15)))) == 1
+
+    os.remove(os.path.join(vdirs[cal1].path, href_one))
+    assert coll.update_hrefs({cal1: {href_one}}) == [(dt.date(2014, 9, 15), dt.date(2014, 9, 15))]
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 15)))) == 0
+
+
+def test_update_in_thread(tmpdir):
+    """the db is updated in another thread with its own connection, the
+    collection only sees the changes once they are passed to finish_update"""
+    path = tmpdir.mkdir('home')
+    calendars = {'home': {'name': 'home', 'path': str(path), 'color': '', 'readonly': False}}
+    coll = CalendarCollection(calendars=calendars, locale=LOCALE_BERLIN, update=False,
+                              dbpath=str(tmpdir.join('khal.db')))
+    path.join('one.ics').write(
+        event_allday_template.replace('uid3@host1.com', 'one').format('20140909', '20140910'))
+    assert coll.needs_update()
+
+    day = dt.date(2014, 9, 9)
+    assert coll.get_calendars_on(day) == []
+
+    results = list()
+    done = threading.Event()
+
+    def callback(result, last_ctags):
+        results.append((result, last_ctags))
+        done.set()
+
+    coll.update_in_thread(callback)
+    assert done.wait(10)
+    assert results[0][0] == [(dt.date(2014, 9, 9), dt.date(2014, 9, 9))]
+    assert coll.needs_update()
+    assert coll.get_calendars_on(day) == []
+    coll.finish_update(*results[0])
+    assert not coll.needs_update()
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 1
+    assert coll.get_calendars_on(day) == ['home']
+
+    done.clear()
+    path.join('one.ics').remove()
+    coll.update_in_thread(callback, {'home': {'one.ics'}})
+    assert done.wait(10)
+    assert results[1][0] == [(dt.date(2014, 9, 9), dt.date(2014, 9, 9))]
+    coll.finish_update(*results[1])
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 0
+    assert coll.get_calendars_on(day) == []
+
+
+def test_update_in_thread_batches(tmpdir, monkeypatch):
+    """the thread using the collection can write to the db while a long
+    update runs in the background"""
+    monkeypatch.setattr('khal.khalendar.backend.BUSY_TIMEOUT', 0.5)
+    monkeypatch.setattr(khal.khalendar.khalendar, 'BACKGROUND_BATCH', 2)
+    prepare_update = khal.khalendar.backend.prepare_update
+
+    def slow_prepare_update(*args):
+        sleep(0.05)
+        return prepare_update(*args)
+    monkeypatch.setattr('khal.khalendar.backend.prepare_update', slow_prepare_update)
+    path = tmpdir.mkdir('home')
+    calendars = {'home': {'name': 'home', 'path': str(path), 'color': '', 'readonly': False}}
+    coll = CalendarCollection(calendars=calendars, locale=LOCALE_BERLIN, update=False,
+                              dbpath=str(tmpdir.join('khal.db')))
+    for number in range(40):
+        path.join('{}.ics'.format(number)).write(event_allday_template.replace(
+            'uid3@host1.com', str(number)).format('20140909', '20140910'))
+
+    done = threading.Event()
+    coll.update_in_thread(lambda *args: done.set())
+    sleep(0.2)
+    assert not done.is_set()
+    coll.new(coll.new_event(event_allday_template.replace('uid3@host1.com', 'new').format(
+        '20140910', '20140911'), 'home'))
+    assert done.wait(10)
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 40
+
+
+def test_changed_days(coll_vdirs):
+    """changing events returns the intervals of the days they were or now
+    are on"""
+    coll, _ = coll_vdirs
+    event = Event.fromString(_get_text('event_dt_simple'), calendar=cal1, locale=LOCALE_BERLIN)
+    assert coll.new(event, cal1) == [(aday, aday)]
+
+    event = list(coll.get_events_on(aday))[0]
+    event.update_start_end(dt.date(2014, 4, 12), dt.date(2014, 4, 12))
+    assert coll.update(event) == [(aday, aday), (dt.date(2014, 4, 12), dt.date(2014, 4, 12))]
+
+    event = list(coll.get_events_on(dt.date(2014, 4, 12)))[0]
+    assert coll.change_collection(event, cal2) == [(dt.date(2014, 4, 12), dt.date(2014, 4, 12))]
+
+    event = list(coll.get_events_on(dt.date(2014, 4, 12)))[0]
+    assert coll.delete(event.href, event.etag, event.calendar) == [
+        (dt.date(2014, 4, 12), dt.date(2014, 4, 12))]
+    assert not coll.needs_update()
+
+
+def test_own_changes_keep_external_ones(coll_vdirs, sleep_time):
+    """changes of the vdir made by others (e.g. vdirsyncer) are still found
+    after the collection changed the vdir itself"""
+    coll, vdirs = coll_vdirs
+    coll.update_db()
+    assert not coll.needs_update()
+
+    sleep(sleep_time)
+    vdirs[cal1].upload(Item(
+        event_allday_template.replace('uid3@host1.com', 'synced').format('20140909', '20140910')))
+    event = Event.fromString(_get_text('event_dt_simple'), calendar=cal1, locale=LOCALE_BERLIN)
+    coll.new(event, cal1)
+    assert coll.needs_update()
+    coll.update_db()
+    assert len(list(coll.get_events_on(dt.date(2014, 9, 9)))) == 1
+    assert not coll.needs_update()
+
+
+def test_update_db_changed_days(tmpdir, monkeypatch, sleep_time):
+    """update_db returns the intervals of the days on which events changed,
+    None if another process changed the db or too many events changed"""
+    path = tmpdir.mkdir('home')
+    calendars = {'home': {'name': 'home', 'path': str(path), 'color': '', 'readonly': False}}
+    colls = [CalendarCollection(calendars=calendars, locale=LOCALE_BERLIN, update=False,
+                                dbpath=str(tmpdir.join('khal.db'))) for _ in range(2)]
+    path.join('one.ics').write(
+        event_allday_template.replace('SUMMARY', 'RRULE:FREQ=WEEKLY;COUNT=3\nSUMMARY')
+        .format('20140909', '20140911'))
+    assert colls[0].update_db() == [
+        (dt.date(2014, 9, 9), dt.date(2014, 9, 10)),
+        (dt.date(2014, 9, 16), dt.date(2014, 9, 17)),
+        (dt.date(2014, 9, 23), dt.date(2014, 9, 24)),
+    ]
+    assert colls[0].update_db() == []
+
+    sleep(sleep_time)
+    # written atomically, like vdirsyncer does
+    path.join('one.tmp').write(event_allday_template.format('20140910', '20140911'))
+    os.rename(str(path.join('one.tmp')), str(path.join('one.ics')))
+    assert colls[1].update_db() == [
+        (dt.date(2014, 9, 9), dt.date(2014, 9, 10)),
+        (dt.date(2014, 9, 16), dt.date(2014, 9, 17)),
+        (dt.date(2014, 9, 23), dt.date(2014, 9, 24)),
+    ]
+    assert colls[0].update_db() is None
+    assert colls[0].update_db() == []
+    assert colls[0].get_calendars_on(dt.date(2014, 9, 16)) == []
+
+    sleep(sleep_time)
+    monkeypatch.setattr(khal.khalendar.khalendar, 'MAX_TRACKED_CHANGES', 0)
+    path.join('one.ics').remove()
+    assert colls[0].update_db() is None
+    assert colls[0].get_calendars_on(dt.date(2014, 9, 10)) == []
+
+
+def test_get_calendars_between(coll_vdirs):
+    """the calendars on each day are found with one query, they are the same
+    as those found by querying each day on its own"""
+    coll, vdirs = coll_vdirs
+    for number, name in enumerate(['event_d_long', 'event_dt_floating', 'event_dt_long',
+                                   'event_dt_london', 'event_d_rr', 'event_no_dst']):
+        ics = _get_text(name).replace('V042MJ8B3SJNFXQOJL6P53OFMHJE8Z3VZWOU', name)
+        coll.new(coll.new_event(ics, [cal1, cal2, cal3][number % 3]))
+    start, end = dt.date(2014, 4, 1), dt.date(2014, 4, 30)
+
+    days = coll.get_calendars_between(start, end)
+    expected = dict()
+    for number in range((end - start).days + 1):
+        day = start + dt.timedelta(days=number)
+        day_start = dt.datetime.combine(day, dt.time.min)
+        day_end = dt.datetime.combine(day, dt.time.max)
+        expected[day] = set(coll._backend.get_floating_calendars(day_start, day_end)) | set(
+            coll._backend.get_localized_calendars(BERLIN.localize(day_start),
+                                                  BERLIN.localize(day_end)))
+    assert days == expected
+    assert days[aday] == {cal1, cal2, cal3}
+    assert days[dt.date(2014, 4, 20)] == set()
+
+    # remembered until events change
+    get_calendars_between = coll._backend.get_calendars_between
+    coll._backend.get_calendars_between = None
+    assert coll.get_calendars_on(aday) == sorted([cal1, cal2, cal3])
+    coll._backend.get_calendars_between = get_calendars_between
+    event = coll.new_event(_get_text('event_dt_simple').replace(
+        '20140409T', '20140420T'), cal2)
+    coll.new(event)
+    assert coll.get_calendars_on(dt.date(2014, 4, 20)) == [cal2]
+    coll.delete(event.href, event.etag, cal2)
+    assert coll.get_calendars_on(dt.date(2014, 4, 20)) == []
+
+
+def _stress(calendars, dbpath, number, write):
+    """update (if `write`) and read the db at `dbpath` several times, return
+    the exception raised, if any"""
+    path = calendars['home']['path']
+    try:
+        for run in range(10):
+            if write:
+                filename = os.path.join(path, 'event{}.ics'.format(number))
+                with open(filename + '.tmp', 'w') as f:
+                    f.write(event_allday_template.replace(
+                        'uid3@host1.com', 'event{}'.format(number)).replace(
+                        'a meeting', 'meeting {}'.format(run)).format('20140909', '20140910'))
+                os.replace(filename + '.tmp', filename)
+            coll = CalendarCollection(calendars=calendars, locale=LOCALE_BERLIN, dbpath=dbpath)
+            list(coll.get_events_on(dt.date(2014, 9, 9)))
+    except Exception as error:
+        return repr(error)
+
+
+def test_concurrent_access(tmpdir):
+    """several processes reading and updating the same db at the same time
+    don't fail with "database is locked" and don't lose any updates"""
+    path = tmpdir.mkdir('home')
+    for number in range(20):
+        path.join('old{}.ics'.format(number)).write(event_allday_template.replace(
+            'uid3@host1.com', 'old{}'.format(number)).format('20140909', '20140910'))
+    calendars = {'home': {'name': 'home', 'path': str(path), 'color': '', 'readonly': False}}
+    dbpath = str(tmpdir.join('khal.db'))
+
+    with multiprocessing.Pool(8) as pool:
+        errors = pool.starmap(_stress, [
+            (calendars, dbpath, number, number % 2 == 0) for number in range(8)])
+    assert errors == [None] * 8
+
+    coll = CalendarCollection(calendars=calendars, locale=LOCALE_BERLIN, dbpath=dbpath)
+    assert not coll.needs_update()
+    summaries = sorted(event.summary for event in coll.get_events_on(dt.date(2014, 9, 9)))
+    assert summaries == ['a meeting'] * 20 + ['meeting 9'] * 4
+    assert coll._backend.conn.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+    # all lock files are kept in one directory
+    assert sorted(name for name in os.listdir(str(tmpdir)) if name.startswith('khal.db')) == \
+        ['khal.db', 'khal.db-locks', 'khal.db-shm', 'khal.db-wal']
+    assert len(os.listdir(dbpath + '-locks')) == 2
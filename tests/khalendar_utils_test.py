@@ -369,6 +369,18 @@ class TestExpand(object):
              new_york.localize(dt.datetime(2011, 12, 3, 17, 0))),
         ]
 
+    def test_expand_dt_window(self):
+        vevent = _get_vevent(event_dt)
+        start = utils.to_unix_time(berlin.localize(dt.datetime(2013, 5, 1, 14, 0)))
+        end = utils.to_unix_time(berlin.localize(dt.datetime(2013, 11, 1, 14, 0)))
+        dtstart = utils.expand(vevent, berlin, start, end)
+        assert dtstart == self.dtstartend_berlin[1:4]
+
+    def test_expand_d_window(self):
+        vevent = _get_vevent(event_d)
+        dtstart = utils.expand(vevent, berlin, end=utils.to_unix_time(dt.date(2013, 7, 2)))
+        assert dtstart == self.dstartend[:3]
+
 
 class TestExpandNoRR(object):
     dtstartend_berlin = [
@@ -1,6 +1,7 @@
 import datetime as dt
 import os.path
 
+import khal.settings.settings
 import pytest
 from khal.settings import get_config
 from khal.settings.exceptions import (CannotParseConfigFileError,
@@ -30,7 +31,9 @@ class TestSettings(object):
                 'work': {'path': os.path.expanduser('~/.calendars/work/'),
                          'readonly': False, 'color': None, 'type': 'calendar'},
             },
-            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db')},
+            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db'),
+                       'recurrence_horizon': None, 'jobs': 1,
+                       'max_cache_age': None},
             'locale': LOCALE_BERLIN,
             'default': {
                 'default_calendar': None,
@@ -65,7 +68,9 @@ class TestSettings(object):
                 'work': {'path': os.path.expanduser('~/.calendars/work/'),
                          'readonly': True, 'color': None,
                          'type': 'calendar'}},
-            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db')},
+            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db'),
+                       'recurrence_horizon': None, 'jobs': 1,
+                       'max_cache_age': None},
             'locale': {
                 'local_timezone': get_localzone(),
                 'default_timezone': get_localzone(),
@@ -288,6 +293,72 @@ def test_config_checks(metavdirs):
     }
 
 
+def test_cached_config(metavdirs, monkeypatch, xdg_cache_home):
+    """the validated config is reused until the config file, the discovered
+    vdirs or their metadata change, but not when events change"""
+    # it's in the directory the vdirs are discovered in
+    os.makedirs(xdg_cache_home)
+    conf_path = metavdirs + '/config'
+    with open(conf_path, 'w') as conf:
+        conf.write('[calendars]\n[[default]]\npath = {}/cal[1-3]/*\ntype = discover\n'
+                   '[sqlite]\npath = {}/khal.db\n'.format(metavdirs, metavdirs))
+    config = get_config(conf_path)
+    assert len(config['calendars']) == 6
+
+    def validate(*args):
+        raise AssertionError('validated again')
+    validate_config = khal.settings.settings._validate_config
+    monkeypatch.setattr(khal.settings.settings, '_validate_config', validate)
+    assert get_config(conf_path) == config
+
+    with open(metavdirs + '/cal1/public/event.ics', 'w') as event:
+        event.write('BEGIN:VCALENDAR\nEND:VCALENDAR\n')
+    assert get_config(conf_path) == config
+
+    os.makedirs(metavdirs + '/cal2/new')
+    with pytest.raises(AssertionError):
+        get_config(conf_path)
+    monkeypatch.setattr(khal.settings.settings, '_validate_config', validate_config)
+    assert 'new' in get_config(conf_path)['calendars']
+
+    # written in place, the vdir's directory doesn't change
+    monkeypatch.setattr(khal.settings.settings, '_validate_config', validate)
+    for key, value in [('color', 'dark red'), ('displayname', 'renamed')]:
+        with open(metavdirs + '/cal1/public/' + key, 'w') as metafile:
+            metafile.write(value)
+        with pytest.raises(AssertionError):
+            get_config(conf_path)
+        monkeypatch.setattr(khal.settings.settings, '_validate_config', validate_config)
+        get_config(conf_path)
+        monkeypatch.setattr(khal.settings.settings, '_validate_config', validate)
+    monkeypatch.setattr(khal.settings.settings, '_validate_config', validate_config)
+    assert get_config(conf_path)['calendars']['renamed']['color'] == 'dark red'
+
+    with open(conf_path, 'a') as conf:
+        conf.write('[view]\nevent_view_weighting = 2\n')
+    assert get_config(conf_path)['view']['event_view_weighting'] == 2
+    assert type(get_config(conf_path)) is dict
+
+
+def test_cached_config_environ(metavdirs, monkeypatch, xdg_cache_home):
+    """config files referencing environment variables are not cached"""
+    os.makedirs(xdg_cache_home)
+    conf_path = metavdirs + '/config'
+    with open(conf_path, 'w') as conf:
+        conf.write('[calendars]\n[[default]]\npath = $CALDIR/*\ntype = discover\n'
+                   '[sqlite]\npath = {}/khal.db\n'.format(metavdirs))
+    monkeypatch.setenv('CALDIR', metavdirs + '/cal1')
+
+    def paths():
+        config = get_config(conf_path)
+        assert type(config) is dict
+        return sorted(calendar['path'][len(metavdirs):]
+                      for calendar in config['calendars'].values())
+    assert paths() == ['/cal1/private', '/cal1/public']
+    monkeypatch.setenv('CALDIR', metavdirs + '/cal3')
+    assert paths() == ['/cal3/home', '/cal3/public', '/cal3/work']
+
+
 def test_is_color():
     assert is_color('dark blue') == 'dark blue'
     assert is_color('#123456') == '#123456'
@@ -1,7 +1,7 @@
 import datetime as dt
 
 from freezegun import freeze_time
-from khal.ui.calendarwidget import CalendarWidget
+from khal.ui.calendarwidget import KEEP_WEEKS, CalendarWidget
 
 on_press = {}
 
@@ -60,3 +60,27 @@ def test_set_focus_date_weekstart_6():
             day = today + dt.timedelta(days=diff)
             frame.set_focus_date(day)
             assert frame.focus_date == day
+
+
+def test_evict_weeks():
+    """weeks far from the focus are dropped and built again when needed"""
+    for firstweekday in [0, 6]:
+        frame = CalendarWidget(on_date_change=lambda _: None,
+                               keybindings=keybindings,
+                               on_press=on_press,
+                               firstweekday=firstweekday,
+                               weeknumbers='right',
+                               initial=dt.date(2017, 6, 7))
+        walker = frame.walker
+        days = [dt.date(2017, 6, 7) + dt.timedelta(days=7 * week) for week in range(160)]
+        for day in days + days[::-1]:
+            frame.set_focus_date(day)
+            assert frame.focus_date == day
+            assert len(walker) <= 2 * KEEP_WEEKS + 12
+            starts = [walker[row][1].date for row in range(len(walker))]
+            assert starts == [starts[0] + dt.timedelta(days=7 * row)
+                              for row in range(len(walker))]
+            if day == days[-1]:
+                assert walker.earliest_date > dt.date(2018, 6, 1)
+        assert walker.earliest_date <= dt.date(2017, 6, 1)
+        assert walker.latest_date < dt.date(2019, 1, 1)
@@ -2,9 +2,10 @@ import datetime as dt
 
 from freezegun import freeze_time
 
-from khal.ui import DayWalker, DListBox, StaticDayWalker
+from khal.khalendar.event import Event
+from khal.ui import KEEP_DAYS, PREFETCH_DAYS, DayWalker, DListBox, StaticDayWalker
 
-from ..utils import LOCALE_BERLIN
+from ..utils import LOCALE_BERLIN, cal1
 from .canvas_render import CanvasTranslator
 
 CONF = {'locale': LOCALE_BERLIN, 'keybindings': {},
@@ -88,3 +89,72 @@ def test_staticdaywalker_3(coll_vdirs):
     canvas = elistbox.render((50, 10), True)
     assert CanvasTranslator(canvas, palette).transform() == \
         '\x1b[34mToday (Wednesday, 07.06.2017)\x1b[0m\n\n\n\n\n\n\n\n\n\n'
+
+
+event_tomorrow = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:tomorrow
+SUMMARY:Tomorrow's event
+DTSTART;TZID=Europe/Berlin:20170608T100000
+DTEND;TZID=Europe/Berlin:20170608T110000
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@freeze_time('2017-6-7')
+def test_daywalker_prefetch(coll_vdirs):
+    collection, _ = coll_vdirs
+    collection.new(Event.fromString(event_tomorrow, locale=LOCALE_BERLIN), collection=cal1)
+    queries = list()
+    get_localized = collection.get_localized
+    collection.get_localized = lambda *args: queries.append(args) or get_localized(*args)
+    today = dt.date.today()
+    tomorrow = today + dt.timedelta(days=1)
+    conf = dict(CONF)
+    conf['view'] = dict(CONF['view'], agenda_event_format='{title}')
+
+    daywalker = DayWalker(today, None, conf, collection, delete_status=lambda recuid: False)
+    assert len(queries) == 1
+    assert [event.summary for event in daywalker._events_on(tomorrow)] == ["Tomorrow's event"]
+    daywalker.ensure_date(today + dt.timedelta(days=5))
+    assert len(queries) == 1
+    # the next days are fetched before they are shown
+    daywalker.ensure_date(today + dt.timedelta(days=8))
+    assert len(queries) == 2
+    assert today + dt.timedelta(days=8 + PREFETCH_DAYS) in daywalker._day_events
+
+    event = daywalker._events_on(tomorrow)[0]
+    event.update_summary('Changed')
+    collection.update(event)
+    daywalker.update_range(tomorrow, tomorrow)
+    assert len(queries) == 3
+    assert [event.summary for event in daywalker._events_on(tomorrow)] == ['Changed']
+
+
+@freeze_time('2017-6-7')
+def test_daywalker_evict(coll_vdirs):
+    collection, _ = coll_vdirs
+    collection.new(Event.fromString(event_tomorrow, locale=LOCALE_BERLIN), collection=cal1)
+    today = dt.date.today()
+    tomorrow = today + dt.timedelta(days=1)
+    conf = dict(CONF)
+    conf['view'] = dict(CONF['view'], agenda_event_format='{title}')
+    daywalker = DayWalker(today, None, conf, collection, delete_status=lambda recuid: False)
+
+    days = [today + dt.timedelta(days=number) for number in range(300)]
+    for day in days + days[::-1]:
+        daywalker.ensure_date(day)
+        assert daywalker.current_day == day
+        assert len(daywalker) <= 2 * KEEP_DAYS + 1
+        assert [one.date for one in daywalker] == \
+            [daywalker[0].date + dt.timedelta(days=number) for number in range(len(daywalker))]
+        if day == days[-1]:
+            assert daywalker[0].date > tomorrow
+            assert tomorrow not in daywalker._day_events
+    assert [event.summary for event in daywalker._events_on(tomorrow)] == ["Tomorrow's event"]
+    assert len(daywalker[(tomorrow - daywalker[0].date).days].original_widget.body) == 2
+
+    # far away days are not built one by one
+    daywalker.ensure_date(today + dt.timedelta(days=5 * 365))
+    assert len(daywalker) < 2 * KEEP_DAYS
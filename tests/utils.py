@@ -61,6 +61,22 @@ LOCALE_MIXED = LOCALE_BERLIN.copy()
 LOCALE_MIXED['local_timezone'] = BOGOTA
 
 
+# the layout of khal 0.9's dbs
+DB_VERSION_5 = [
+    'CREATE TABLE version (version INTEGER);',
+    'INSERT INTO version (version) VALUES (5);',
+    '''CREATE TABLE calendars (
+        calendar TEXT NOT NULL UNIQUE, resource TEXT NOT NULL, ctag TEXT);''',
+    '''CREATE TABLE events (
+        href TEXT NOT NULL, calendar TEXT NOT NULL, sequence INT, etag TEXT, item TEXT,
+        primary key (href, calendar));''',
+] + ['''CREATE TABLE {} (
+        dtstart INT NOT NULL, dtend INT NOT NULL, href TEXT NOT NULL REFERENCES events( href ),
+        rec_inst TEXT NOT NULL, ref TEXT NOT NULL, dtype INT NOT NULL, calendar TEXT NOT NULL,
+        primary key (href, rec_inst, calendar));'''.format(table)
+     for table in ['recs_loc', 'recs_float']]
+
+
 def normalize_component(x):
     x = icalendar.cal.Component.from_ical(x)
 
@@ -166,3 +166,19 @@ def test_get_weekday_occurrence():
     assert utils.get_weekday_occurrence(dt.date(2017, 5, 8)) == (0, 2)
     assert utils.get_weekday_occurrence(dt.date(2017, 5, 28)) == (6, 4)
     assert utils.get_weekday_occurrence(dt.date(2017, 5, 29)) == (0, 5)
+
+
+def test_merge_date_intervals():
+    assert utils.merge_date_intervals([]) == []
+    assert utils.merge_date_intervals([
+        (dt.date(2017, 3, 10), dt.date(2017, 3, 12)),
+        (dt.date(2017, 3, 1), dt.date(2017, 3, 1)),
+        (dt.date(2017, 3, 11), dt.date(2017, 3, 11)),
+        (dt.date(2017, 3, 13), dt.date(2017, 3, 14)),
+        (dt.date(2017, 3, 2), dt.date(2017, 3, 3)),
+        (dt.date(2017, 3, 20), dt.date(2017, 3, 20)),
+    ]) == [
+        (dt.date(2017, 3, 1), dt.date(2017, 3, 3)),
+        (dt.date(2017, 3, 10), dt.date(2017, 3, 14)),
+        (dt.date(2017, 3, 20), dt.date(2017, 3, 20)),
+    ]
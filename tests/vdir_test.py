@@ -86,3 +86,34 @@ def test_etag_sleep(tmpdir, sleep_time):
     new_etag = vdir.get_etag_from_file(fpath)
 
     assert old_etag != new_etag
+
+
+def test_etag_replaced(tmpdir):
+    """files atomically replaced within the mtime's resolution get a new etag"""
+    fpath = os.path.join(str(tmpdir), 'foo')
+    with open(fpath, 'w') as file_:
+        file_.write('foo')
+    old_etag = vdir.get_etag_from_file(fpath)
+    stat = os.stat(fpath)
+
+    with open(fpath + '.tmp', 'w') as file_:
+        file_.write('bar')
+    os.utime(fpath + '.tmp', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(fpath + '.tmp', fpath)
+
+    assert vdir.get_etag_from_file(fpath) != old_etag
+
+
+def test_list_without_fsync(tmpdir, monkeypatch):
+    """listing and reading a vdir doesn't sync anything to disk"""
+    vdir_ = vdir.Vdir(str(tmpdir), '.ics')
+    href, etag = vdir_.upload(vdir.Item('BEGIN:VEVENT\nUID:foo\nEND:VEVENT\n'))
+    tmpdir.join('other.txt').write('not an event')
+
+    def fsync(fd):
+        raise AssertionError('fsync called')
+    monkeypatch.setattr(os, 'fsync', fsync)
+    assert list(vdir_.list()) == [(href, etag)]
+    assert vdir_.get(href)[1] == etag
+    assert vdir.get_etag_from_file(os.path.join(str(tmpdir), href)) == etag
+    vdir.get_etag_from_file(str(tmpdir))
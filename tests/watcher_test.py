@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+from khal.khalendar.vdir import Item, Vdir
+from khal.khalendar.watcher import VdirWatcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                                reason='inotify is only available on Linux')
+
+EVENT = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:{}
+DTSTART;VALUE=DATE:20140909
+SUMMARY:a meeting
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.fixture
+def vdirs(tmpdir):
+    vdirs = dict()
+    for name in ['home', 'work']:
+        vdirs[name] = Vdir(str(tmpdir.mkdir(name)), '.ics')
+    return vdirs
+
+
+def test_watcher(vdirs):
+    watcher = VdirWatcher({name: (vdir.path, vdir.fileext) for name, vdir in vdirs.items()})
+    try:
+        assert watcher.read() == ({}, set())
+        href, etag = vdirs['home'].upload(Item(EVENT.format('one')))
+        vdirs['home'].update(href, Item(EVENT.format('one')), etag)
+        vdirs['work'].upload(Item(EVENT.format('two')))
+        with open(os.path.join(vdirs['work'].path, 'notes.txt'), 'w') as f:
+            f.write('not an event')
+        assert watcher.read() == ({'home': {'one.ics'}, 'work': {'two.ics'}}, set())
+        assert watcher.read() == ({}, set())
+
+        os.remove(os.path.join(vdirs['home'].path, 'one.ics'))
+        assert watcher.read() == ({'home': {'one.ics'}}, set())
+    finally:
+        watcher.close()
+
+
+def test_watcher_rescan(vdirs, tmpdir):
+    """calendars whose vdir was moved need to be checked completely"""
+    watcher = VdirWatcher({name: (vdir.path, vdir.fileext) for name, vdir in vdirs.items()})
+    try:
+        vdirs['home'].upload(Item(EVENT.format('one')))
+        os.rename(vdirs['home'].path, str(tmpdir.join('moved')))
+        assert watcher.read() == ({}, {'home'})
+    finally:
+        watcher.close()